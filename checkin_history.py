@@ -0,0 +1,71 @@
+# 履歴1ページあたりの件数
+PAGE_SIZE = 20
+# 履歴の表示に使う列だけを読む（request_id は送信待ちだった行との突き合わせ用）
+HISTORY_COLUMNS = "id, created_at, place, exp, request_id"
+
+
+def fetch_history_page(supabase, spell, before_id=None, limit=PAGE_SIZE) -> tuple:
+    """
+    じゅもんのチェックイン履歴を新しい順に limit 件読む（id によるキーセットページング）
+    before_id: 前のページの最後の id。省略すると最新から
+    戻り値: (行のリスト, 次のページの before_id。もう無ければ None)
+    """
+    query = supabase.table("records").select(HISTORY_COLUMNS).eq("spell", spell)
+    if before_id is not None:
+        query = query.lt("id", before_id)
+    rows = query.order("id", desc=True).limit(limit).execute().data
+    next_cursor = rows[-1]["id"] if len(rows) == limit else None
+    return rows, next_cursor
+
+
+class HistoryPager:
+    """
+    チェックイン履歴を新しい順に1ページずつ読み足していく
+    各行に、その時点までの累計経験値（running_total）を付ける
+    total_exp: 最新時点の累計経験値。pending: まだ送信待ちで records に無いチェックイン（新しい順）
+    送信待ちだった行が後から records に届いて読んだページに現れたら、同じチェックインとして差し替え、
+    経験値を二重に引かない
+    loaded: 最初のページを読んだか（rows は送信待ちの行だけで埋まっていることがあるので別に持つ）
+    """
+
+    def __init__(self, supabase, spell, total_exp, pending=(), page_size=PAGE_SIZE):
+        self.supabase = supabase
+        self.spell = spell
+        self.page_size = page_size
+        self.rows = []
+        self.cursor = None
+        self.done = False
+        self.loaded = False
+        self._running = total_exp
+        self._pending = {}  # request_id -> rows の中の位置
+        for row in pending:
+            if row.get("request_id"):
+                self._pending[row["request_id"]] = len(self.rows)
+            self._append_one(row)
+
+    def _append_one(self, row):
+        row = dict(row)
+        row["running_total"] = self._running
+        self._running -= row["exp"]
+        self.rows.append(row)
+
+    def _append(self, rows):
+        for row in rows:
+            i = self._pending.pop(row.get("request_id"), None) if row.get("request_id") else None
+            if i is None:
+                self._append_one(row)
+            else:
+                # 送信待ちとして表示していた行が届いた。位置と累計はそのままで中身だけ差し替える
+                self.rows[i] = dict(row, running_total=self.rows[i]["running_total"])
+
+    def load_more(self) -> list:
+        """次のページを読み、読み足した行を返す"""
+        if self.done:
+            return []
+        rows, self.cursor = fetch_history_page(self.supabase, self.spell, self.cursor, self.page_size)
+        self.loaded = True
+        if self.cursor is None:
+            self.done = True
+        start = len(self.rows)
+        self._append(rows)
+        return self.rows[start:]
@@ -0,0 +1,124 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 接続プールの大きさ。annulus 検索や search_many は同時に複数本の接続を使う
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "4"))   # 接続先ホストごとのプール数
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "16"))          # 1ホストあたり使い回す接続数
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "16"))
+# Google の上限（OVER_QUERY_LIMIT）に達したら待って再試行せず、すぐ ApiError にして呼び出し側の代替手段に任せる
+# それ以外の再試行もこの秒数で打ち切る（既定の 60 秒だと、相乗りしたセッションが先に TimeoutError になる）
+GMAPS_RETRY_TIMEOUT = int(os.getenv("GMAPS_RETRY_TIMEOUT", "10"))
+
+_clients = {}
+_counters = {}   # クライアント名 -> {'requests': 件数, 'connections': 見かけた接続の集合}
+_lock = threading.Lock()
+
+
+def _get(name, key, factory):
+    """(name, key) ごとにクライアントを1つだけ作って使い回す"""
+    with _lock:
+        client = _clients.get((name, key))
+        if client is None:
+            client = factory()
+            _clients[(name, key)] = client
+        return client
+
+
+def pooled_session() -> requests.Session:
+    """keep-alive の接続プールを持つ requests.Session を返す"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _count_httpx(name, client):
+    """httpx.Client のリクエスト数と、使われた接続の数を数えるフックを付ける"""
+    counter = _counters.setdefault(name, {"requests": 0, "connections": set()})
+
+    def on_response(response):
+        counter["requests"] += 1
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        for conn in getattr(pool, "connections", []):
+            counter["connections"].add(id(conn))
+
+    hooks = dict(client.event_hooks)
+    hooks["response"] = list(hooks.get("response", [])) + [on_response]
+    client.event_hooks = hooks
+
+
+def get_gmaps(key=None):
+    """Google Maps のクライアント（プロセスで1つ）"""
+    from googlemaps import Client as GoogleMaps
+    key = key or os.getenv("GOOGLE_MAPS_API_KEY")
+
+    def make():
+        client = GoogleMaps(key=key, retry_over_query_limit=False, retry_timeout=GMAPS_RETRY_TIMEOUT)
+        client.session = pooled_session()
+        return client
+    return _get("gmaps", key, make)
+
+
+def get_openai(api_key=None):
+    """OpenAI のクライアント（プロセスで1つ）"""
+    import httpx
+    from openai import OpenAI, DefaultHttpxClient
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+
+    def make():
+        http_client = DefaultHttpxClient(limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+        ))
+        _count_httpx("openai", http_client)
+        return OpenAI(api_key=api_key, http_client=http_client)
+    return _get("openai", api_key, make)
+
+
+def get_supabase(url=None, key=None):
+    """Supabase のクライアント（プロセスで1つ）。中の PostgREST の接続はこのクライアントの間使い回される"""
+    from supabase import create_client
+    url = url or os.getenv("SUPABASE_URL")
+    key = key or os.getenv("SUPABASE_KEY")
+
+    def make():
+        client = create_client(url, key)
+        session = getattr(client.postgrest, "session", None)
+        if session is not None:
+            _count_httpx("supabase", session)
+        return client
+    return _get("supabase", (url, key), make)
+
+
+def connection_stats() -> dict:
+    """
+    クライアントごとのリクエスト数と新しく張った接続の数。reused は接続を使い回したリクエスト数
+    """
+    stats = {}
+    with _lock:
+        clients = dict(_clients)
+    for (name, _), client in clients.items():
+        if name == "gmaps":
+            requests_n = connections_n = 0
+            # http:// と https:// に同じアダプタを付けているので重複を除く
+            adapters = {id(a): a for a in client.session.adapters.values()}.values()
+            for adapter in adapters:
+                pools = adapter.poolmanager.pools
+                for pool_key in list(pools.keys()):
+                    pool = pools.get(pool_key)
+                    if pool is not None:
+                        requests_n += pool.num_requests
+                        connections_n += pool.num_connections
+        else:
+            counter = _counters.get(name, {"requests": 0, "connections": set()})
+            requests_n, connections_n = counter["requests"], len(counter["connections"])
+        entry = stats.setdefault(name, {"requests": 0, "connections": 0})
+        entry["requests"] += requests_n
+        entry["connections"] += connections_n
+    for entry in stats.values():
+        entry["reused"] = max(0, entry["requests"] - entry["connections"])
+    return stats
@@ -0,0 +1,73 @@
+import os
+
+# 経験値 100 ごとにレベルが 1 上がる
+EXP_PER_LEVEL = 100
+
+# spell_stats の行が無いじゅもん（まだチェックインしていない）の値
+EMPTY_STATS = {"total_exp": 0, "level": 0, "visits": 0}
+
+
+def _first(data):
+    # rpc の戻り値は複合型1つでも、ライブラリの版によって辞書かリストで返ってくる
+    if isinstance(data, list):
+        return data[0] if data else None
+    return data
+
+
+def get_stats(supabase, spell) -> dict:
+    """
+    spell_stats からじゅもんの累計経験値・レベル・チェックイン回数を1行だけ読む
+    records の件数に関係なく1回の主キー検索で済む
+    """
+    response = supabase.table("spell_stats").select("total_exp, level, visits").eq("spell", spell).limit(1).execute()
+    row = _first(response.data)
+    return dict(row) if row else dict(EMPTY_STATS)
+
+
+def record_checkin(supabase, spell, place, exp) -> dict:
+    """
+    records への追加と spell_stats の更新を record_checkin 関数（sql/spell_stats.sql）で同時に行う
+    戻り値: 更新後の {'total_exp', 'level', 'visits'}
+    """
+    response = supabase.rpc("record_checkin", {"p_spell": spell, "p_place": place, "p_exp": exp}).execute()
+    row = _first(response.data) or {}
+    return {k: row.get(k, EMPTY_STATS[k]) for k in EMPTY_STATS}
+
+
+def record_checkins(supabase, rows) -> int:
+    """
+    複数のチェックインを record_checkins 関数（sql/record_checkins.sql）でまとめて書き込む
+    rows: {'request_id', 'spell', 'place', 'exp'} のリスト。request_id が同じ行は二重に入らない
+    戻り値: 新しく追加された行数
+    """
+    response = supabase.rpc("record_checkins", {"p_rows": rows}).execute()
+    return _first(response.data) or 0
+
+
+def rebuild(supabase, spell=None) -> int:
+    """
+    records から spell_stats を作り直す（集計がずれたときの復旧用）
+    spell を省略すると全員分。戻り値は更新した行数
+    """
+    response = supabase.rpc("rebuild_spell_stats", {"p_spell": spell}).execute()
+    return _first(response.data) or 0
+
+
+# 集計の作り直し用 CLI
+if __name__ == '__main__':
+    import argparse
+    from dotenv import load_dotenv
+    from clients import get_supabase
+
+    parser = argparse.ArgumentParser(description="spell_stats を records から作り直す")
+    parser.add_argument('--spell', help="作り直すじゅもん（省略すると全員分）")
+    args = parser.parse_args()
+
+    load_dotenv()
+    url = os.getenv("SUPABASE_URL")
+    key = os.getenv("SUPABASE_KEY")
+    if not url or not key:
+        raise RuntimeError("ERROR: 環境変数 SUPABASE_URL / SUPABASE_KEY が設定されていません。")
+
+    n = rebuild(get_supabase(url, key), args.spell)
+    print(f"{n} 件のじゅもんの集計を作り直しました")
@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+
+import exp_stats
+from storage import utc_timestamp
+
+# この秒数ごとに、他のプロセスで更新された spell_stats の行を読み足す
+REFRESH_INTERVAL = 30
+FETCH_PAGE_SIZE = 1000
+# updated_at はトランザクション開始時刻なので、後からコミットされた行が watermark より前の時刻を持つことがある
+# 毎回 watermark のこの秒数前から読み直す（同じ行をもう一度 update() しても結果は変わらない）
+REFRESH_OVERLAP = 10  # 秒
+# 表示名を status から引くときに1回で問い合わせるじゅもんの数
+LABEL_CHUNK_SIZE = 200
+# status にまだ見つからないじゅもんの表示名
+UNKNOWN_LABEL = "名もなき勇者"
+
+
+def hero_label(status_id) -> str:
+    """
+    ランキングに出す表示名。じゅもんはログインに使う秘密なので画面には出さず、status の id から作る
+    """
+    return f"勇者No.{status_id}"
+
+
+class Leaderboard:
+    """
+    じゅもんを累計経験値の高い順に並べたランキング
+    (-経験値, じゅもん) を常に並んだ状態のリストで持ち、二分探索で
+    上位 N 件は O(log n + N)、順位は O(log n) で答える
+    update() は位置を二分探索で探すが、リストの途中への挿入・削除で後ろの要素をずらすので O(n)
+    （数万人までならメモリの移動だけで済み、全件を並べ直すより十分速い）
+    チェックインのたびに update() で1人分だけ差し替え、他のプロセスの更新は
+    spell_stats.updated_at が新しい行だけを refresh() で読み足す
+    じゅもんはこのクラスの中だけで使い、top() は表示名（hero_label）で返す
+    """
+
+    def __init__(self, refresh_interval=REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._scores = {}    # じゅもん -> 累計経験値
+        self._order = []     # (-累計経験値, じゅもん) の昇順
+        self._labels = {}    # じゅもん -> 表示名
+        self._watermark = None
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._order)
+
+    def update(self, spell, total_exp):
+        """じゅもんの累計経験値を total_exp にする"""
+        with self._lock:
+            self._set(spell, total_exp)
+
+    def _set(self, spell, total_exp):
+        # self._lock を持って呼ぶ
+        old = self._scores.get(spell)
+        if old == total_exp:
+            return
+        if old is not None:
+            i = bisect_left(self._order, (-old, spell))
+            del self._order[i]
+        self._scores[spell] = total_exp
+        insort(self._order, (-total_exp, spell))
+
+    def top(self, n=10, reveal=False) -> list:
+        """
+        上位 n 件を [{'rank', 'name', 'total_exp'}, ...] で返す（同じ経験値は同じ順位）
+        reveal=True のときだけ 'spell' も付ける（管理用 CLI 専用。画面に出してはいけない）
+        """
+        with self._lock:
+            head = self._order[:n]
+            result = []
+            for neg, spell in head:
+                entry = {
+                    "rank": bisect_left(self._order, (neg,)) + 1,
+                    "name": self._labels.get(spell, UNKNOWN_LABEL),
+                    "total_exp": -neg,
+                }
+                if reveal:
+                    entry["spell"] = spell
+                result.append(entry)
+            return result
+
+    def rank_of(self, spell):
+        """じゅもんの順位（1 位から）。ランキングにいなければ None"""
+        with self._lock:
+            score = self._scores.get(spell)
+            if score is None:
+                return None
+            return bisect_left(self._order, (-score,)) + 1
+
+    def refresh(self, supabase) -> int:
+        """
+        前回から更新された spell_stats の行だけを読み、ランキングに反映する
+        初回は全行を読む。2回目からは watermark の REFRESH_OVERLAP 秒前から読み直す
+        ページの境目は updated_at 以上で読み直すので、同じ時刻の行を取りこぼさない
+        戻り値は読んだ行数（読み直した行も数える）
+        """
+        count = 0
+        with self._lock:
+            start = None if self._watermark is None else _shift(self._watermark, -REFRESH_OVERLAP)
+        page_size = FETCH_PAGE_SIZE
+        while True:
+            query = supabase.table("spell_stats").select("spell, total_exp, updated_at").order("updated_at")
+            if start is not None:
+                query = query.gte("updated_at", start)
+            rows = query.limit(page_size).execute().data
+            # 読んでいる間はロックを持たず、読んだページを反映するときだけ持つ（top() や rank_of() が途中の状態を見ない）
+            with self._lock:
+                for row in rows:
+                    self._set(row["spell"], row["total_exp"])
+                if rows and (self._watermark is None or rows[-1]["updated_at"] > self._watermark):
+                    self._watermark = rows[-1]["updated_at"]
+            count += len(rows)
+            if len(rows) < page_size:
+                break
+            if rows[0]["updated_at"] == rows[-1]["updated_at"]:
+                # 1ページ全部が同じ時刻だと次のページに進めないので、ページを広げて読み直す
+                page_size *= 2
+                continue
+            start = rows[-1]["updated_at"]
+            page_size = FETCH_PAGE_SIZE
+        self._load_labels(supabase)
+        self._refreshed_at = time.time()
+        return count
+
+    def _load_labels(self, supabase):
+        """表示名がまだ無いじゅもんの status の id を引いて、表示名を付ける"""
+        with self._lock:
+            missing = [spell for spell in self._scores if spell not in self._labels]
+        for i in range(0, len(missing), LABEL_CHUNK_SIZE):
+            chunk = missing[i:i + LABEL_CHUNK_SIZE]
+            rows = supabase.table("status").select("id, spell").in_("spell", chunk).execute().data
+            with self._lock:
+                for row in rows:
+                    self._labels[row["spell"]] = hero_label(row["id"])
+
+    def refresh_if_due(self, supabase):
+        if time.time() - self._refreshed_at > self.refresh_interval:
+            self.refresh(supabase)
+
+    def rebuild(self, supabase) -> int:
+        """
+        records から spell_stats を作り直し、ランキングを最初から読み直す（復旧用）
+        戻り値はランキングに載ったじゅもんの数
+        """
+        exp_stats.rebuild(supabase)
+        with self._lock:
+            self._scores.clear()
+            self._order.clear()
+            self._labels.clear()
+            self._watermark = None
+        self.refresh(supabase)
+        return len(self)
+
+
+def _shift(timestamp, seconds) -> str:
+    """ISO 形式の時刻を seconds 秒ずらし、storage.utc_timestamp の形で返す（SQLite では文字列のまま比べるので）"""
+    return utc_timestamp(datetime.fromisoformat(timestamp) + timedelta(seconds=seconds))
+
+
+# ランキングの作り直し用 CLI
+if __name__ == '__main__':
+    import argparse
+    from dotenv import load_dotenv
+    from storage import get_storage
+
+    parser = argparse.ArgumentParser(description="ランキング")
+    parser.add_argument('--rebuild', action='store_true', help="records から集計とランキングを作り直す")
+    parser.add_argument('--top', type=int, default=10, help="表示する件数")
+    args = parser.parse_args()
+
+    load_dotenv()
+    storage = get_storage(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+    board = Leaderboard()
+    if args.rebuild:
+        print(f"{board.rebuild(storage)} 人分のランキングを作り直しました")
+    else:
+        board.refresh(storage)
+    for entry in board.top(args.top, reveal=True):
+        print(f"{entry['rank']}. {entry['name']} {entry['spell']} ({entry['total_exp']} EXP)")
@@ -0,0 +1,217 @@
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from scraper import PlaceBatch, haversine_batch, normalize_keyword
+
+# 格子1マスの大きさ（度）。0.01度 ≒ 1km なので 2km までのリング検索は数マスで済む
+CELL_DEG = 0.01
+# Supabase から1回に取ってくる行数
+FETCH_PAGE_SIZE = 1000
+# 書き換え・削除された行も反映するため、この秒数ごとにテーブル全体を読み直す（0 なら毎回増えた行だけ）
+RELOAD_INTERVAL = int(os.getenv("PLACE_INDEX_RELOAD_INTERVAL", "600"))
+
+
+class PlaceIndex:
+    """
+    Supabase の place テーブルの行をメモリ上の格子（グリッド）で管理する空間インデックス
+    Google を呼ばずに「この座標から 500〜1000m の場所」や「近い順に k 件」を答える
+    行は id をキーに持ち、upsert() / remove() で1行ずつ差し替えられる
+    refresh() は増えた行だけを読み足し、reload_interval 秒ごとにテーブル全体を読み直す
+    （id の増えない書き換えや削除は、読み直したときに反映される）
+    """
+
+    def __init__(self, cell_deg=CELL_DEG, reload_interval=RELOAD_INTERVAL):
+        self.cell_deg = cell_deg
+        self.reload_interval = reload_interval
+        self._rows = {}    # id -> 行
+        self._cells = {}   # (i, j) -> id の集合
+        self._cell_of = {} # id -> (i, j)
+        self._last_id = None
+        self._loaded_at = None
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+
+    def upsert(self, rows):
+        """行を追加する。同じ id があれば置き換える。lat / lon が無い行は無視する"""
+        with self._lock:
+            for row in rows:
+                row_id = row.get("id", (row.get("name"), row.get("lat"), row.get("lon")))
+                self._discard(row_id)
+                if row.get("lat") is None or row.get("lon") is None:
+                    continue
+                cell = self._cell(float(row["lat"]), float(row["lon"]))
+                self._rows[row_id] = row
+                self._cells.setdefault(cell, set()).add(row_id)
+                self._cell_of[row_id] = cell
+                if isinstance(row.get("id"), int) and (self._last_id is None or row["id"] > self._last_id):
+                    self._last_id = row["id"]
+
+    def remove(self, ids):
+        with self._lock:
+            for row_id in ids:
+                self._discard(row_id)
+
+    def _discard(self, row_id):
+        cell = self._cell_of.pop(row_id, None)
+        if cell is None:
+            return
+        del self._rows[row_id]
+        ids = self._cells[cell]
+        ids.discard(row_id)
+        if not ids:
+            del self._cells[cell]
+
+    def refresh(self, supabase):
+        """
+        前回読み込んだ最大 id より後の行だけを place テーブルから読み込む
+        初回と、前回の全体の読み込みから reload_interval 秒たったときは reload() する。戻り値は読み込んだ行数
+        """
+        if self._loaded_at is None or (self.reload_interval and time.time() - self._loaded_at >= self.reload_interval):
+            return self.reload(supabase)
+        count = 0
+        for rows in _fetch_pages(supabase, self._last_id):
+            self.upsert(rows)
+            count += len(rows)
+        return count
+
+    def reload(self, supabase):
+        """
+        place テーブル全体を読み直して置き換える。戻り値は読み込んだ行数
+        読み込みは別のインデックスに行い、終わってから入れ替えるので、その間も検索できる
+        """
+        fresh = PlaceIndex(self.cell_deg, self.reload_interval)
+        loaded_at = time.time()
+        for rows in _fetch_pages(supabase, None):
+            fresh.upsert(rows)
+        with self._lock:
+            self._rows, self._cells, self._cell_of = fresh._rows, fresh._cells, fresh._cell_of
+            self._last_id = fresh._last_id
+            self._loaded_at = loaded_at
+        return len(fresh)
+
+    def locate(self, area):
+        """
+        area（'博多駅' など）の行の座標の平均を (lat, lon) で返す。行が無ければ None
+        Google でジオコーディングできないときの出発地の代わりに使う
+        """
+        key = normalize_keyword(area)
+        with self._lock:
+            rows = [r for r in self._rows.values() if r.get("area") and normalize_keyword(r["area"]) == key]
+        if not rows:
+            return None
+        return (sum(float(r["lat"]) for r in rows) / len(rows),
+                sum(float(r["lon"]) for r in rows) / len(rows))
+
+    def _candidates(self, cells, mood):
+        ids = []
+        for cell in cells:
+            ids.extend(self._cells.get(cell, ()))
+        rows = [self._rows[i] for i in ids]
+        if mood is not None:
+            rows = [r for r in rows if r.get("mood") == mood]
+        return rows
+
+    def _distances(self, rows, base_lat, base_lon):
+        lats = np.fromiter((float(r["lat"]) for r in rows), dtype=np.float64, count=len(rows))
+        lons = np.fromiter((float(r["lon"]) for r in rows), dtype=np.float64, count=len(rows))
+        return haversine_batch(base_lat, base_lon, lats, lons)
+
+    def _cells_within(self, base_lat, base_lon, radius):
+        """出発地から radius メートルの円に掛かる格子マスを列挙する"""
+        dlat = math.degrees(radius / 6371000)
+        dlon = dlat / max(math.cos(math.radians(base_lat)), 1e-6)
+        i0, j0 = self._cell(base_lat - dlat, base_lon - dlon)
+        i1, j1 = self._cell(base_lat + dlat, base_lon + dlon)
+        return [(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+
+    def ring(self, base_lat, base_lon, time_min, time_max, mood=None, limit=None):
+        """
+        出発地からの距離が [time_min, time_max] の行を近い順に (行, 距離) のリストで返す
+        """
+        with self._lock:
+            rows = self._candidates(self._cells_within(base_lat, base_lon, time_max), mood)
+        if not rows:
+            return []
+        dists = self._distances(rows, base_lat, base_lon)
+        idx = np.flatnonzero((dists >= time_min) & (dists <= time_max))
+        idx = idx[np.argsort(dists[idx], kind="stable")]
+        if limit is not None:
+            idx = idx[:limit]
+        return [(rows[i], float(dists[i])) for i in idx]
+
+    def nearest(self, base_lat, base_lon, k=5, mood=None):
+        """
+        出発地に近い順に k 件の (行, 距離) を返す
+        出発地のマスから外側へ1周ずつ広げ、k 件目までの距離がまだ見ていないマスより近いと確定したら止める
+        """
+        with self._lock:
+            if not self._cells:
+                return []
+            ci, cj = self._cell(base_lat, base_lon)
+            max_r = max(max(abs(i - ci), abs(j - cj)) for i, j in self._cells)
+            # 1マスの短い辺（経度方向）の長さ。r 周目までに見た範囲は少なくとも r * これだけ離れている
+            cell_m = self.cell_deg * math.pi / 180 * 6371000 * math.cos(math.radians(base_lat))
+            rows = []
+            for r in range(max_r + 1):
+                ring_cells = [(ci + di, cj + dj) for di in range(-r, r + 1) for dj in range(-r, r + 1)
+                              if max(abs(di), abs(dj)) == r]
+                rows.extend(self._candidates(ring_cells, mood))
+                if len(rows) >= k:
+                    dists = self._distances(rows, base_lat, base_lon)
+                    if np.partition(dists, k - 1)[k - 1] <= r * cell_m:
+                        break
+        if not rows:
+            return []
+        dists = self._distances(rows, base_lat, base_lon)
+        idx = np.argsort(dists, kind="stable")[:k]
+        return [(rows[i], float(dists[i])) for i in idx]
+
+    def search_ring(self, mood, time_min, time_max, base_lat, base_lon, limit=5) -> list:
+        """
+        scraper.search_places_by_coords と同じ形の場所情報リストを返す
+        """
+        return self.search_ring_batch(mood, time_min, time_max, base_lat, base_lon, limit).to_dicts()
+
+    def search_ring_batch(self, mood, time_min, time_max, base_lat, base_lon, limit=5) -> PlaceBatch:
+        """
+        search_ring() の結果を辞書にせず PlaceBatch で返す
+        """
+        hits = self.ring(base_lat, base_lon, time_min, time_max, mood=mood, limit=limit)
+        return PlaceBatch(
+            [row.get("name") for row, _ in hits],
+            [row.get("vicinity") or row.get("area") or "" for row, _ in hits],
+            [float(row["lat"]) for row, _ in hits],
+            [float(row["lon"]) for row, _ in hits],
+            [int(dist) for _, dist in hits],
+            [row.get("place_id") for row, _ in hits],
+        )
+
+
+def _fetch_pages(supabase, after_id):
+    """place テーブルの after_id より後の行を id 順に FETCH_PAGE_SIZE 件ずつ返す"""
+    while True:
+        query = supabase.table("place").select("*").order("id")
+        if after_id is not None:
+            query = query.gt("id", after_id)
+        rows = query.limit(FETCH_PAGE_SIZE).execute().data
+        if rows:
+            yield rows
+            after_id = rows[-1]["id"]
+        if len(rows) < FETCH_PAGE_SIZE:
+            return
+
+
+def load_place_index(supabase) -> PlaceIndex:
+    """place テーブル全体を読み込んだ PlaceIndex を返す"""
+    index = PlaceIndex()
+    index.refresh(supabase)
+    return index
@@ -0,0 +1,377 @@
+# scraper の検索結果を place テーブル（search_shops が読む表）へまとめて入れるパイプライン
+#
+#     行を読む（スナップショット / その場で検索） → 正規化 → 重複除去 → batch_size 件ずつ upsert
+#
+# 行はジェネレータで1件ずつ流すので、件数が多くてもメモリに全部は載せない
+# upsert のたびに「入力の何件目まで書き終えたか」（その場で検索するときは「どの検索まで書き終えたか」）を
+# チェックポイントファイルに書くので、途中で止まっても同じ入力なら続きから再開できる
+# （書き直しになる行も dedupe_key で上書きされるだけ）
+# 手で登録した既存の行（dedupe_key も place_id も無い）は、気分と名前が同じで近くにあれば同じ場所とみなし、
+# 新しい行を足す代わりにその行へ place_id と dedupe_key を書き足す
+#
+# 書き込みのたびにこのプロセスの shop_planner のキャッシュは消す
+# 動いているアプリ（別のプロセス）には再起動しなくても反映されるが、すぐではない
+#     search_shops の結果: PLAN_CACHE_TTL 秒（shop_planner.py）以内
+#     地図の近くの場所（place_index）: 既存の行の書き足しは PLACE_INDEX_RELOAD_INTERVAL 秒ごとの読み直しで反映される
+#     （新しい行は次の refresh() で読み足される）
+import json
+import math
+import os
+import sys
+import unicodedata
+from urllib.parse import quote
+
+from shop_planner import shop_planner
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+INGEST_CHECKPOINT_PATH = os.getenv("INGEST_CHECKPOINT_PATH", os.path.join(".cache", "place_ingest.json"))
+# geohash の桁数。7桁で約 150m 四方。place_id の無い行はこのマス + 名前で同じ場所とみなす
+GEOHASH_PRECISION = 7
+# 座標は小数点以下 6 桁（約 10cm）に丸めて保存する
+COORD_DIGITS = 6
+# 既存の行と同じ場所とみなす距離（メートル）
+MATCH_RADIUS = 150
+FETCH_PAGE_SIZE = 1000
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash(lat, lon, precision=GEOHASH_PRECISION) -> str:
+    """緯度経度を geohash の文字列にする"""
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    chars = []
+    bits = 0
+    n = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            bit = lon >= mid
+            lon_lo, lon_hi = (mid, lon_hi) if bit else (lon_lo, mid)
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            bit = lat >= mid
+            lat_lo, lat_hi = (mid, lat_hi) if bit else (lat_lo, mid)
+        bits = (bits << 1) | bit
+        n += 1
+        even = not even
+        if n == 5:
+            chars.append(_BASE32[bits])
+            bits = n = 0
+    return "".join(chars)
+
+
+def normalize_name(name) -> str:
+    """全角・半角や空白の違いをなくした名前（重複判定用）"""
+    return " ".join(unicodedata.normalize("NFKC", name or "").split()).lower()
+
+
+def dedupe_key(row) -> str:
+    """
+    同じ場所かどうかの判定に使うキー。place_id があればそれ、無ければ geohash + 正規化した名前
+    place は気分ごとに行を持つので、気分もキーに含める
+    """
+    ident = row.get("place_id") or f"{geohash(row['lat'], row['lon'])}:{normalize_name(row['name'])}"
+    return f"{row['mood']}|{ident}"
+
+
+def maps_url(name, place_id=None) -> str:
+    """Google マップでその場所を開く URL"""
+    url = f"https://www.google.com/maps/search/?api=1&query={quote(name)}"
+    if place_id:
+        url += f"&query_place_id={quote(place_id)}"
+    return url
+
+
+def normalize_row(spot, mood, area, minutes=None):
+    """
+    scraper の場所情報（name, lat, lon, place_id, ...）を place テーブルの行にする
+    名前や座標が無い行は None を返す
+    """
+    name = " ".join(unicodedata.normalize("NFKC", spot.get("name") or "").split())
+    if not name or spot.get("lat") is None or spot.get("lon") is None:
+        return None
+    row = {
+        "name": name,
+        "url": spot.get("url") or maps_url(name, spot.get("place_id")),
+        "lat": round(float(spot["lat"]), COORD_DIGITS),
+        "lon": round(float(spot["lon"]), COORD_DIGITS),
+        "mood": mood,
+        "area": area,
+        "time": f"{minutes}分" if minutes is not None else None,
+        "place_id": spot.get("place_id"),
+    }
+    row["dedupe_key"] = dedupe_key(row)
+    return row
+
+
+def iter_snapshot(snapshot):
+    """
+    scraper.precompute() のスナップショットから place の行を1件ずつ返す
+    並び順は毎回同じなので、チェックポイントから再開できる
+    """
+    from scraper import SNAPSHOT_FIELDS
+    fields = snapshot.get("fields", SNAPSHOT_FIELDS)
+    labels = snapshot.get("labels", {})
+    for key in sorted(snapshot["results"]):
+        origin, mood, minutes = key.split("|")
+        area = labels.get(origin, origin)
+        for values in snapshot["results"][key]:
+            yield normalize_row(dict(zip(fields, values)), mood, area, int(minutes))
+
+
+def query_key(origin, mood, band) -> str:
+    """その場で検索するときの1つの検索（出発地, 気分, 時間帯）を表す文字列。チェックポイントに書く"""
+    return json.dumps([origin, mood, band], ensure_ascii=False)
+
+
+def iter_search(origins, moods=None, bands=None, mode="annulus", limit=None, skip=()):
+    """
+    scraper.search_many でその場で検索し、終わった検索から順に (query_key, place の行のリスト) を返す
+    並び順は毎回変わるので、再開するときは skip に書き終えた検索の query_key を渡して読み飛ばす
+    失敗した検索は返さない（次に動かしたときにもう一度検索する）
+    """
+    import scraper
+    moods = moods or scraper.KEYWORDS
+    bands = bands or tuple(scraper.TIME_BANDS)
+    queries = [(o, m, b) for o in origins for m in moods for b in bands if query_key(o, m, b) not in skip]
+    for r in scraper.search_many(origins, moods, bands, mode=mode, limit=limit, queries=queries):
+        if r["error"] is not None:
+            print(f"失敗: {r['origin']} {r['mood']} {r['band']}分: {r['error']}", file=sys.stderr)
+            continue
+        area = r["origin"] if isinstance(r["origin"], str) else None
+        minutes = r["band"] if r["band"] in scraper.TIME_BANDS else None
+        rows = [normalize_row(spot, r["mood"], area, minutes) for spot in r["places"]]
+        yield query_key(r["origin"], r["mood"], r["band"]), rows
+
+
+def _distance_m(lat1, lon1, lat2, lon2):
+    R = 6371000
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2)**2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2)**2
+    return 2 * R * math.asin(math.sqrt(a))
+
+
+class ExistingPlaces:
+    """
+    place テーブルにすでにある行のうち、重複判定に要るものをメモリに持つ
+    keys: 使われている dedupe_key
+    unkeyed: place_id の無い行を (気分, 正規化した名前) ごとにまとめたもの（手で登録した行など）
+    """
+
+    def __init__(self):
+        self.keys = set()
+        self.unkeyed = {}
+
+    @classmethod
+    def load(cls, supabase, page_size=FETCH_PAGE_SIZE):
+        existing = cls()
+        last_id = None
+        while True:
+            query = supabase.table("place").select("*")
+            if last_id is not None:
+                query = query.gt("id", last_id)
+            rows = query.order("id").limit(page_size).execute().data
+            for row in rows:
+                existing.add(row)
+            if len(rows) < page_size:
+                return existing
+            last_id = rows[-1]["id"]
+
+    def add(self, row):
+        if row.get("dedupe_key"):
+            self.keys.add(row["dedupe_key"])
+        if not row.get("place_id") and row.get("lat") is not None and row.get("lon") is not None:
+            self.unkeyed.setdefault((row.get("mood"), normalize_name(row.get("name"))), []).append(row)
+
+    def match(self, row):
+        """
+        row と同じ場所の既存の行（気分と名前が同じで MATCH_RADIUS 以内にあり、dedupe_key の違うもの）を返す
+        見つかった行は1度しか返さない。row の dedupe_key がすでに使われていれば upsert で上書きされるので None
+        """
+        if row["dedupe_key"] in self.keys:
+            return None
+        candidates = self.unkeyed.get((row["mood"], normalize_name(row["name"])), [])
+        best, best_dist = None, MATCH_RADIUS
+        for other in candidates:
+            dist = _distance_m(row["lat"], row["lon"], float(other["lat"]), float(other["lon"]))
+            if other.get("dedupe_key") != row["dedupe_key"] and dist <= best_dist:
+                best, best_dist = other, dist
+        if best is not None:
+            candidates.remove(best)
+        return best
+
+
+class _Writer:
+    """ingest() と ingest_search() で共通の、重複を除いて batch_size 件ずつ upsert する部分"""
+
+    def __init__(self, supabase, batch_size):
+        self.supabase = supabase
+        self.batch_size = batch_size
+        self.existing = ExistingPlaces.load(supabase)
+        self.stats = {"read": 0, "skipped": 0, "duplicates": 0, "matched": 0, "written": 0, "batches": 0}
+        self.seen = set()
+        self.batch = []
+        self.adopted = []
+
+    def add(self, row):
+        self.stats["read"] += 1
+        if row is None:
+            self.stats["skipped"] += 1
+            return
+        if row["dedupe_key"] in self.seen:
+            self.stats["duplicates"] += 1
+            return
+        self.seen.add(row["dedupe_key"])
+        match = self.existing.match(row)
+        if match is None:
+            self.batch.append(row)
+            return
+        # 既存の行はそのまま残し、place_id と dedupe_key だけを書き足す
+        self.stats["matched"] += 1
+        self.adopted.append(dict(match, place_id=row["place_id"], dedupe_key=row["dedupe_key"]))
+
+    def full(self) -> bool:
+        return len(self.batch) + len(self.adopted) >= self.batch_size
+
+    def flush(self):
+        if not self.adopted and not self.batch:
+            return
+        if self.adopted:
+            self.supabase.table("place").upsert(self.adopted, on_conflict="id").execute()
+            self.stats["written"] += len(self.adopted)
+            self.stats["batches"] += 1
+            self.adopted = []
+        if self.batch:
+            self.supabase.table("place").upsert(self.batch, on_conflict="dedupe_key").execute()
+            self.stats["written"] += len(self.batch)
+            self.stats["batches"] += 1
+            self.batch = []
+        # 書いた行がこのプロセスの search_shops の結果にすぐ出るように
+        shop_planner.invalidate()
+
+
+def load_checkpoint(path) -> dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"done": 0, "written": 0}
+
+
+def save_checkpoint(path, checkpoint):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 書き込み途中のファイルを読まれないように、一時ファイルに書いてから置き換える
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, path)
+
+
+def ingest(supabase, rows, batch_size=INGEST_BATCH_SIZE, checkpoint_path=None, source=None) -> dict:
+    """
+    rows（normalize_row の結果を流すイテラブル。None は読み飛ばす）を place テーブルへ upsert する
+    dedupe_key が同じ行は最初の1件だけを書き、既存の行と同じ場所ならその行に書き足す
+    checkpoint_path を渡すと、そこに記録された件数だけ入力を読み飛ばしてから始め、
+    upsert のたびに書き終えた位置を記録する
+    source: 入力を見分ける値（スナップショットの created_at など）。チェックポイントと違えば最初から読む
+    戻り値: {'read', 'skipped', 'duplicates', 'matched', 'written', 'batches'}
+    """
+    checkpoint = load_checkpoint(checkpoint_path) if checkpoint_path else {"done": 0, "written": 0}
+    if checkpoint.get("source") != source:
+        checkpoint = {"done": 0, "written": 0}
+    writer = _Writer(supabase, batch_size)
+
+    def flush(done):
+        writer.flush()
+        if checkpoint_path:
+            save_checkpoint(checkpoint_path, {
+                "source": source,
+                "done": done,
+                "written": checkpoint["written"] + writer.stats["written"],
+            })
+
+    position = 0
+    for row in rows:
+        position += 1
+        if position <= checkpoint["done"]:
+            # 書き済みの行も、この後に出てくる重複を除くために覚えておく
+            if row is not None:
+                writer.seen.add(row["dedupe_key"])
+            continue
+        writer.add(row)
+        if writer.full():
+            flush(position)
+    flush(position)
+    return writer.stats
+
+
+def ingest_search(supabase, results, batch_size=INGEST_BATCH_SIZE, checkpoint_path=None, source="search") -> dict:
+    """
+    iter_search() の結果（(query_key, 行のリスト) を流すイテラブル）を place テーブルへ upsert する
+    checkpoint_path を渡すと、upsert のたびに行を書き終えた検索の query_key を記録する
+    続きから動かすときは load_checkpoint(...)['queries'] を iter_search の skip に渡す
+    1つの検索の行は同じ upsert で書くので、1回に書く件数は batch_size を少し超えることがある
+    戻り値: ingest() と同じ
+    """
+    checkpoint = load_checkpoint(checkpoint_path) if checkpoint_path else {}
+    if checkpoint.get("source") != source:
+        checkpoint = {}
+    done = list(checkpoint.get("queries", []))
+    writer = _Writer(supabase, batch_size)
+    pending = []
+
+    def flush():
+        writer.flush()
+        done.extend(pending)
+        pending.clear()
+        if checkpoint_path:
+            save_checkpoint(checkpoint_path, {
+                "source": source,
+                "queries": done,
+                "written": checkpoint.get("written", 0) + writer.stats["written"],
+            })
+
+    for key, rows in results:
+        for row in rows:
+            writer.add(row)
+        pending.append(key)
+        if writer.full():
+            flush()
+    flush()
+    return writer.stats
+
+
+# place テーブルへの一括投入用 CLI
+if __name__ == '__main__':
+    import argparse
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="scraper の検索結果を place テーブルへ入れる")
+    parser.add_argument('--snapshot', help="scraper.py --precompute で書き出したスナップショット")
+    parser.add_argument('--origins', nargs='+', help="スナップショットの代わりに、この出発地でその場で検索する")
+    parser.add_argument('--batch-size', type=int, default=INGEST_BATCH_SIZE, help="1回の upsert で書く件数")
+    parser.add_argument('--checkpoint', default=INGEST_CHECKPOINT_PATH, help="再開用のチェックポイントファイル")
+    parser.add_argument('--restart', action='store_true', help="チェックポイントを消して最初からやり直す")
+    args = parser.parse_args()
+
+    load_dotenv()
+    from storage import get_storage
+    storage = get_storage(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    if args.origins:
+        # 前回書き終えた検索は読み飛ばす（--restart でチェックポイントを消していれば全部検索する）
+        checkpoint = load_checkpoint(args.checkpoint)
+        done = checkpoint.get("queries", []) if checkpoint.get("source") == "search" else []
+        stats = ingest_search(storage, iter_search(args.origins, skip=set(done)), args.batch_size, args.checkpoint)
+    else:
+        from scraper import load_snapshot, SNAPSHOT_PATH
+        snapshot = load_snapshot(args.snapshot or SNAPSHOT_PATH)
+        stats = ingest(storage, iter_snapshot(snapshot), args.batch_size, args.checkpoint,
+                       source=snapshot.get("created_at"))
+    print(f"{stats['read']} 件を読み、{stats['written']} 件を {stats['batches']} 回に分けて書きました"
+          f"（重複 {stats['duplicates']} 件、既存の行に書き足し {stats['matched']} 件、不備 {stats['skipped']} 件）")
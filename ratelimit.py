@@ -0,0 +1,28 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    トークンバケット方式のレート制限。acquire() はトークンが1つ取れるまで待つ
+    rate: 1秒あたりに補充されるトークン数、capacity: 貯められる最大数（バースト）
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
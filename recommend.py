@@ -0,0 +1,521 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from place_ingest import normalize_name
+from singleflight import inflight
+
+RECOMMEND_MODEL = os.getenv("RECOMMEND_MODEL", "gpt-4o-mini")
+RECOMMEND_TIMEOUT = 20  # 秒。1件のコメント生成を待つ上限
+RECOMMEND_MAX_WORKERS = int(os.getenv("RECOMMEND_MAX_WORKERS", "8"))  # 同時に投げるリクエスト数
+# プロンプトを変えたら上げる。キャッシュのキーに含まれるので、古い文面のコメントは使われなくなる
+PROMPT_VERSION = 1
+RECOMMEND_CACHE_PATH = os.getenv("RECOMMEND_CACHE_PATH", os.path.join(".cache", "recommend.sqlite3"))
+RECOMMEND_CACHE_TTL = int(os.getenv("RECOMMEND_CACHE_TTL", str(30 * 24 * 3600)))  # 秒
+RECOMMEND_CACHE_MAX_ENTRIES = int(os.getenv("RECOMMEND_CACHE_MAX_ENTRIES", "20000"))
+# 最後に使った時刻は、前の記録からこの秒数以上たったときだけ書き直す（読むたびに書き込まないため）
+LAST_USED_RESOLUTION = 300
+RECOMMEND_MAX_CHARS = 100
+# parallel: 最初から1件ずつ同時に頼む（既定）
+# batch: 候補地全部を1回のリクエストで頼み、足りない分だけ1件ずつ頼み直す（リクエスト数は減るが、
+# 1回の応答が長くなって最初のコメントが出るまでが遅くなるので、使うときは RECOMMEND_MODE=batch を指定する）
+RECOMMEND_MODE = os.getenv("RECOMMEND_MODE", "parallel")
+# 1: キャッシュに無いコメントを1件ずつ生成しながら少しずつ表示する（ストリーミング）
+# まとめて1回で頼む batch モードは使えなくなるので、既定では使わない
+RECOMMEND_STREAM = os.getenv("RECOMMEND_STREAM", "0") == "1"
+# まとめて頼んだリクエストで時間を使い切っても、1件ずつの頼み直しにはこれだけ待つ
+RETRY_MIN_TIMEOUT = 5  # 秒
+# 生成に失敗した・時間内に終わらなかったときに出す文言（キャッシュはしない）
+PLACEHOLDER = "この場所のおすすめコメントを準備中です。ぜひ訪れてみてください！"
+
+SYSTEM_PROMPT = "あなたは旅行好きユーザー向けのレコメンドアシスタントです。"
+
+
+def build_messages(place) -> list:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"目的地「{place}」を訪れたくなる、日本語の短い推薦コメントを{RECOMMEND_MAX_CHARS}文字以内でください。"}
+    ]
+
+
+def build_batch_messages(places) -> list:
+    listing = "\n".join(f"{i}. {place}" for i, place in enumerate(places, 1))
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": (
+            f"次の目的地それぞれについて、訪れたくなる日本語の短い推薦コメントを{RECOMMEND_MAX_CHARS}文字以内で書いてください。\n"
+            f"index には目的地の番号を入れてください。\n{listing}"
+        )}
+    ]
+
+
+# まとめて頼むときの出力の形（{"comments": [{"index": 1, "comment": "..."}, ...]}）
+BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "recommendations",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "comments": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "index": {"type": "integer"},
+                            "comment": {"type": "string"},
+                        },
+                        "required": ["index", "comment"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["comments"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+def parse_batch(content, places) -> dict:
+    """
+    まとめて頼んだ応答の JSON を {場所: コメント} にする
+    番号が範囲外・空・RECOMMEND_MAX_CHARS 文字を超えるコメントは捨てる（その場所は頼み直しになる）
+    """
+    try:
+        items = json.loads(content)["comments"]
+    except (ValueError, KeyError, TypeError):
+        return {}
+    comments = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        index, comment = item.get("index"), item.get("comment")
+        if not isinstance(index, int) or not 1 <= index <= len(places) or not isinstance(comment, str):
+            continue
+        comment = comment.strip()
+        if comment and len(comment) <= RECOMMEND_MAX_CHARS:
+            comments.setdefault(places[index - 1], comment)
+    return comments
+
+
+def cache_key(place, place_id=None, model=RECOMMEND_MODEL, prompt_version=PROMPT_VERSION) -> str:
+    """キャッシュのキー。place_id があればそれ、無ければ正規化した名前に、モデルとプロンプトの版を付ける"""
+    ident = f"id:{place_id}" if place_id else f"name:{normalize_name(place)}"
+    return f"{model}|v{prompt_version}|{ident}"
+
+
+class RecommendationCache:
+    """
+    推薦コメントを SQLite ファイル（WAL）に保存するキャッシュ
+    Streamlit のワーカープロセスが同じファイルを同時に読めるので、再起動やデプロイの後も作り直さない
+    ttl 秒を過ぎたものは使わず、max_entries を超えたら最後に使った時刻が古いものから消す（LRU）
+    """
+
+    def __init__(self, path=RECOMMEND_CACHE_PATH, ttl=RECOMMEND_CACHE_TTL, max_entries=RECOMMEND_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS recommendation ("
+                " key TEXT PRIMARY KEY, comment TEXT NOT NULL,"
+                " created_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS recommendation_last_used ON recommendation (last_used)")
+
+    def _connect(self):
+        # スレッドやプロセスをまたいで使うので、呼び出しごとに接続する
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, place, place_id=None):
+        """キャッシュにあればコメントを、なければ None を返す"""
+        return self.get_many([place], {place: place_id}).get(place)
+
+    def get_many(self, places, place_ids=None) -> dict:
+        """
+        キャッシュにある分だけ {場所: コメント} で返す（1回の問い合わせで読む）
+        place_ids: {場所: place_id}。place_id の分かる場所はそれをキーにする
+        """
+        place_ids = place_ids or {}
+        keys = {cache_key(p, place_ids.get(p)): p for p in places}
+        if not keys:
+            return {}
+        now = time.time()
+        found = {}
+        expired = []
+        touched = []
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT key, comment, created_at, last_used FROM recommendation"
+                f" WHERE key IN ({', '.join('?' for _ in keys)})",
+                list(keys)
+            ).fetchall()
+            for key, comment, created_at, last_used in rows:
+                if now - created_at > self.ttl:
+                    expired.append(key)
+                    continue
+                found[keys[key]] = comment
+                if now - last_used > LAST_USED_RESOLUTION:
+                    touched.append(key)
+            if expired:
+                conn.executemany("DELETE FROM recommendation WHERE key = ?", [(k,) for k in expired])
+            if touched:
+                conn.executemany("UPDATE recommendation SET last_used = ? WHERE key = ?", [(now, k) for k in touched])
+        return found
+
+    def put(self, place, comment, place_id=None):
+        self.put_many([(place, comment, place_id)])
+
+    def put_many(self, entries):
+        """entries: (場所, コメント, place_id) のリストを1回の書き込みで入れる"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO recommendation (key, comment, created_at, last_used) VALUES (?, ?, ?, ?)",
+                [(cache_key(place, place_id), comment, now, now) for place, comment, place_id in entries]
+            )
+            count = conn.execute("SELECT COUNT(*) FROM recommendation").fetchone()[0]
+            if count > self.max_entries:
+                conn.execute(
+                    "DELETE FROM recommendation WHERE key IN"
+                    " (SELECT key FROM recommendation ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM recommendation")
+
+
+class TokenUsage:
+    """OpenAI のリクエスト数と使ったトークン数を数える（全スレッド共通）"""
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, response):
+        usage = getattr(response, "usage", None)
+        with self._lock:
+            self.requests += 1
+            if usage is not None:
+                self.prompt_tokens += usage.prompt_tokens or 0
+                self.completion_tokens += usage.completion_tokens or 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "total_tokens": self.prompt_tokens + self.completion_tokens,
+            }
+
+
+def _complete(client, place, timeout):
+    res = client.chat.completions.create(
+        model=RECOMMEND_MODEL,
+        messages=build_messages(place),
+        temperature=0.8,
+        max_tokens=120,
+        timeout=timeout,
+    )
+    token_usage.add(res)
+    return res.choices[0].message.content.strip()
+
+
+def _complete_batch(client, places, timeout):
+    res = client.chat.completions.create(
+        model=RECOMMEND_MODEL,
+        messages=build_batch_messages(places),
+        temperature=0.8,
+        max_tokens=120 * len(places),
+        response_format=BATCH_RESPONSE_FORMAT,
+        timeout=timeout,
+    )
+    token_usage.add(res)
+    return parse_batch(res.choices[0].message.content, places)
+
+
+def _stream_chunks(client, place, timeout):
+    stream = client.chat.completions.create(
+        model=RECOMMEND_MODEL,
+        messages=build_messages(place),
+        temperature=0.8,
+        max_tokens=120,
+        stream=True,
+        stream_options={"include_usage": True},
+        timeout=timeout,
+    )
+    usage = None
+    for chunk in stream:
+        # 使ったトークン数は最後の（choices が空の）チャンクに付いてくる
+        if getattr(chunk, "usage", None) is not None:
+            usage = chunk
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+    token_usage.add(usage)
+
+
+def recommend(client, place, cache=None, timeout=RECOMMEND_TIMEOUT, place_id=None) -> str:
+    """
+    place の推薦コメントを1件生成する（キャッシュがあればそれを返す）
+    同じ場所のコメントを別のセッションが生成中なら、その結果を待って使う
+    """
+    cache = recommendation_cache if cache is None else cache
+    comment = cache.get(place, place_id)
+    if comment is not None:
+        return comment
+    comment = inflight.do(("recommend", place), _complete, client, place, timeout, timeout=timeout)
+    cache.put(place, comment, place_id)
+    return comment
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    # プロセスで1つのスレッドプール。同時に OpenAI に投げる数は全セッション合わせて RECOMMEND_MAX_WORKERS まで
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=RECOMMEND_MAX_WORKERS, thread_name_prefix="recommend")
+        return _pool
+
+
+def recommend_batch(client, places, cache=None, timeout=RECOMMEND_TIMEOUT, place_ids=None) -> dict:
+    """
+    places の推薦コメントを1回のリクエストでまとめて生成し、取れた分だけ {場所: コメント} で返す
+    応答が壊れていた・検証に通らなかった場所は含まれない
+    """
+    cache = recommendation_cache if cache is None else cache
+    place_ids = place_ids or {}
+    try:
+        comments = inflight.do(("recommend_batch", tuple(places)), _complete_batch, client, list(places), timeout,
+                               timeout=timeout)
+    except Exception:
+        return {}
+    for place, comment in comments.items():
+        cache.put(place, comment, place_ids.get(place))
+    return comments
+
+
+def recommend_many(client, places, cache=None, timeout=RECOMMEND_TIMEOUT, mode=RECOMMEND_MODE, place_ids=None) -> dict:
+    """
+    複数の場所の推薦コメントを {場所: コメント} で返す
+    mode='parallel'（既定）なら最初から1件ずつ頼む。mode='batch' ならキャッシュに無い場所をまず
+    1回のリクエストでまとめて頼み、取れなかった場所だけを1件ずつ頼み直す
+    1件ずつ頼むときはスレッドプールで同時に生成し、全体で timeout 秒まで待つ
+    失敗した・間に合わなかった場所は PLACEHOLDER になる（間に合わなかった分も裏で生成を続け、終われば次からキャッシュに載る）
+    place_ids: {場所: place_id}。分かっていればキャッシュのキーに使う
+    """
+    cache = recommendation_cache if cache is None else cache
+    place_ids = place_ids or {}
+    places = list(dict.fromkeys(places))
+    results = cache.get_many(places, place_ids)
+    missing = [p for p in places if p not in results]
+    deadline = time.time() + timeout
+    if mode == "batch" and len(missing) > 1:
+        results.update(recommend_batch(client, missing, cache, timeout, place_ids))
+        missing = [p for p in places if p not in results]
+        timeout = max(RETRY_MIN_TIMEOUT, deadline - time.time())
+    if missing:
+        pool = _get_pool()
+        futures = {pool.submit(recommend, client, p, cache, timeout, place_ids.get(p)): p for p in missing}
+        done, _ = wait(futures, timeout=timeout)
+        for future, place in futures.items():
+            if future in done and future.exception() is None:
+                results[place] = future.result()
+            else:
+                results[place] = PLACEHOLDER
+    return {p: results[p] for p in places}
+
+
+class _Broadcast:
+    """1つの場所のストリーミング生成の途中経過を、同じ場所を待っている他のセッションにも配る"""
+
+    def __init__(self):
+        self.text = ""
+        self.done = False
+        self.error = None
+        self._cond = threading.Condition()
+
+    def publish(self, text):
+        with self._cond:
+            self.text = text
+            self._cond.notify_all()
+
+    def finish(self, text=None, error=None):
+        with self._cond:
+            if text is not None:
+                self.text = text
+            self.error = error
+            self.done = True
+            self._cond.notify_all()
+
+    def follow(self, timeout):
+        """途中経過の文を変わるたびに返す。生成側が失敗したらその例外を、timeout 秒で終わらなければ TimeoutError を投げる"""
+        deadline = time.time() + timeout
+        seen = None
+        while True:
+            with self._cond:
+                while self.text == seen and not self.done:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise TimeoutError(f"先行するストリーミングが {timeout} 秒以内に終わりませんでした")
+                    self._cond.wait(remaining)
+                text, done, error = self.text, self.done, self.error
+            if error is not None:
+                raise error
+            if text != seen:
+                seen = text
+                yield text
+            if done:
+                return
+
+
+_streams = {}   # キャッシュのキー -> 生成中の _Broadcast
+_streams_lock = threading.Lock()
+_stream_counts = {"calls": 0, "coalesced": 0}
+
+
+def _join_stream(key):
+    """key の生成が進行中ならその _Broadcast と False を、なければ新しく作って True（自分が生成する）を返す"""
+    with _streams_lock:
+        broadcast = _streams.get(key)
+        if broadcast is not None:
+            _stream_counts["coalesced"] += 1
+            return broadcast, False
+        broadcast = _Broadcast()
+        _streams[key] = broadcast
+        _stream_counts["calls"] += 1
+        return broadcast, True
+
+
+def _leave_stream(key):
+    with _streams_lock:
+        _streams.pop(key, None)
+
+
+def stream_stats() -> dict:
+    """ストリーミングで実際に生成した回数と、生成中の他のセッションに相乗りした回数"""
+    with _streams_lock:
+        return dict(_stream_counts, inflight=len(_streams))
+
+
+def stream_many(client, places, cache=None, timeout=RECOMMEND_TIMEOUT, place_ids=None):
+    """
+    複数の場所の推薦コメントを、生成されたところから (場所, ここまでの文, 完了したか) で順に返すジェネレータ
+    キャッシュにある場所は最初に完了の状態で返し、無い場所はスレッドプールで同時にストリーミングで生成する
+    生成し終えたコメントはキャッシュに入れる。失敗した・timeout 秒以内に終わらなかった場所は PLACEHOLDER で完了になる
+    同じ場所を別のセッションが生成中なら、新しく頼まずにその途中経過を受け取る（singleflight と同じ考え方）
+    """
+    cache = recommendation_cache if cache is None else cache
+    place_ids = place_ids or {}
+    places = list(dict.fromkeys(places))
+    cached = cache.get_many(places, place_ids)
+    for place in places:
+        if place in cached:
+            yield place, cached[place], True
+    missing = [p for p in places if p not in cached]
+    if not missing:
+        return
+
+    events = queue.Queue()
+
+    def lead(place, broadcast):
+        text = ""
+        try:
+            for piece in _stream_chunks(client, place, timeout):
+                text += piece
+                broadcast.publish(text)
+                events.put((place, text, False))
+            text = text.strip()
+            if not text:
+                raise ValueError("空のコメントが返されました")
+            cache.put(place, text, place_ids.get(place))
+            broadcast.finish(text)
+        except Exception as e:
+            broadcast.finish(error=e)
+            raise
+        return text
+
+    def generate(place):
+        key = cache_key(place, place_ids.get(place))
+        broadcast, leader = _join_stream(key)
+        try:
+            if leader:
+                text = lead(place, broadcast)
+            else:
+                for text in broadcast.follow(timeout):
+                    events.put((place, text, False))
+                text = broadcast.text
+            events.put((place, text, True))
+        except Exception:
+            events.put((place, PLACEHOLDER, True))
+        finally:
+            if leader:
+                _leave_stream(key)
+
+    pool = _get_pool()
+    for place in missing:
+        pool.submit(generate, place)
+    remaining = set(missing)
+    deadline = time.time() + timeout
+    while remaining:
+        try:
+            place, text, done = events.get(timeout=max(0.0, deadline - time.time()))
+        except queue.Empty:
+            break
+        if place not in remaining:
+            continue
+        if done:
+            remaining.discard(place)
+        yield place, text, done
+    # 間に合わなかった分も裏で生成を続け、終われば次からキャッシュに載る
+    for place in missing:
+        if place in remaining:
+            yield place, PLACEHOLDER, True
+
+
+def warm_from_catalog(supabase, cache=None, page_size=1000) -> int:
+    """
+    place テーブルに事前生成しておいたコメント（recommend_pregen.py）をキャッシュに読み込む
+    今のモデルとプロンプトの版で作られたものだけを使う。戻り値は読み込んだ件数
+    """
+    cache = recommendation_cache if cache is None else cache
+    count = 0
+    last_id = None
+    while True:
+        query = supabase.table("place").select("id, name, place_id, recommendation, recommendation_key")
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        rows = query.order("id").limit(page_size).execute().data
+        entries = [
+            (r["name"], r["recommendation"], r.get("place_id"))
+            for r in rows
+            if r.get("recommendation") and r.get("recommendation_key") == cache_key(r["name"], r.get("place_id"))
+        ]
+        if entries:
+            cache.put_many(entries)
+            count += len(entries)
+        if len(rows) < page_size:
+            return count
+        last_id = rows[-1]["id"]
+
+
+# プロセス全体で共有するインスタンス
+recommendation_cache = RecommendationCache()
+token_usage = TokenUsage()
@@ -0,0 +1,173 @@
+# place テーブル（またはスナップショット）の場所の推薦コメントを前もってまとめて生成するジョブ
+#
+# まだコメントが無い（または今のモデル・プロンプトの版で作られていない）場所だけを
+# PREGEN_CHUNK_SIZE 件ずつ1回のリクエストで頼み、取れなかった分は1件ずつ頼み直す
+# 生成したコメントは place の行の recommendation 列と、アプリと共通の推薦キャッシュに書く
+# 作り終えた場所は次に動かしたときに読み飛ばすので、途中で止めてもそのまま動かし直せば続きから再開する
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from ratelimit import TokenBucket
+from shop_planner import shop_planner
+from recommend import (
+    RECOMMEND_TIMEOUT, cache_key, recommend, recommend_batch, recommendation_cache, token_usage,
+)
+
+PREGEN_CHUNK_SIZE = int(os.getenv("PREGEN_CHUNK_SIZE", "10"))    # 1回のリクエストで頼む場所の数
+PREGEN_MAX_WORKERS = int(os.getenv("PREGEN_MAX_WORKERS", "4"))   # 同時に投げるリクエスト数
+PREGEN_QPS = float(os.getenv("PREGEN_QPS", "2"))                 # 1秒あたりのリクエスト数の上限
+PREGEN_PAGE_SIZE = 1000
+
+
+def iter_catalog(supabase, page_size=PREGEN_PAGE_SIZE):
+    """place テーブルの行のうち、今の版のコメントがまだ無いものを id 順に返す"""
+    last_id = None
+    while True:
+        query = supabase.table("place").select("id, name, place_id, recommendation_key")
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        rows = query.order("id").limit(page_size).execute().data
+        for row in rows:
+            if row.get("name") and row.get("recommendation_key") != cache_key(row["name"], row.get("place_id")):
+                yield row
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1]["id"]
+
+
+def iter_snapshot_places(snapshot, cache=None):
+    """スナップショットの場所のうち、推薦キャッシュにまだ無いものを返す（place の行が無いので id は None）"""
+    from place_ingest import iter_snapshot
+    cache = recommendation_cache if cache is None else cache
+    seen = set()
+    for row in iter_snapshot(snapshot):
+        if row is None or (row["name"], row["place_id"]) in seen:
+            continue
+        seen.add((row["name"], row["place_id"]))
+        if cache.get(row["name"], row["place_id"]) is None:
+            yield {"id": None, "name": row["name"], "place_id": row["place_id"]}
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _generate(client, supabase, chunk, limiter, cache, timeout) -> tuple:
+    """chunk の場所のコメントを作って保存する。戻り値: (生成できた数, 失敗した数)"""
+    names = list(dict.fromkeys(r["name"] for r in chunk))
+    place_ids = {}
+    for row in chunk:
+        place_ids.setdefault(row["name"], row.get("place_id"))
+    # キャッシュにあるもの（前回 place に書く前に止まった分など）は頼まない
+    comments = cache.get_many(names, place_ids)
+    missing = [n for n in names if n not in comments]
+    if len(missing) > 1:
+        limiter.acquire()
+        comments.update(recommend_batch(client, missing, cache, timeout, place_ids))
+    for name in names:
+        if name in comments:
+            continue
+        limiter.acquire()
+        try:
+            comments[name] = recommend(client, name, cache, timeout, place_ids[name])
+        except Exception as e:
+            print(f"失敗: {name}: {e}", file=sys.stderr)
+
+    done = [r for r in chunk if r["name"] in comments]
+    # 同じ名前で place_id の違う行にも同じコメントを使う
+    cache.put_many([(r["name"], comments[r["name"]], r.get("place_id")) for r in done])
+    updated = [r for r in done if r["id"] is not None]
+    if supabase is not None and updated:
+        # upsert だと name などの NOT NULL の列が無い行の INSERT として検査されて失敗するので、1行ずつ update する
+        for r in updated:
+            supabase.table("place").update({
+                "recommendation": comments[r["name"]],
+                "recommendation_key": cache_key(r["name"], r.get("place_id")),
+            }).eq("id", r["id"]).execute()
+        shop_planner.invalidate()
+    return len(done), len(chunk) - len(done)
+
+
+def pregenerate(client, rows, supabase=None, chunk_size=PREGEN_CHUNK_SIZE, max_workers=PREGEN_MAX_WORKERS,
+                qps=PREGEN_QPS, cache=None, timeout=RECOMMEND_TIMEOUT) -> dict:
+    """
+    rows（{'id', 'name', 'place_id'} を流すイテラブル）の推薦コメントを生成して保存する
+    同時に投げるのは max_workers 本まで、リクエストは1秒あたり qps 回までに抑える
+    supabase を渡すと、id のある行は place テーブルにもコメントを書く
+    戻り値: {'places', 'generated', 'failed', 'requests', 'prompt_tokens', 'completion_tokens', 'total_tokens', 'seconds'}
+    """
+    cache = recommendation_cache if cache is None else cache
+    limiter = TokenBucket(qps, max(1, max_workers))
+    before = token_usage.stats()
+    started = time.time()
+    stats = {"places": 0, "generated": 0, "failed": 0}
+    pool = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    pending = set()
+
+    def collect(futures):
+        for future in futures:
+            try:
+                generated, failed = future.result()
+            except Exception as e:
+                # place への書き込みに失敗した分。キャッシュには入っているので、次に動かしたときに書き直す
+                print(f"失敗: {e}", file=sys.stderr)
+                continue
+            stats["generated"] += generated
+            stats["failed"] += failed
+
+    try:
+        # 先読みしすぎないように、同時に抱えるチャンクは max_workers の2倍まで
+        for chunk in _chunks(rows, chunk_size):
+            stats["places"] += len(chunk)
+            pending.add(pool.submit(_generate, client, supabase, chunk, limiter, cache, timeout))
+            if len(pending) >= 2 * max(1, max_workers):
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        done, _ = wait(pending)
+        collect(done)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    after = token_usage.stats()
+    for key in ("requests", "prompt_tokens", "completion_tokens", "total_tokens"):
+        stats[key] = after[key] - before[key]
+    stats["seconds"] = round(time.time() - started, 1)
+    return stats
+
+
+# 推薦コメントの事前生成用 CLI
+if __name__ == '__main__':
+    import argparse
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="place の推薦コメントを前もって生成する")
+    parser.add_argument('--snapshot', help="place テーブルの代わりに、このスナップショットの場所のコメントを作る")
+    parser.add_argument('--chunk-size', type=int, default=PREGEN_CHUNK_SIZE, help="1回のリクエストで頼む場所の数")
+    parser.add_argument('--workers', type=int, default=PREGEN_MAX_WORKERS, help="同時に投げるリクエスト数")
+    parser.add_argument('--qps', type=float, default=PREGEN_QPS, help="1秒あたりのリクエスト数の上限")
+    args = parser.parse_args()
+
+    load_dotenv()
+    from clients import get_openai
+    from storage import get_storage
+    client = get_openai()
+    storage = get_storage(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+
+    if args.snapshot:
+        from scraper import load_snapshot
+        rows = iter_snapshot_places(load_snapshot(args.snapshot))
+    else:
+        rows = iter_catalog(storage)
+    stats = pregenerate(client, rows, storage, args.chunk_size, args.workers, args.qps)
+    print(f"{stats['places']} 件中 {stats['generated']} 件を生成しました（失敗 {stats['failed']} 件、{stats['seconds']} 秒）")
+    print(f"リクエスト {stats['requests']} 回、トークン {stats['total_tokens']}"
+          f"（入力 {stats['prompt_tokens']} / 出力 {stats['completion_tokens']}）")
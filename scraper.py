@@ -1,9 +1,22 @@
 import os
+import re
+import gzip
+import json
 import sys
 import math
-import requests
+import time
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
 from dotenv import load_dotenv
-from googlemaps import Client as GoogleMaps
+from googlemaps.exceptions import ApiError
+
+from clients import get_gmaps
+from ratelimit import TokenBucket
+from singleflight import inflight
 
 # .env を読み込む
 load_dotenv()
@@ -11,11 +24,53 @@ GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
 if not GOOGLE_MAPS_API_KEY:
     raise RuntimeError("ERROR: 環境変数 GOOGLE_MAPS_API_KEY が設定されていません。")
 
-gmaps = GoogleMaps(key=GOOGLE_MAPS_API_KEY)
+gmaps = get_gmaps(GOOGLE_MAPS_API_KEY)
 
 # サポートするキーワード
 KEYWORDS = ["カフェ", "リラクゼーション", "エンタメ", "ショッピング"]
 
+# 冒険の時間（分） → 検索距離の範囲（メートル）
+TIME_BANDS = {
+    30: (0, 500),
+    60: (500, 1000),
+    120: (1000, 2000),
+}
+
+# 事前計算（キャッシュのウォームアップ）の対象にする出発地と、結果を書き出すファイル
+PRECOMPUTE_ORIGINS = ["博多駅", "天神駅", "中洲川端駅"]
+SNAPSHOT_PATH = os.getenv("PLACES_SNAPSHOT_PATH", "places_snapshot.json.gz")
+SNAPSHOT_VERSION = 1
+SNAPSHOT_FIELDS = ["name", "vicinity", "lat", "lon", "distance_m", "place_id"]
+# これより古いスナップショットは使わずにその場で検索する（秒。0 なら古さを見ない）
+SNAPSHOT_MAX_AGE = int(os.getenv("PLACES_SNAPSHOT_MAX_AGE", str(7 * 24 * 3600)))
+
+# ジオコーディング結果の保存先（プロセスを再起動しても残るようにファイルに置く）
+GEOCODE_CACHE_PATH = os.getenv("GEOCODE_CACHE_PATH", os.path.join(".cache", "geocode.sqlite3"))
+GEOCODE_CACHE_TTL = int(os.getenv("GEOCODE_CACHE_TTL", str(30 * 24 * 3600)))  # 秒
+GEOCODE_CACHE_MAX_ENTRIES = int(os.getenv("GEOCODE_CACHE_MAX_ENTRIES", "5000"))
+
+# Nearby Search の結果キャッシュ（出発地を格子に丸めて同じセルなら使い回す）
+NEARBY_CELL_DEG = float(os.getenv("NEARBY_CELL_DEG", "0.002"))  # 約 200m 四方
+NEARBY_CACHE_TTL = int(os.getenv("NEARBY_CACHE_TTL", str(6 * 3600)))  # 秒
+NEARBY_CACHE_MAX_ENTRIES = int(os.getenv("NEARBY_CACHE_MAX_ENTRIES", "2000"))
+
+# next_page_token は発行直後だと使えないので、少し待ってから次のページを取りに行く
+NEXT_PAGE_DELAY = 2.0  # 秒
+# next_page_token は発行から数分で使えなくなるので、これより古いトークンは持っていないものとして扱う
+NEXT_PAGE_TOKEN_TTL = int(os.getenv("NEXT_PAGE_TOKEN_TTL", "120"))  # 秒
+MAX_PAGES = 3  # Nearby Search は最大 3 ページ（60件）まで
+
+# リング（ドーナツ状の範囲）を小さな円で覆って検索するときの同時実行数
+ANNULUS_MAX_WORKERS = int(os.getenv("ANNULUS_MAX_WORKERS", "8"))
+
+# Google API 呼び出しの上限（全スレッド共通）
+GOOGLE_API_QPS = float(os.getenv("GOOGLE_API_QPS", "10"))
+GOOGLE_API_BURST = int(os.getenv("GOOGLE_API_BURST", "10"))
+SEARCH_MANY_MAX_WORKERS = int(os.getenv("SEARCH_MANY_MAX_WORKERS", "4"))
+
+
+google_rate_limiter = TokenBucket(GOOGLE_API_QPS, GOOGLE_API_BURST)
+
 
 def haversine(lat1, lon1, lat2, lon2):
     """
@@ -30,92 +85,749 @@ def haversine(lat1, lon1, lat2, lon2):
     return R * c
 
 
-def search_places(mood: str, time_min: int, time_max: int, location_keyword: str) -> list:
+def haversine_batch(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    haversine() の配列版。引数はスカラーでも配列でもよく、NumPy のブロードキャストに従って
+    まとめて距離（メートル）を計算する。
+    """
+    R = 6371000
+    phi1 = np.radians(np.asarray(lat1, dtype=np.float64))
+    phi2 = np.radians(np.asarray(lat2, dtype=np.float64))
+    dphi = phi2 - phi1
+    dlambda = np.radians(np.asarray(lon2, dtype=np.float64) - np.asarray(lon1, dtype=np.float64))
+    a = np.sin(dphi/2)**2 + np.cos(phi1)*np.cos(phi2)*np.sin(dlambda/2)**2
+    # 丸め誤差で 1 をわずかに超えると sqrt(1-a) が NaN になるので抑える
+    a = np.clip(a, 0.0, 1.0)
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
+    return R * c
+
+
+def distances_from(base_lat, base_lon, lats, lons) -> np.ndarray:
+    """
+    1つの出発地から複数地点への距離（メートル）を1次元配列で返す
+    """
+    return haversine_batch(base_lat, base_lon, lats, lons)
+
+
+def distance_matrix(origin_lats, origin_lons, lats, lons) -> np.ndarray:
+    """
+    複数の出発地 × 複数地点の距離行列を返す
+    戻り値の shape は (出発地の数, 地点の数)
+    """
+    o_lat = np.asarray(origin_lats, dtype=np.float64)[:, np.newaxis]
+    o_lon = np.asarray(origin_lons, dtype=np.float64)[:, np.newaxis]
+    p_lat = np.asarray(lats, dtype=np.float64)[np.newaxis, :]
+    p_lon = np.asarray(lons, dtype=np.float64)[np.newaxis, :]
+    return haversine_batch(o_lat, o_lon, p_lat, p_lon)
+
+
+def ring_mask(dist, time_min, time_max) -> np.ndarray:
+    """
+    time_min <= dist <= time_max を満たす要素を True とするマスクを返す
+    """
+    dist = np.asarray(dist)
+    return (dist >= time_min) & (dist <= time_max)
+
+
+class PlaceBatch:
+    """
+    場所情報をまとめて持つ列指向のコンテナ（1件ごとの辞書の代わり）
+    座標と距離は NumPy 配列、名前と住所はリストで持つので、件数が多くてもメモリを食わず
+    DataFrame や pydeck のレイヤーデータへも列ごとに渡すだけで変換できる
+    to_dicts() でこれまでの辞書のリストにも戻せる
+    """
+
+    __slots__ = ("name", "vicinity", "lat", "lon", "distance_m", "place_id")
+
+    def __init__(self, name, vicinity, lat, lon, distance_m, place_id=None):
+        self.name = list(name)
+        self.vicinity = list(vicinity)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.distance_m = np.asarray(distance_m, dtype=np.int64)
+        self.place_id = list(place_id) if place_id is not None else [None] * len(self.name)
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], [], [], [], [])
+
+    @classmethod
+    def concat(cls, batches):
+        """複数の PlaceBatch を順に1つへつなげる"""
+        batches = list(batches)
+        if not batches:
+            return cls.empty()
+        return cls(
+            [n for b in batches for n in b.name],
+            [v for b in batches for v in b.vicinity],
+            np.concatenate([b.lat for b in batches]),
+            np.concatenate([b.lon for b in batches]),
+            np.concatenate([b.distance_m for b in batches]),
+            [pid for b in batches for pid in b.place_id],
+        )
+
+    @classmethod
+    def from_dicts(cls, spots):
+        """search_places などが返す辞書のリストから作る"""
+        return cls(
+            [s.get("name") for s in spots],
+            [s.get("vicinity", "") for s in spots],
+            [s["lat"] for s in spots],
+            [s["lon"] for s in spots],
+            [s["distance_m"] for s in spots],
+            [s.get("place_id") for s in spots],
+        )
+
+    def __len__(self):
+        return len(self.name)
+
+    def __getitem__(self, i):
+        return {
+            "name": self.name[i],
+            "vicinity": self.vicinity[i],
+            "lat": float(self.lat[i]),
+            "lon": float(self.lon[i]),
+            "distance_m": int(self.distance_m[i]),
+            "place_id": self.place_id[i]
+        }
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def to_dicts(self) -> list:
+        return list(self)
+
+    def to_dataframe(self):
+        import pandas as pd
+        return pd.DataFrame({
+            "name": self.name,
+            "vicinity": self.vicinity,
+            "lat": self.lat,
+            "lon": self.lon,
+            "distance_m": self.distance_m,
+            "place_id": self.place_id,
+        }, copy=False)
+
+    def to_layer_data(self):
+        """pydeck の Layer(data=...) にそのまま渡せる形（'[lon, lat]' で位置を参照する DataFrame）"""
+        return self.to_dataframe()
+
+
+def filter_ring_batch(places: list, base_lat, base_lon, time_min, time_max, limit=5) -> PlaceBatch:
+    """
+    Places API の結果リストから、出発地からの距離が [time_min, time_max] に入るものを
+    先頭から最大 limit 件、PlaceBatch にして返す
+    """
+    if not places:
+        return PlaceBatch.empty()
+    lats = np.fromiter((p["geometry"]["location"]["lat"] for p in places), dtype=np.float64, count=len(places))
+    lons = np.fromiter((p["geometry"]["location"]["lng"] for p in places), dtype=np.float64, count=len(places))
+    dists = distances_from(base_lat, base_lon, lats, lons)
+    idx = np.flatnonzero(ring_mask(dists, time_min, time_max))
+    if limit is not None:
+        idx = idx[:limit]
+    return PlaceBatch(
+        [places[i].get("name") for i in idx],
+        [places[i].get("vicinity", "") for i in idx],
+        lats[idx],
+        lons[idx],
+        dists[idx].astype(np.int64),
+        [places[i].get("place_id") for i in idx],
+    )
+
+
+def filter_ring(places: list, base_lat, base_lon, time_min, time_max, limit=5) -> list:
+    """
+    filter_ring_batch() の結果を場所情報の辞書のリストで返す
+    """
+    return filter_ring_batch(places, base_lat, base_lon, time_min, time_max, limit).to_dicts()
+
+
+def normalize_keyword(keyword: str) -> str:
+    """
+    出発地キーワードをキャッシュのキー用に正規化する
+    全角・半角の統一、空白の除去、末尾の「駅」を取り除く（'博多駅' と ' 博多 ' は同じキー）
+    """
+    key = unicodedata.normalize("NFKC", keyword or "")
+    key = re.sub(r"\s+", "", key).lower()
+    if key.endswith("駅") and len(key) > 1:
+        key = key[:-1]
+    return key
+
+
+class GeocodeCache:
+    """
+    キーワード → 座標 を SQLite ファイルに保存するキャッシュ
+    ttl 秒を過ぎたものは使わず、max_entries を超えたら最後に使った時刻が古いものから消す（LRU）
+    """
+
+    def __init__(self, path=GEOCODE_CACHE_PATH, ttl=GEOCODE_CACHE_TTL, max_entries=GEOCODE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS geocode ("
+                " key TEXT PRIMARY KEY, lat REAL NOT NULL, lng REAL NOT NULL,"
+                " created_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS geocode_last_used ON geocode (last_used)")
+
+    def _connect(self):
+        # スレッドやプロセスをまたいで使うので、呼び出しごとに接続する
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, keyword):
+        """キャッシュにあれば (lat, lng) を、なければ None を返す"""
+        key = normalize_keyword(keyword)
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT lat, lng, created_at FROM geocode WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            lat, lng, created_at = row
+            if now - created_at > self.ttl:
+                conn.execute("DELETE FROM geocode WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE geocode SET last_used = ? WHERE key = ?", (now, key))
+        return lat, lng
+
+    def set(self, keyword, lat, lng):
+        key = normalize_keyword(keyword)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO geocode (key, lat, lng, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, lat, lng, now, now)
+            )
+            count = conn.execute("SELECT COUNT(*) FROM geocode").fetchone()[0]
+            if count > self.max_entries:
+                conn.execute(
+                    "DELETE FROM geocode WHERE key IN"
+                    " (SELECT key FROM geocode ORDER BY last_used ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM geocode")
+
+
+geocode_cache = GeocodeCache()
+
+
+def resolve_location(location_keyword: str, method: str = "find_place") -> tuple:
+    """
+    出発地キーワードを (lat, lng) に変換する。結果は geocode_cache に保存して使い回す
+    method: キャッシュにない場合に使う API。'find_place'（Places API）か 'geocode'（Geocoding API）
+    """
+    cached = geocode_cache.get(location_keyword)
+    if cached is not None:
+        return cached
+    # 同じキーワードを同時に引いている別セッションがあれば、その結果を待って使う
+    return inflight.do(("geocode", normalize_keyword(location_keyword)), _lookup_location, location_keyword, method)
+
+
+def _lookup_location(location_keyword, method):
+    if method == "geocode":
+        google_rate_limiter.acquire()
+        res = gmaps.geocode(location_keyword, language="ja")
+        if not res:
+            raise ValueError(f"場所 '{location_keyword}' が見つかりませんでした。")
+        loc = res[0]["geometry"]["location"]
+    else:
+        google_rate_limiter.acquire()
+        res = gmaps.find_place(
+            input=location_keyword,
+            input_type="textquery",
+            fields=["geometry/location"],
+            language="ja"
+        )
+        candidates = res.get("candidates", [])
+        if not candidates:
+            raise ValueError(f"場所 '{location_keyword}' が見つかりませんでした。")
+        loc = candidates[0]["geometry"]["location"]
+
+    geocode_cache.set(location_keyword, loc["lat"], loc["lng"])
+    return loc["lat"], loc["lng"]
+
+
+class NearbyCache:
+    """
+    Nearby Search の生の結果をメモリに保持するキャッシュ
+    キーは (格子セル, 気分キーワード, 半径)。セルの中心から検索した結果を保存しておき、
+    同じセル内のどの出発地から来ても距離は実際の出発地から計算し直して使う
+    """
+
+    def __init__(self, cell_deg=NEARBY_CELL_DEG, ttl=NEARBY_CACHE_TTL, max_entries=NEARBY_CACHE_MAX_ENTRIES):
+        self.cell_deg = cell_deg
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cell_of(self, lat, lon):
+        """座標が属する格子セルの番号 (i, j) を返す"""
+        return math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+
+    def cell_center(self, cell):
+        i, j = cell
+        return (i + 0.5) * self.cell_deg, (j + 0.5) * self.cell_deg
+
+    def cell_margin(self, cell):
+        """セルの中心から角までの距離（メートル）。検索半径にこれを足せばセル内のどこからでも円を覆える"""
+        lat, lon = self.cell_center(cell)
+        return haversine(lat, lon, lat + self.cell_deg / 2, lon + self.cell_deg / 2)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and time.time() - entry[0] <= self.ttl:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def peek(self, key):
+        """get() と同じく TTL 内の値を返すが、ヒット・ミスの数にも LRU の順番にも数えない"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and time.time() - entry[0] <= self.ttl:
+                return entry[1]
+            return None
+
+    def set(self, key, results):
+        with self._lock:
+            self._data[key] = (time.time(), results)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "size": len(self._data),
+            }
+
+
+nearby_cache = NearbyCache()
+
+
+def nearby_page(base_lat, base_lon, radius, mood, page=0) -> tuple:
+    """
+    Nearby Search の page ページ目（0 始まり）を (results, has_next) で返す
+    nearby_cache にあれば API を呼ばない。2ページ目以降は前のページに付いてきた next_page_token で取りに行く
+    radius: 実際の出発地から見て覆いたい半径（メートル）
+    """
+    cell = nearby_cache.cell_of(base_lat, base_lon)
+    key = (cell, mood, int(radius), page)
+    entry = nearby_cache.get(key)
+    if entry is None:
+        # 同じセル・気分・半径のページを同時に取りに行っている別セッションがあれば、その結果を待って使う
+        entry = inflight.do(("nearby",) + key, _fetch_nearby_page, key, cell, radius, mood, page)
+    results, token, _ = entry
+    return results, token is not None
+
+
+def _page_token(key, cell, radius, mood, page):
+    """
+    page ページ目を取るための next_page_token（前のページに付いてきたもの）を返す。次のページが無ければ None
+    トークンは短い時間で使えなくなるので、古ければ1ページ目なら取り直し、2ページ目以降ならあきらめる
+    """
+    prev_key = key[:-1] + (page - 1,)
+    # トークンを読むだけなので、キャッシュのヒット率には数えない
+    prev = nearby_cache.peek(prev_key)
+    if prev is None and page - 1 > 0:
+        return None
+    if prev is not None:
+        _, token, issued_at = prev
+        if token is None or time.time() - issued_at <= NEXT_PAGE_TOKEN_TTL:
+            return token
+        if page - 1 > 0:
+            return None
+    _, token, _ = inflight.do(("nearby",) + prev_key, _fetch_nearby_page, prev_key, cell, radius, mood, 0)
+    return token
+
+
+def _fetch_nearby_page(key, cell, radius, mood, page):
+    if page == 0:
+        center_lat, center_lon = nearby_cache.cell_center(cell)
+        google_rate_limiter.acquire()
+        response = gmaps.places_nearby(
+            location=(center_lat, center_lon),
+            radius=min(50000, math.ceil(radius + nearby_cache.cell_margin(cell))),
+            keyword=mood,
+            language="ja"
+        )
+    else:
+        page_token = _page_token(key, cell, radius, mood, page)
+        if page_token is None:
+            return [], None, time.time()
+        response = None
+        for _ in range(3):
+            time.sleep(NEXT_PAGE_DELAY)
+            google_rate_limiter.acquire()
+            try:
+                response = gmaps.places_nearby(page_token=page_token)
+                break
+            except ApiError as e:
+                # トークンがまだ有効になっていない場合は INVALID_REQUEST が返る
+                if e.status != "INVALID_REQUEST":
+                    raise
+        if response is None:
+            return [], None, time.time()
+
+    # トークンは発行された時刻と一緒に持つ（結果はキャッシュの TTL まで使うが、トークンは NEXT_PAGE_TOKEN_TTL まで）
+    entry = (response.get("results", []), response.get("next_page_token"), time.time())
+    nearby_cache.set(key, entry)
+    return entry
+
+
+def nearby_search(base_lat, base_lon, radius, mood) -> list:
+    """
+    Nearby Search の1ページ目の結果（生の results リスト）を返す
+    """
+    return nearby_page(base_lat, base_lon, radius, mood)[0]
+
+
+class PlaceIterator:
+    """
+    iter_places() の戻り値。for で回すと距離リングに入る場所を1件ずつ返す
+    batch() を呼ぶと、辞書にせずに PlaceBatch でまとめて返す
+    pages_used: 実際に読んだページ数（キャッシュから読んだページも含む）
+    """
+
+    def __init__(self, mood, time_min, time_max, base_lat, base_lon, limit=5, max_pages=MAX_PAGES):
+        self.mood = mood
+        self.time_min = time_min
+        self.time_max = time_max
+        self.base_lat = base_lat
+        self.base_lon = base_lon
+        self.limit = limit
+        self.max_pages = max_pages
+        self.pages_used = 0
+        self._gen = self._generate()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._gen)
+
+    def _generate(self):
+        for batch in self._batches():
+            yield from batch
+
+    def batch(self) -> PlaceBatch:
+        """残りのページを読み、リングに入る場所を1つの PlaceBatch にして返す"""
+        return PlaceBatch.concat(self._batches())
+
+    def _batches(self):
+        """ページごとに、リングに入る場所を PlaceBatch で返す"""
+        found = 0
+        seen = set()
+        has_next = True
+        for page in range(self.max_pages):
+            if not has_next:
+                break
+            places, has_next = nearby_page(self.base_lat, self.base_lon, self.time_max, self.mood, page)
+            self.pages_used += 1
+            places = [p for p in places if p.get("place_id") is None or p["place_id"] not in seen]
+            seen.update(p["place_id"] for p in places if p.get("place_id"))
+            remaining = None if self.limit is None else self.limit - found
+            batch = filter_ring_batch(places, self.base_lat, self.base_lon, self.time_min, self.time_max, limit=remaining)
+            found += len(batch)
+            yield batch
+            if self.limit is not None and found >= self.limit:
+                return
+
+
+def iter_places(mood, time_min, time_max, base_lat, base_lon, limit=5, max_pages=MAX_PAGES) -> PlaceIterator:
+    """
+    距離リング [time_min, time_max] に入る場所を遅延評価で返すイテレータ
+    1ページ目で limit 件そろわなかったときだけ next_page_token をたどって次のページを取りに行く
+    """
+    return PlaceIterator(mood, time_min, time_max, base_lat, base_lon, limit, max_pages)
+
+
+def offset_point(lat, lon, distance_m, bearing_rad) -> tuple:
+    """
+    (lat, lon) から方位 bearing_rad（北が 0、時計回り）へ distance_m 進んだ地点を返す
+    数 km 程度なら平面近似で十分な精度になる
+    """
+    R = 6371000
+    dlat = distance_m * math.cos(bearing_rad) / R
+    dlon = distance_m * math.sin(bearing_rad) / (R * math.cos(math.radians(lat)))
+    return lat + math.degrees(dlat), lon + math.degrees(dlon)
+
+
+def annulus_tiles(base_lat, base_lon, time_min, time_max) -> list:
+    """
+    リング [time_min, time_max] を覆う小円のリスト [(lat, lon, radius), ...] を返す
+    小円の半径はリングの幅とし、外周上でも隣の円と重なるだけの個数を並べる
+    time_min が 0 のとき（ただの円）は出発地を中心とする1つの円を返す
+    """
+    width = time_max - time_min
+    if time_min <= 0 or width <= 0:
+        return [(base_lat, base_lon, time_max)]
+    sub_radius = width
+    mid = (time_min + time_max) / 2
+    # 半径方向のずれ (width/2) を差し引いた残りで、外周上の隣接円との半分の間隔を覆う
+    half_gap = math.sqrt(sub_radius**2 - (width / 2)**2)
+    n = math.ceil(math.pi / math.asin(min(1.0, half_gap / time_max)))
+    tiles = []
+    for k in range(n):
+        lat, lon = offset_point(base_lat, base_lon, mid, 2 * math.pi * k / n)
+        tiles.append((lat, lon, sub_radius))
+    return tiles
+
+
+def search_places_annulus(mood, time_min, time_max, base_lat, base_lon, limit=5, max_workers=ANNULUS_MAX_WORKERS) -> list:
+    """
+    search_annulus_batch() の結果を場所情報の辞書のリストで返す
+    """
+    return search_annulus_batch(mood, time_min, time_max, base_lat, base_lon, limit, max_workers).to_dicts()
+
+
+def search_annulus_batch(mood, time_min, time_max, base_lat, base_lon, limit=5, max_workers=ANNULUS_MAX_WORKERS) -> PlaceBatch:
+    """
+    リングを小円で覆い、各小円の Nearby Search を並列に実行して結果を PlaceBatch にまとめる
+    place_id で重複を除き、距離は実際の出発地から計算し直してリング内のものを返す
+    各方向の上位から順に交互に取り出すので、候補がリングの一方向に偏りにくい
+    """
+    tiles = annulus_tiles(base_lat, base_lon, time_min, time_max)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tiles)))) as pool:
+        pages = list(pool.map(lambda t: nearby_search(t[0], t[1], t[2], mood), tiles))
+
+    merged = []
+    seen = set()
+    for rank in range(max((len(p) for p in pages), default=0)):
+        for page in pages:
+            if rank >= len(page):
+                continue
+            p = page[rank]
+            pid = p.get("place_id") or (p.get("name"), p["geometry"]["location"]["lat"], p["geometry"]["location"]["lng"])
+            if pid in seen:
+                continue
+            seen.add(pid)
+            merged.append(p)
+    return filter_ring_batch(merged, base_lat, base_lon, time_min, time_max, limit=limit)
+
+
+def search_places(mood: str, time_min: int, time_max: int, location_keyword: str, mode: str = "nearby", backend=None, limit=5) -> list:
     """
     mood: KEYWORDS のいずれか
     time_min, time_max: 検索距離の最小・最大値（メートル）
     location_keyword: 出発地キーワード（例: '博多駅'）
-    戻り値: 場所情報リスト (最大5件)
-    """
-    # 1) 出発地の座標取得 (Places API Find Place)
-    res = gmaps.find_place(
-        input=location_keyword,
-        input_type="textquery",
-        fields=["geometry/location"],
-        language="ja"
-    )
-    candidates = res.get("candidates", [])
-    if not candidates:
-        raise ValueError(f"場所 '{location_keyword}' が見つかりませんでした。")
-    base = candidates[0]["geometry"]["location"]
-    base_lat, base_lon = base['lat'], base['lng']
-
-    # 2) 周辺検索 (Nearby Search)
-    response = gmaps.places_nearby(
-        location=(base_lat, base_lon),
-        radius=time_max,
-        keyword=mood,
-        language="ja"
-    )
-    results = []
-    for p in response.get('results', []):
-        loc = p['geometry']['location']
-        dist = haversine(base_lat, base_lon, loc['lat'], loc['lng'])
-        if time_min <= dist <= time_max:
-            results.append({
-                'name': p.get('name'),
-                'vicinity': p.get('vicinity'),
-                'lat': loc['lat'],
-                'lon': loc['lng'],
-                'distance_m': int(dist)
-            })
-        if len(results) >= 5:
-            break
-    return results
-
-def search_places_by_coords(mood, time_min, time_max, base_lat, base_lon):
+    mode: 'nearby'（出発地中心の1円）か 'annulus'（リングを小円で覆って並列検索）
+    backend: search_ring() を持つオブジェクト（place_index.PlaceIndex など）。指定すると周辺検索に Google を使わない
+    limit: 返す件数の上限。None なら読めたページの分だけ全部
+    戻り値: 場所情報リスト (最大 limit 件)
+    """
+    # 1) 出発地の座標取得 (キャッシュ → Places API Find Place)
+    base_lat, base_lon = resolve_location(location_keyword)
+
+    # 2) 周辺検索 (Nearby Search、キャッシュ付き。足りなければ次のページも読む)
+    return search_places_by_coords(mood, time_min, time_max, base_lat, base_lon, mode=mode, backend=backend, limit=limit)
+
+def search_places_by_coords(mood, time_min, time_max, base_lat, base_lon, mode="nearby", backend=None, limit=5):
     # 近傍検索だけ行うバージョン
-    resp = gmaps.places_nearby(
-        location=(base_lat, base_lon),
-        radius=time_max,
-        keyword=mood,
-        language="ja"
-    )
-    results = []
-    for p in resp.get("results", []):
-        loc = p["geometry"]["location"]
-        dist = haversine(base_lat, base_lon, loc["lat"], loc["lng"])
-        if time_min <= dist <= time_max:
-            results.append({
-                "name": p["name"],
-                "vicinity": p.get("vicinity",""),
-                "lat": loc["lat"],
-                "lon": loc["lng"],
-                "distance_m": int(dist)
-            })
-        if len(results) >= 5:
-            break
-    return results
+    return search_batch_by_coords(mood, time_min, time_max, base_lat, base_lon, mode, backend, limit).to_dicts()
+
+
+def search_batch_by_coords(mood, time_min, time_max, base_lat, base_lon, mode="nearby", backend=None, limit=5) -> PlaceBatch:
+    """
+    search_places_by_coords() と同じ検索をして、結果を辞書にせず PlaceBatch のまま返す
+    backend: search_ring_batch() を持つオブジェクト（place_index.PlaceIndex など）
+    """
+    if backend is not None:
+        return backend.search_ring_batch(mood, time_min, time_max, base_lat, base_lon, limit=limit)
+    if mode == "annulus":
+        return search_annulus_batch(mood, time_min, time_max, base_lat, base_lon, limit=limit)
+    return iter_places(mood, time_min, time_max, base_lat, base_lon, limit=limit).batch()
+
+
+
+def _search_one(origin, mood, band, mode, limit=5):
+    time_min, time_max = TIME_BANDS[band] if band in TIME_BANDS else band
+    if isinstance(origin, str):
+        return search_places(mood, time_min, time_max, origin, mode=mode, limit=limit)
+    base_lat, base_lon = origin
+    return search_places_by_coords(mood, time_min, time_max, base_lat, base_lon, mode=mode, limit=limit)
+
+
+def search_many(origins, moods=KEYWORDS, bands=tuple(TIME_BANDS), mode="nearby", max_workers=SEARCH_MANY_MAX_WORKERS, limit=5,
+                queries=None):
+    """
+    出発地 × 気分 × 時間帯 の全組み合わせをスレッドプールで並列に検索する
+    origins: 出発地キーワード（'博多駅'）か (lat, lon) のリスト
+    bands: TIME_BANDS のキー（30, 60, 120）か (time_min, time_max) のリスト
+    limit: 1つの検索で返す件数の上限（None なら全部）
+    queries: (出発地, 気分, 時間帯) のリスト。渡すと全組み合わせの代わりにこれだけを検索する
+    終わった検索から順に {'origin', 'mood', 'band', 'places', 'error'} の辞書を返すジェネレータ
+    API の呼び出し回数は google_rate_limiter で全スレッド共通に制限される
+    """
+    if queries is None:
+        queries = [(o, m, b) for o in origins for m in moods for b in bands]
+    pool = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    try:
+        futures = {pool.submit(_search_one, o, m, b, mode, limit): (o, m, b) for o, m, b in queries}
+        for future in as_completed(futures):
+            origin, mood, band = futures[future]
+            try:
+                places, error = future.result(), None
+            except Exception as e:
+                places, error = [], e
+            yield {"origin": origin, "mood": mood, "band": band, "places": places, "error": error}
+    finally:
+        # 途中で読むのをやめた場合は、まだ始まっていない検索を取り消す
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+
+def _snapshot_key(location_keyword, mood, minutes):
+    return f"{normalize_keyword(location_keyword)}|{mood}|{minutes}"
 
 
+def precompute(origins=PRECOMPUTE_ORIGINS, moods=KEYWORDS, bands=tuple(TIME_BANDS), path=SNAPSHOT_PATH) -> dict:
+    """
+    出発地 × 気分 × 時間帯 を全部検索して、リングで絞り込んだ結果をスナップショットファイルに書き出す
+    120分はアプリと同じくリングを小円で覆う検索（annulus）を使う
+    戻り値: 書き出したスナップショット
+    """
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "created_at": time.time(),
+        "fields": SNAPSHOT_FIELDS,
+        "origins": {},
+        "labels": {},    # 正規化した出発地 -> 指定されたときの表記（'博多駅' など）
+        "results": {},
+    }
+    for keyword in origins:
+        snapshot["origins"][normalize_keyword(keyword)] = list(resolve_location(keyword))
+        snapshot["labels"][normalize_keyword(keyword)] = keyword
+
+    near_bands = [b for b in bands if b != 120]
+    far_bands = [b for b in bands if b == 120]
+    results = list(search_many(origins, moods, near_bands, mode="nearby")) if near_bands else []
+    if far_bands:
+        results += list(search_many(origins, moods, far_bands, mode="annulus"))
+    for r in results:
+        if r["error"] is not None:
+            print(f"失敗: {r['origin']} {r['mood']} {r['band']}分: {r['error']}", file=sys.stderr)
+            continue
+        rows = [[spot.get(f) for f in SNAPSHOT_FIELDS] for spot in r["places"]]
+        snapshot["results"][_snapshot_key(r["origin"], r["mood"], r["band"])] = rows
+
+    # 書き込み途中のファイルを読まれないように、一時ファイルに書いてから置き換える
+    tmp = f"{path}.tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
+    return snapshot
+
+
+def load_snapshot(path=SNAPSHOT_PATH) -> dict:
+    """
+    precompute() が書き出したスナップショットを読む。ファイルが無い・版が違うときは空のスナップショットを返す
+    """
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return {"version": SNAPSHOT_VERSION, "origins": {}, "results": {}}
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        return {"version": SNAPSHOT_VERSION, "origins": {}, "results": {}}
+    return snapshot
+
+
+def snapshot_is_stale(snapshot, max_age=SNAPSHOT_MAX_AGE) -> bool:
+    """スナップショットが max_age 秒より前に作られたものなら True（作成時刻の無いものも古いとみなす）"""
+    if not max_age:
+        return False
+    created_at = snapshot.get("created_at")
+    return created_at is None or time.time() - created_at > max_age
+
+
+def snapshot_lookup(snapshot, location_keyword, mood, minutes, max_age=SNAPSHOT_MAX_AGE):
+    """
+    スナップショットにあれば ((lat, lng), 場所情報リスト) を、なければ None を返す
+    """
+    hit = snapshot_lookup_batch(snapshot, location_keyword, mood, minutes, max_age)
+    if hit is None:
+        return None
+    origin, batch = hit
+    return origin, batch.to_dicts()
+
+
+def snapshot_lookup_batch(snapshot, location_keyword, mood, minutes, max_age=SNAPSHOT_MAX_AGE):
+    """
+    スナップショットにあれば ((lat, lng), PlaceBatch) を、なければ None を返す
+    スナップショットが max_age 秒より古ければ、あっても None を返す（呼び出し側はその場で検索する）
+    """
+    if snapshot_is_stale(snapshot, max_age):
+        return None
+    origin = snapshot["origins"].get(normalize_keyword(location_keyword))
+    rows = snapshot["results"].get(_snapshot_key(location_keyword, mood, minutes))
+    if origin is None or rows is None:
+        return None
+    fields = snapshot.get("fields", SNAPSHOT_FIELDS)
+    columns = {f: [row[i] for row in rows] for i, f in enumerate(fields)}
+    return tuple(origin), PlaceBatch(
+        columns.get("name", []),
+        columns.get("vicinity", [""] * len(rows)),
+        columns.get("lat", []),
+        columns.get("lon", []),
+        columns.get("distance_m", []),
+        columns.get("place_id"),
+    )
+
 # CLI テスト用
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser(description="場所検索テスト")
-    parser.add_argument('--mood', choices=KEYWORDS, required=True)
-    parser.add_argument('--time', type=int, choices=[30,60,120], required=True,
+    parser.add_argument('--mood', choices=KEYWORDS)
+    parser.add_argument('--time', type=int, choices=[30,60,120],
                         help="30, 60, 120 のいずれかを指定")
-    parser.add_argument('--location', required=True, help="例: '博多駅'")
+    parser.add_argument('--location', help="例: '博多駅'")
+    parser.add_argument('--mode', choices=["nearby", "annulus"], default="nearby",
+                        help="annulus: リングを小円で覆って並列検索する")
+    parser.add_argument('--precompute', action='store_true',
+                        help="出発地 × 全気分 × 全時間帯 を検索してスナップショットを書き出す")
+    parser.add_argument('--origins', nargs='+', default=PRECOMPUTE_ORIGINS,
+                        help="--precompute の対象にする出発地")
+    parser.add_argument('--snapshot', default=SNAPSHOT_PATH, help="スナップショットの出力先")
     args = parser.parse_args()
 
+    if args.precompute:
+        snapshot = precompute(origins=args.origins, path=args.snapshot)
+        print(f"{len(snapshot['results'])} 件の検索結果を {args.snapshot} に書き出しました")
+        sys.exit(0)
+    if not (args.mood and args.time and args.location):
+        parser.error("--mood, --time, --location を指定してください（または --precompute）")
+
     # time に応じた距離設定
-    if args.time == 30:
-        min_r, max_r = 0, 500
-    elif args.time == 60:
-        min_r, max_r = 500, 1000
-    else:
-        min_r, max_r = 1000, 2000
+    min_r, max_r = TIME_BANDS[args.time]
 
-    places = search_places(args.mood, min_r, max_r, args.location)
+    places = search_places(args.mood, min_r, max_r, args.location, mode=args.mode)
     for i, spot in enumerate(places, start=1):
         print(f"{i}. {spot['name']} - {spot['vicinity']} ({spot['distance_m']}m)")
@@ -0,0 +1,89 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# 駅のつながりと、冒険の時間ごとにどこまでの駅を含めるかの表
+STATIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stations.json")
+PLAN_CACHE_TTL = 300  # 秒
+# stations.json に無い時間は出発駅だけで探す
+DEFAULT_BAND = {"hops": 0, "limit": 5}
+
+
+def load_stations(path=STATIONS_PATH) -> dict:
+    """
+    stations.json を読む
+    stations: 駅 -> 隣の駅のリスト、bands: 時間 -> {'hops': 何駅先まで含めるか（null なら全駅）, 'limit': 件数}
+    """
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def reachable(stations, area, hops) -> list:
+    """area から hops 駅以内で行ける駅（area 自身を含む）を名前順で返す"""
+    seen = {area}
+    queue = deque([(area, 0)])
+    while queue:
+        station, depth = queue.popleft()
+        if depth == hops:
+            continue
+        for nxt in stations.get(station, []):
+            if nxt not in seen:
+                seen.add(nxt)
+                queue.append((nxt, depth + 1))
+    return sorted(seen)
+
+
+class ShopPlanner:
+    """
+    (時間, 気分, 出発駅) を place テーブルへの検索条件（プラン）に変換し、プランごとに結果を覚えておく
+    プラン: (気分, 対象の駅のタプル（None なら駅で絞らない）, 件数)
+    同じプランの検索は PLAN_CACHE_TTL 秒の間 Supabase に行かない
+    """
+
+    def __init__(self, table=None, ttl=PLAN_CACHE_TTL):
+        self.table = table if table is not None else load_stations()
+        self.ttl = ttl
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def plan(self, time_label, mood, area) -> tuple:
+        band = self.table["bands"].get(time_label, DEFAULT_BAND)
+        if band["hops"] is None:
+            areas = None
+        else:
+            areas = tuple(reachable(self.table["stations"], area, band["hops"]))
+        return mood, areas, band["limit"]
+
+    def run(self, supabase, plan) -> list:
+        mood, areas, limit = plan
+        query = supabase.table("place").select("*")
+        if areas is not None:
+            query = query.eq("area", areas[0]) if len(areas) == 1 else query.in_("area", list(areas))
+        return query.eq("mood", mood).limit(limit).execute().data
+
+    def search(self, supabase, time_label, mood, area) -> list:
+        plan = self.plan(time_label, mood, area)
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(plan)
+            if entry is not None and entry[0] > now:
+                # 呼び出し側がリストを書き換えてもキャッシュが変わらないよう、写しを返す
+                return list(entry[1])
+        data = self.run(supabase, plan)
+        with self._lock:
+            self._cache[plan] = (now + self.ttl, data)
+        return list(data)
+
+    def invalidate(self):
+        """
+        place テーブルを書き換えたときに呼ぶ（place_ingest・recommend_pregen は書き込みのたびに呼ぶ）
+        消えるのはこのプロセスのキャッシュだけ。ほかのプロセスには PLAN_CACHE_TTL 秒たつと反映される
+        """
+        with self._lock:
+            self._cache.clear()
+
+
+# プロセス全体で共有するインスタンス
+shop_planner = ShopPlanner()
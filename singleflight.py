@@ -0,0 +1,68 @@
+import threading
+
+# 先に走っている呼び出しの完了を待つ時間の既定値（秒）
+DEFAULT_TIMEOUT = 30.0
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    同じキーの呼び出しが同時に来たとき、実際に実行するのは最初の1つだけにして
+    後から来た呼び出しはその完了を待って同じ結果（または同じ例外）を受け取る
+    Streamlit のセッションはスレッドで動くので、プロセス内の全セッションで共有できる
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT):
+        self.timeout = timeout
+        self.calls = 0       # 実際に fn を実行した回数
+        self.coalesced = 0   # 先行する呼び出しに相乗りした回数
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, timeout=None, **kwargs):
+        """
+        key が同じ呼び出しが実行中ならその結果を待ち、なければ fn(*args, **kwargs) を実行する
+        timeout: 先行する呼び出しを待つ最大秒数。超えたら TimeoutError
+        """
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._inflight[key] = call
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            wait = self.timeout if timeout is None else timeout
+            if not call.event.wait(wait):
+                raise TimeoutError(f"先行する呼び出しが {wait} 秒以内に終わりませんでした: {key!r}")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            call.event.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "inflight": len(self._inflight)}
+
+
+# プロセス全体で共有するインスタンス
+inflight = SingleFlight()
@@ -0,0 +1,60 @@
+import threading
+import time
+
+# 存在が確認できたじゅもんを覚えておく秒数
+KNOWN_TTL = 3600
+# 「存在しない」と分かったじゅもんを覚えておく秒数（すぐ登録されることがあるので短め）
+MISSING_TTL = 10
+
+
+class SpellCache:
+    """
+    status テーブルにじゅもんがあるかを1件ずつ調べ、結果をプロセス全体で覚えておくキャッシュ
+    status を全件読む代わりに spell の主キー検索を1回だけ行う
+    登録したじゅもんは add() で知らせると、すぐに「ある」と答えるようになる
+    """
+
+    def __init__(self, known_ttl=KNOWN_TTL, missing_ttl=MISSING_TTL):
+        self.known_ttl = known_ttl
+        self.missing_ttl = missing_ttl
+        self._known = {}    # spell -> 期限
+        self._missing = {}  # spell -> 期限
+        self._lock = threading.Lock()
+
+    def exists(self, supabase, spell) -> bool:
+        now = time.time()
+        with self._lock:
+            if self._known.get(spell, 0) > now:
+                return True
+            if self._missing.get(spell, 0) > now:
+                return False
+
+        response = supabase.table("status").select("spell").eq("spell", spell).limit(1).execute()
+        found = bool(response.data)
+        with self._lock:
+            if found:
+                self._known[spell] = now + self.known_ttl
+                self._missing.pop(spell, None)
+            else:
+                self._missing[spell] = now + self.missing_ttl
+        return found
+
+    def add(self, spell):
+        """じゅもんを status に登録したときに呼ぶ"""
+        with self._lock:
+            self._known[spell] = time.time() + self.known_ttl
+            self._missing.pop(spell, None)
+
+    def invalidate(self, spell=None):
+        """じゅもんの記憶を消す。spell を省略するとすべて消す"""
+        with self._lock:
+            if spell is None:
+                self._known.clear()
+                self._missing.clear()
+            else:
+                self._known.pop(spell, None)
+                self._missing.pop(spell, None)
+
+
+# プロセス全体で共有するインスタンス
+spell_cache = SpellCache()
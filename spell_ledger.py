@@ -0,0 +1,154 @@
+import time
+
+import exp_stats
+from storage import utc_timestamp
+
+# 台帳に読み込む列（履歴の表示は checkin_history が別にページごとに読む）
+LEDGER_COLUMNS = "id, place, exp, request_id"
+
+# この秒数を過ぎたら、次に読むときに spell_stats の1行を読み直す
+LEDGER_MAX_AGE = 60
+
+
+class SpellLedger:
+    """
+    1つのじゅもんのチェックインをセッションの間メモリに持っておく台帳
+    経験値の合計とチェックイン回数は spell_stats の1行（主キー検索1回）から答える
+    records の行は、場所ごとの回数や履歴を聞かれたときに初めて読む（場所ごとなら (spell, place) の索引で引く）
+    チェックインは手元の台帳に足し、リモートには queue（write_queue.CheckinQueue）経由で後から書く
+    queue を渡さなければ record_checkin でその場で書く
+    別の端末から同じじゅもんでチェックインされて spell_stats の visits が見込みと合わなくなったら、読んだ行を捨てて読み直す
+    """
+
+    def __init__(self, supabase, spell, max_age=LEDGER_MAX_AGE, queue=None):
+        self.supabase = supabase
+        self.spell = spell
+        self.max_age = max_age
+        self.queue = queue
+        self._remote = None     # spell_stats の {'total_exp', 'level', 'visits'}（送信済みの分）
+        self._pending = {}      # まだ queue から送られていないチェックイン（request_id -> 行）
+        self._records = None    # このじゅもんの records 全体（読んでいなければ None）
+        self._by_place = {}     # 場所 -> その場所の records
+        self._checked_at = 0.0
+        self._stale = True
+
+    def load(self):
+        """spell_stats からこのじゅもんの集計を読み直す"""
+        self._prune_pending()
+        expected = None if self._remote is None else self._remote["visits"]
+        self._remote = exp_stats.get_stats(self.supabase, self.spell)
+        self._checked_at = time.time()
+        self._stale = False
+        # 読んでいる間に送られた行は、今読んだ集計に入っているかどうか分からないので、もう一度読み直す
+        if self._prune_pending(count_sent=False):
+            self._stale = True
+        if expected is not None and self._remote["visits"] != expected:
+            # 別の端末からのチェックインがあった。読んだ records は古いので捨てる
+            self._records = None
+            self._by_place = {}
+
+    def is_stale(self) -> bool:
+        """まだ読んでいないか、max_age 秒より前に読んだものなら True"""
+        return self._stale or time.time() - self._checked_at > self.max_age
+
+    def _prune_pending(self, count_sent=True) -> bool:
+        """送信済みになった行を送信待ちから外す。count_sent なら手元の集計に足す。外した行があれば True"""
+        if self.queue is None or not self._pending:
+            return False
+        still = self.queue.pending_ids(self.spell)
+        sent = [r for rid, r in self._pending.items() if rid not in still]
+        if not sent:
+            return False
+        self._pending = {rid: r for rid, r in self._pending.items() if rid in still}
+        if count_sent and self._remote is not None:
+            self._add_remote(sum(r["exp"] for r in sent), len(sent))
+        return True
+
+    def _add_remote(self, exp, visits):
+        total = self._remote["total_exp"] + exp
+        self._remote = {
+            "total_exp": total,
+            "level": total // exp_stats.EXP_PER_LEVEL,
+            "visits": self._remote["visits"] + visits,
+        }
+
+    def _ensure_fresh(self):
+        if self.is_stale():
+            self.load()
+
+    def total_exp(self) -> int:
+        self._ensure_fresh()
+        self._prune_pending()
+        return self._remote["total_exp"] + sum(r["exp"] for r in self._pending.values())
+
+    def level(self) -> int:
+        return self.total_exp() // exp_stats.EXP_PER_LEVEL
+
+    def visits(self) -> int:
+        self._ensure_fresh()
+        self._prune_pending()
+        return self._remote["visits"] + len(self._pending)
+
+    def visit_count(self, place) -> int:
+        return len(self.records(place))
+
+    def _with_pending(self, rows, place=None):
+        # まだ送信待ちのチェックインはリモートに無いので、手元の分を足す
+        sent = {r.get("request_id") for r in rows}
+        rows.extend(r for rid, r in self._pending.items()
+                    if rid not in sent and (place is None or r["place"] == place))
+        return rows
+
+    def records(self, place=None) -> list:
+        """このじゅもんの records（place を渡すとその場所の分だけ）。初めて聞かれたときに読む"""
+        self._ensure_fresh()
+        if place is None:
+            if self._records is None:
+                response = self.supabase.table("records").select(LEDGER_COLUMNS).eq("spell", self.spell).execute()
+                self._records = self._with_pending(list(response.data))
+            return list(self._records)
+        rows = self._by_place.get(place)
+        if rows is None:
+            if self._records is not None:
+                rows = [r for r in self._records if r["place"] == place]
+            else:
+                response = (self.supabase.table("records").select(LEDGER_COLUMNS)
+                            .eq("spell", self.spell).eq("place", place).execute())
+                rows = self._with_pending(list(response.data), place)
+            self._by_place[place] = rows
+        return list(rows)
+
+    def pending_records(self) -> list:
+        """まだ queue から送られていないチェックインを新しい順に返す"""
+        self._prune_pending()
+        return list(reversed(self._pending.values()))
+
+    def add(self, place, exp) -> dict:
+        """
+        チェックインを記録する
+        queue があれば送信待ちに入れてすぐ戻り、なければ record_checkin の1回でリモートに書く
+        戻り値: 更新後の {'total_exp', 'level', 'visits'}
+        """
+        row = {
+            "place": place,
+            "exp": exp,
+            "spell": self.spell,
+            "created_at": utc_timestamp(),
+        }
+        self._ensure_fresh()
+        if self.queue is not None:
+            row["request_id"] = self.queue.enqueue(self.spell, place, exp)
+            self._pending[row["request_id"]] = row
+        else:
+            expected = self._remote["visits"] + 1
+            self._remote = exp_stats.record_checkin(self.supabase, self.spell, place, exp)
+            # 手元の見込みとリモートの件数が食い違ったら、他の端末からも書かれているので読んだ行を捨てる
+            if self._remote["visits"] != expected:
+                self._records = None
+                self._by_place = {}
+        if self._records is not None:
+            self._records.append(row)
+        if place in self._by_place:
+            self._by_place[place].append(row)
+        total = self.total_exp()
+        return {"total_exp": total, "level": total // exp_stats.EXP_PER_LEVEL, "visits": self.visits()}
@@ -0,0 +1,4 @@
+-- ランキング（leaderboard.py）用。sql/spell_stats.sql の後に Supabase の SQL Editor で実行する
+
+-- 更新された spell_stats の行だけを読み足すための索引
+create index if not exists spell_stats_updated_at_idx on public.spell_stats (updated_at);
@@ -0,0 +1,10 @@
+-- place テーブルへの一括投入（place_ingest.py）用。Supabase の SQL Editor で実行する
+
+-- Google の place_id と、重複判定のキー（気分|place_id か 気分|geohash:名前）
+alter table public.place add column if not exists place_id text;
+alter table public.place add column if not exists dedupe_key text;
+
+-- upsert(on_conflict="dedupe_key") のための一意索引
+-- 手で登録した既存の行は dedupe_key が null のまま。place_ingest.py が投入のたびに気分・名前・距離で
+-- 同じ場所の行を探し、見つかればその行に place_id と dedupe_key を書き足すので、同じ場所の行は増えない
+create unique index if not exists place_dedupe_key_key on public.place (dedupe_key);
@@ -0,0 +1,5 @@
+-- 推薦コメントの事前生成（recommend_pregen.py）用。Supabase の SQL Editor で実行する
+
+-- 生成したコメントと、どのモデル・プロンプトの版で作ったか（recommend.cache_key）
+alter table public.place add column if not exists recommendation text;
+alter table public.place add column if not exists recommendation_key text;
@@ -0,0 +1,40 @@
+-- チェックインの書き込みキュー（write_queue.py）用。sql/spell_stats.sql の後に Supabase の SQL Editor で実行する
+
+-- クライアントが発行する冪等キー。再送しても同じチェックインが二重に入らない
+alter table public.records add column if not exists request_id uuid;
+create unique index if not exists records_request_id_key on public.records (request_id);
+
+-- 複数のチェックインをまとめて追加し、新しく入った行の分だけ spell_stats を増やす
+-- p_rows: [{"request_id": "...", "spell": "...", "place": "...", "exp": 20}, ...]
+-- 戻り値: 新しく追加された行数（再送で既に入っていた行は数えない）
+create or replace function public.record_checkins(p_rows jsonb)
+returns integer
+language plpgsql
+as $$
+declare
+    n integer;
+begin
+    with ins as (
+        insert into public.records (request_id, place, exp, spell)
+        select (r->>'request_id')::uuid, r->>'place', (r->>'exp')::integer, r->>'spell'
+        from jsonb_array_elements(p_rows) as r
+        on conflict (request_id) do nothing
+        returning spell, exp
+    ), agg as (
+        select spell, sum(exp)::integer as total, count(*)::integer as cnt
+        from ins
+        group by spell
+    ), up as (
+        insert into public.spell_stats as s (spell, total_exp, level, visits, updated_at)
+        select spell, total, total / 100, cnt, now() from agg
+        on conflict (spell) do update
+            set total_exp  = s.total_exp + excluded.total_exp,
+                level      = (s.total_exp + excluded.total_exp) / 100,
+                visits     = s.visits + excluded.visits,
+                updated_at = now()
+    )
+    select count(*) into n from ins;
+
+    return n;
+end;
+$$;
@@ -0,0 +1,69 @@
+-- じゅもん（spell）ごとの経験値の集計テーブルと、チェックイン用の関数
+-- Supabase の SQL Editor で実行する
+
+create table if not exists public.spell_stats (
+    spell      text primary key,
+    total_exp  integer     not null default 0,
+    level      integer     not null default 0,
+    visits     integer     not null default 0,
+    updated_at timestamptz not null default now()
+);
+
+create index if not exists records_spell_idx on public.records (spell);
+
+-- records への追加と spell_stats の更新を1つのトランザクションで行う
+create or replace function public.record_checkin(p_spell text, p_place text, p_exp integer)
+returns public.spell_stats
+language plpgsql
+as $$
+declare
+    result public.spell_stats;
+begin
+    insert into public.records (place, exp, spell) values (p_place, p_exp, p_spell);
+
+    insert into public.spell_stats as s (spell, total_exp, level, visits, updated_at)
+    values (p_spell, p_exp, p_exp / 100, 1, now())
+    on conflict (spell) do update
+        set total_exp  = s.total_exp + excluded.total_exp,
+            level      = (s.total_exp + excluded.total_exp) / 100,
+            visits     = s.visits + 1,
+            updated_at = now()
+    returning * into result;
+
+    return result;
+end;
+$$;
+
+-- records から spell_stats を作り直す（p_spell が null なら全員分）。更新した行数を返す
+create or replace function public.rebuild_spell_stats(p_spell text default null)
+returns integer
+language plpgsql
+as $$
+declare
+    n integer;
+begin
+    insert into public.spell_stats as s (spell, total_exp, level, visits, updated_at)
+    select r.spell, coalesce(sum(r.exp), 0), coalesce(sum(r.exp), 0) / 100, count(*), now()
+    from public.records r
+    where p_spell is null or r.spell = p_spell
+    group by r.spell
+    on conflict (spell) do update
+        set total_exp  = excluded.total_exp,
+            level      = excluded.level,
+            visits     = excluded.visits,
+            updated_at = now();
+    get diagnostics n = row_count;
+
+    -- records が1件も無くなったじゅもんは 0 に戻す
+    update public.spell_stats s
+    set total_exp = 0, level = 0, visits = 0, updated_at = now()
+    where (p_spell is null or s.spell = p_spell)
+      and not exists (select 1 from public.records r where r.spell = s.spell);
+
+    return n;
+end;
+$$;
+
+-- すでにある records から全員分の集計を作る（これを流さないと、既存のじゅもんは経験値 0 に見える）
+-- 何度流しても同じ結果になる
+select public.rebuild_spell_stats();
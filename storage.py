@@ -0,0 +1,361 @@
+# データの保存先（ストレージ）を切り替えるためのモジュール
+#
+# アプリの各モジュールは Supabase のクライアントを受け取り、次の操作だけを使っている
+# これをストレージのインターフェースとし、同じ操作ができるものなら何でも差し替えられる
+#
+#     client.table(name)
+#         .select(columns) / .insert(rows) / .upsert(rows, on_conflict=...) / .update(values)
+#         .eq(col, v) / .in_(col, values) / .lt(col, v) / .gt(col, v) / .gte(col, v)
+#         .order(col, desc=False) / .limit(n)
+#         .execute()  -> .data に行（辞書）のリスト
+#     client.rpc("record_checkin" | "record_checkins" | "rebuild_spell_stats", params).execute()
+#
+# STORAGE_BACKEND=sqlite にすると Supabase の代わりに手元の SQLite ファイル（SQLITE_PATH）を使う
+# オフラインでの動作確認や、ネットワークを挟まない負荷試験に使える
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Protocol
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase")
+SQLITE_PATH = os.getenv("SQLITE_PATH", os.path.join(".cache", "machiquest.sqlite3"))
+
+EXP_PER_LEVEL = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS status (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    spell TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    place TEXT,
+    exp INTEGER NOT NULL,
+    spell TEXT NOT NULL,
+    request_id TEXT UNIQUE
+);
+CREATE INDEX IF NOT EXISTS records_spell_idx ON records (spell);
+CREATE INDEX IF NOT EXISTS records_spell_place_idx ON records (spell, place);
+CREATE TABLE IF NOT EXISTS place (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    name TEXT,
+    url TEXT,
+    lat REAL,
+    lon REAL,
+    mood TEXT,
+    area TEXT,
+    time TEXT,
+    place_id TEXT,
+    dedupe_key TEXT,
+    recommendation TEXT,
+    recommendation_key TEXT
+);
+CREATE INDEX IF NOT EXISTS place_mood_area_idx ON place (mood, area);
+CREATE TABLE IF NOT EXISTS spell_stats (
+    spell TEXT PRIMARY KEY,
+    total_exp INTEGER NOT NULL DEFAULT 0,
+    level INTEGER NOT NULL DEFAULT 0,
+    visits INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS spell_stats_updated_at_idx ON spell_stats (updated_at);
+"""
+
+# 後から足した列。古いファイルには ALTER TABLE で足してから索引を張る
+MIGRATIONS = {
+    "place": [("place_id", "TEXT"), ("dedupe_key", "TEXT"), ("recommendation", "TEXT"), ("recommendation_key", "TEXT")],
+}
+INDEXES = """
+CREATE UNIQUE INDEX IF NOT EXISTS place_dedupe_key_idx ON place (dedupe_key);
+"""
+
+_IDENT = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def _ident(name):
+    # 列名・表名は SQL に直接埋め込むので、英数字とアンダースコアだけを許す
+    name = name.strip()
+    if not _IDENT.match(name):
+        raise ValueError(f"不正な列名です: {name!r}")
+    return name
+
+
+def utc_timestamp(dt=None) -> str:
+    """
+    dt（省略すると今）を UTC の ISO 形式の文字列にする（例: 2026-01-01T09:30:00.123Z）
+    列の既定値 strftime('%Y-%m-%dT%H:%M:%fZ', 'now') と同じ形なので、文字列のまま大小を比べられる
+    """
+    dt = datetime.now(timezone.utc) if dt is None else dt.astimezone(timezone.utc)
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.") + f"{dt.microsecond // 1000:03d}Z"
+
+
+def _now():
+    return utc_timestamp()
+
+
+class Storage(Protocol):
+    """
+    このモジュールの先頭に書いたインターフェース（Supabase のクライアントと SQLiteStorage のどちらも満たす）
+    型注釈に使う。これだけなら supabase パッケージは要らない
+    """
+
+    def table(self, name): ...
+
+    def rpc(self, name, params=None): ...
+
+
+class StorageError(Exception):
+    """SQLite バックエンドのエラー。メッセージは Supabase（PostgreSQL）に合わせてある"""
+
+
+class Response:
+    def __init__(self, data):
+        self.data = data
+
+
+class _Query:
+    def __init__(self, storage, table):
+        self.storage = storage
+        self.table = _ident(table)
+        self.columns = "*"
+        self.where = []
+        self.params = []
+        self.order_by = None
+        self.limit_n = None
+        self.rows = None
+        self.on_conflict = None
+        self.action = "select"
+
+    def select(self, columns="*"):
+        self.columns = "*" if columns.strip() == "*" else ", ".join(_ident(c) for c in columns.split(","))
+        return self
+
+    def insert(self, rows):
+        self.action = "insert"
+        self.rows = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def upsert(self, rows, on_conflict="id"):
+        self.action = "upsert"
+        self.rows = rows if isinstance(rows, list) else [rows]
+        self.on_conflict = [_ident(c) for c in on_conflict.split(",")]
+        return self
+
+    def update(self, values):
+        """条件（eq など）に合う行の values の列だけを書き換える。条件が無ければ全行"""
+        self.action = "update"
+        self.rows = [dict(values)]
+        return self
+
+    def _cond(self, col, op, value):
+        self.where.append(f"{_ident(col)} {op} ?")
+        self.params.append(value)
+        return self
+
+    def eq(self, col, value):
+        return self._cond(col, "=", value)
+
+    def lt(self, col, value):
+        return self._cond(col, "<", value)
+
+    def gt(self, col, value):
+        return self._cond(col, ">", value)
+
+    def gte(self, col, value):
+        return self._cond(col, ">=", value)
+
+    def in_(self, col, values):
+        values = list(values)
+        self.where.append(f"{_ident(col)} IN ({', '.join('?' for _ in values)})" if values else "0")
+        self.params.extend(values)
+        return self
+
+    def order(self, col, desc=False):
+        self.order_by = f"{_ident(col)} {'DESC' if desc else 'ASC'}"
+        return self
+
+    def limit(self, n):
+        self.limit_n = int(n)
+        return self
+
+    def execute(self):
+        with self.storage.connect() as conn:
+            if self.action == "select":
+                sql = f"SELECT {self.columns} FROM {self.table}"
+                if self.where:
+                    sql += " WHERE " + " AND ".join(self.where)
+                if self.order_by:
+                    sql += f" ORDER BY {self.order_by}"
+                if self.limit_n is not None:
+                    sql += f" LIMIT {self.limit_n}"
+                return Response([dict(r) for r in conn.execute(sql, self.params)])
+            if self.action == "update":
+                return Response(self._update(conn, self.rows[0]))
+            return Response([self._write(conn, row) for row in self.rows])
+
+    def _update(self, conn, values):
+        # Supabase と同じく書き換えた行を返す（書き換える列が条件に入っていてもよいように、先に対象を決める）
+        where = (" WHERE " + " AND ".join(self.where)) if self.where else ""
+        rowids = [r[0] for r in conn.execute(f"SELECT rowid FROM {self.table}{where}", self.params)]
+        if not rowids or not values:
+            return []
+        cols = [_ident(c) for c in values]
+        marks = ", ".join("?" for _ in rowids)
+        try:
+            conn.execute(
+                f"UPDATE {self.table} SET {', '.join(f'{c} = ?' for c in cols)} WHERE rowid IN ({marks})",
+                list(values.values()) + rowids
+            )
+        except sqlite3.IntegrityError as e:
+            raise StorageError(str(e)) from e
+        return [dict(r) for r in conn.execute(f"SELECT * FROM {self.table} WHERE rowid IN ({marks})", rowids)]
+
+    def _write(self, conn, row):
+        row = dict(row)
+        cols = [_ident(c) for c in row]
+        sql = f"INSERT INTO {self.table} ({', '.join(cols)}) VALUES ({', '.join('?' for _ in cols)})"
+        if self.action == "upsert":
+            updates = [c for c in cols if c not in self.on_conflict]
+            sql += f" ON CONFLICT ({', '.join(self.on_conflict)}) DO "
+            sql += ("UPDATE SET " + ", ".join(f"{c} = excluded.{c}" for c in updates)) if updates else "NOTHING"
+        try:
+            cur = conn.execute(sql, list(row.values()))
+        except sqlite3.IntegrityError as e:
+            if "UNIQUE" in str(e):
+                raise StorageError(f"duplicate key value violates unique constraint ({e})") from e
+            raise StorageError(str(e)) from e
+        if cur.lastrowid and "id" not in row:
+            row["id"] = cur.lastrowid
+        return row
+
+
+class _Rpc:
+    def __init__(self, storage, name, params):
+        self.storage = storage
+        self.name = name
+        self.params = params
+
+    def execute(self):
+        fn = getattr(self.storage, f"_rpc_{self.name}", None)
+        if fn is None:
+            raise StorageError(f"関数 {self.name} はありません")
+        with self.storage.connect() as conn:
+            return Response(fn(conn, **self.params))
+
+
+class SQLiteStorage:
+    """
+    Supabase クライアントと同じ操作ができる SQLite のストレージ
+    records / status / place / spell_stats を1つのファイルに持ち、
+    (spell)、(spell, place)、(mood, area) に索引を張ってある。place の dedupe_key は一意
+    rpc の record_checkin / record_checkins / rebuild_spell_stats も sql/*.sql と同じ動きをする
+    """
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            for table, columns in MIGRATIONS.items():
+                existing = {r["name"] for r in conn.execute(f"PRAGMA table_info({table})")}
+                for name, decl in columns:
+                    if name not in existing:
+                        conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+            conn.executescript(INDEXES)
+
+    @contextmanager
+    def connect(self):
+        """with で使う。抜けるときにコミット（例外ならロールバック）して接続を閉じる"""
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def table(self, name):
+        return _Query(self, name)
+
+    def rpc(self, name, params=None):
+        return _Rpc(self, name, params or {})
+
+    def _add_stats(self, conn, spell, exp, visits):
+        conn.execute(
+            "INSERT INTO spell_stats (spell, total_exp, level, visits, updated_at) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (spell) DO UPDATE SET"
+            "  total_exp = total_exp + excluded.total_exp,"
+            f"  level = (total_exp + excluded.total_exp) / {EXP_PER_LEVEL},"
+            "  visits = visits + excluded.visits,"
+            "  updated_at = excluded.updated_at",
+            (spell, exp, exp // EXP_PER_LEVEL, visits, _now())
+        )
+
+    def _rpc_record_checkin(self, conn, p_spell, p_place, p_exp):
+        conn.execute(
+            "INSERT INTO records (created_at, place, exp, spell) VALUES (?, ?, ?, ?)",
+            (_now(), p_place, p_exp, p_spell)
+        )
+        self._add_stats(conn, p_spell, p_exp, 1)
+        row = conn.execute("SELECT * FROM spell_stats WHERE spell = ?", (p_spell,)).fetchone()
+        return dict(row)
+
+    def _rpc_record_checkins(self, conn, p_rows):
+        inserted = 0
+        for r in p_rows:
+            cur = conn.execute(
+                "INSERT INTO records (created_at, place, exp, spell, request_id) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (request_id) DO NOTHING",
+                (_now(), r["place"], r["exp"], r["spell"], r["request_id"])
+            )
+            if cur.rowcount:
+                self._add_stats(conn, r["spell"], r["exp"], 1)
+                inserted += 1
+        return inserted
+
+    def _rpc_rebuild_spell_stats(self, conn, p_spell=None):
+        where, params = ("WHERE spell = ?", [p_spell]) if p_spell is not None else ("", [])
+        rows = conn.execute(
+            f"SELECT spell, SUM(exp) AS total, COUNT(*) AS cnt FROM records {where} GROUP BY spell", params
+        ).fetchall()
+        if p_spell is None:
+            conn.execute("UPDATE spell_stats SET total_exp = 0, level = 0, visits = 0")
+        else:
+            conn.execute("UPDATE spell_stats SET total_exp = 0, level = 0, visits = 0 WHERE spell = ?", (p_spell,))
+        for r in rows:
+            conn.execute(
+                "INSERT INTO spell_stats (spell, total_exp, level, visits, updated_at) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (spell) DO UPDATE SET total_exp = excluded.total_exp, level = excluded.level,"
+                " visits = excluded.visits, updated_at = excluded.updated_at",
+                (r["spell"], r["total"], r["total"] // EXP_PER_LEVEL, r["cnt"], _now())
+            )
+        return len(rows)
+
+
+_sqlite_storages = {}
+_lock = threading.Lock()
+
+
+def get_storage(url=None, key=None, backend=None) -> Storage:
+    """
+    STORAGE_BACKEND（または backend）に応じて Supabase クライアントか SQLiteStorage を返す
+    どちらもプロセスで1つだけ作って使い回す
+    """
+    backend = backend or STORAGE_BACKEND
+    if backend == "sqlite":
+        with _lock:
+            storage = _sqlite_storages.get(SQLITE_PATH)
+            if storage is None:
+                storage = SQLiteStorage(SQLITE_PATH)
+                _sqlite_storages[SQLITE_PATH] = storage
+            return storage
+    from clients import get_supabase
+    return get_supabase(url, key)
@@ -0,0 +1,77 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+# モジュールを読み込んだ時点でキャッシュファイルや Google のクライアントを作るので、その前に設定しておく
+# キーは形式だけ合わせたもの（テストでは Google を呼ばない）
+_CACHE_DIR = tempfile.mkdtemp(prefix="machiquest-test-")
+os.environ.setdefault("GOOGLE_MAPS_API_KEY", "AIza-test")
+os.environ["GEOCODE_CACHE_PATH"] = os.path.join(_CACHE_DIR, "geocode.sqlite3")
+os.environ["RECOMMEND_CACHE_PATH"] = os.path.join(_CACHE_DIR, "recommend.sqlite3")
+os.environ["CHECKIN_SPOOL_PATH"] = os.path.join(_CACHE_DIR, "checkin_spool.sqlite3")
+os.environ["INGEST_CHECKPOINT_PATH"] = os.path.join(_CACHE_DIR, "place_ingest.json")
+
+from storage import SQLiteStorage  # noqa: E402
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return SQLiteStorage(str(tmp_path / "machiquest.sqlite3"))
+
+
+class FakeOpenAI:
+    """
+    chat.completions.create だけを持つ OpenAI クライアントの代わり
+    1件ずつの依頼には「<場所>のコメント」を返し、まとめての依頼（response_format 付き）には全部の番号の分を返す
+    stream=True なら1文字ずつのチャンクで返す。fail に入れた場所は例外にする
+    """
+
+    def __init__(self, fail=(), delay=0.0):
+        self.fail = set(fail)
+        self.delay = delay
+        self.requests = []
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, messages, response_format=None, stream=False, **kwargs):
+        prompt = messages[-1]["content"]
+        with self._lock:
+            self.requests.append(prompt)
+        if self.delay:
+            time.sleep(self.delay)
+        usage = SimpleNamespace(prompt_tokens=10, completion_tokens=5)
+        if response_format is not None:
+            places = [line.split(". ", 1)[1] for line in prompt.splitlines() if re.match(r"^\d+\. ", line)]
+            content = json.dumps({"comments": [
+                {"index": i, "comment": f"{p}のコメント"} for i, p in enumerate(places, 1) if p not in self.fail
+            ]}, ensure_ascii=False)
+            return _completion(content, usage)
+        place = re.search(r"「(.+)」", prompt).group(1)
+        if place in self.fail:
+            raise RuntimeError(f"{place} の生成に失敗しました")
+        text = f"{place}のコメント"
+        if not stream:
+            return _completion(text, usage)
+        chunks = [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=c))], usage=None) for c in text]
+        return iter(chunks + [SimpleNamespace(choices=[], usage=usage)])
+
+
+def _completion(content, usage):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+
+@pytest.fixture
+def openai_client():
+    return FakeOpenAI()
+
+
+@pytest.fixture
+def recommendation_cache(tmp_path):
+    from recommend import RecommendationCache
+    return RecommendationCache(str(tmp_path / "recommend.sqlite3"))
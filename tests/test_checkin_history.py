@@ -0,0 +1,52 @@
+import exp_stats
+from checkin_history import HistoryPager, fetch_history_page
+
+
+def test_fetch_history_page_uses_keyset_cursor(storage):
+    for i in range(3):
+        exp_stats.record_checkin(storage, "abc", f"場所{i}", 10)
+    exp_stats.record_checkin(storage, "xyz", "別の人", 10)
+
+    rows, cursor = fetch_history_page(storage, "abc", limit=2)
+    assert [r["place"] for r in rows] == ["場所2", "場所1"]
+    rows, cursor = fetch_history_page(storage, "abc", before_id=cursor, limit=2)
+    assert [r["place"] for r in rows] == ["場所0"]
+    assert cursor is None
+
+
+def test_history_pager_pages_with_running_totals(storage):
+    for i, exp in enumerate((10, 20, 30)):
+        exp_stats.record_checkin(storage, "abc", f"場所{i}", exp)
+    pager = HistoryPager(storage, "abc", total_exp=60, page_size=2)
+    assert not pager.loaded
+
+    first = pager.load_more()
+    assert [(r["place"], r["running_total"]) for r in first] == [("場所2", 60), ("場所1", 30)]
+    assert pager.loaded and not pager.done
+
+    second = pager.load_more()
+    assert [(r["place"], r["running_total"]) for r in second] == [("場所0", 10)]
+    assert pager.done
+    assert pager.load_more() == []
+
+
+def test_history_pager_empty_history_is_loaded(storage):
+    pager = HistoryPager(storage, "abc", total_exp=0)
+    assert pager.load_more() == []
+    assert pager.loaded and pager.done
+
+
+def test_history_pager_replaces_delivered_pending_row(storage):
+    exp_stats.record_checkins(storage, [
+        {"request_id": "r1", "spell": "abc", "place": "博多駅", "exp": 10},
+        {"request_id": "r2", "spell": "abc", "place": "天神", "exp": 20},
+    ])
+    # r3 は送信待ちとして表示中に records へ届いた
+    pending = [{"request_id": "r3", "place": "中洲", "exp": 5, "created_at": "2026-01-01T00:00:00+00:00"}]
+    exp_stats.record_checkins(storage, [{"request_id": "r3", "spell": "abc", "place": "中洲", "exp": 5}])
+    pager = HistoryPager(storage, "abc", total_exp=35, pending=pending)
+    assert [r["place"] for r in pager.rows] == ["中洲"]
+
+    pager.load_more()
+    assert [(r["place"], r["running_total"]) for r in pager.rows] == [("中洲", 35), ("天神", 30), ("博多駅", 10)]
+    assert "id" in pager.rows[0]
@@ -0,0 +1,70 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import clients
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive で接続を使い回せるように
+
+    def do_GET(self):
+        body = b'{"status": "OK"}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(clients, "_clients", {})
+    monkeypatch.setattr(clients, "_counters", {})
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_registry_makes_one_client_per_key(registry):
+    made = []
+
+    def factory():
+        made.append(object())
+        return made[-1]
+
+    a = clients._get("x", "key1", factory)
+    assert clients._get("x", "key1", factory) is a
+    assert clients._get("x", "key2", factory) is not a
+    assert clients._get("y", "key1", factory) is not a
+    assert len(made) == 3
+
+
+def test_get_gmaps_is_shared(registry):
+    client = clients.get_gmaps("AIza-test")
+    assert clients.get_gmaps("AIza-test") is client
+    assert clients.get_gmaps("AIza-other") is not client
+    assert client.retry_over_query_limit is False
+
+
+def test_connection_stats_counts_reused_connections(registry, server):
+    client = clients.get_gmaps("AIza-test")
+    for _ in range(5):
+        assert client.session.get(server + "/maps").status_code == 200
+
+    assert clients.connection_stats() == {"gmaps": {"requests": 5, "connections": 1, "reused": 4}}
+
+
+def test_connection_stats_without_clients(registry):
+    assert clients.connection_stats() == {}
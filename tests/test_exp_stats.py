@@ -0,0 +1,45 @@
+import exp_stats
+
+
+def test_record_checkin_updates_stats(storage):
+    exp_stats.record_checkin(storage, "abc", "博多駅", 60)
+    stats = exp_stats.record_checkin(storage, "abc", "天神", 50)
+
+    assert stats == {"total_exp": 110, "level": 1, "visits": 2}
+    assert exp_stats.get_stats(storage, "abc") == stats
+    assert len(storage.table("records").select("*").eq("spell", "abc").execute().data) == 2
+
+
+def test_get_stats_without_checkins(storage):
+    assert exp_stats.get_stats(storage, "nobody") == exp_stats.EMPTY_STATS
+
+
+def test_rebuild_spell_stats_repairs_drift(storage):
+    exp_stats.record_checkin(storage, "abc", "博多駅", 70)
+    exp_stats.record_checkin(storage, "abc", "天神", 80)
+    exp_stats.record_checkin(storage, "xyz", "中洲", 20)
+    storage.table("spell_stats").upsert(
+        [{"spell": "abc", "total_exp": 0, "level": 0, "visits": 0, "updated_at": "2020-01-01T00:00:00Z"},
+         {"spell": "xyz", "total_exp": 999, "level": 9, "visits": 9, "updated_at": "2020-01-01T00:00:00Z"}],
+        on_conflict="spell",
+    ).execute()
+
+    assert exp_stats.rebuild(storage, "abc") == 1
+    assert exp_stats.get_stats(storage, "abc") == {"total_exp": 150, "level": 1, "visits": 2}
+    # spell を指定したときはほかのじゅもんに触らない
+    assert exp_stats.get_stats(storage, "xyz")["total_exp"] == 999
+
+    assert exp_stats.rebuild(storage) == 2
+    assert exp_stats.get_stats(storage, "xyz") == {"total_exp": 20, "level": 0, "visits": 1}
+
+
+def test_rebuild_backfills_spells_without_stats(storage):
+    # spell_stats ができる前からある records（移行直後の状態）
+    storage.table("records").insert([
+        {"spell": "old", "place": "博多駅", "exp": 60},
+        {"spell": "old", "place": "天神", "exp": 60},
+    ]).execute()
+    assert exp_stats.get_stats(storage, "old") == exp_stats.EMPTY_STATS
+
+    exp_stats.rebuild(storage)
+    assert exp_stats.get_stats(storage, "old") == {"total_exp": 120, "level": 1, "visits": 2}
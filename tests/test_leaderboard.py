@@ -0,0 +1,71 @@
+import exp_stats
+import leaderboard
+from leaderboard import Leaderboard, _shift
+
+
+def _stats(storage, spell, total_exp, updated_at):
+    storage.table("spell_stats").upsert(
+        [{"spell": spell, "total_exp": total_exp, "level": total_exp // 100, "visits": 1, "updated_at": updated_at}],
+        on_conflict="spell",
+    ).execute()
+
+
+def test_rank_and_ties():
+    board = Leaderboard()
+    for spell, exp in (("a", 50), ("b", 80), ("c", 50), ("d", 10)):
+        board.update(spell, exp)
+
+    assert [(e["rank"], e["total_exp"]) for e in board.top(4)] == [(1, 80), (2, 50), (2, 50), (4, 10)]
+    assert board.rank_of("b") == 1
+    assert board.rank_of("a") == board.rank_of("c") == 2
+    assert board.rank_of("nobody") is None
+
+    board.update("d", 90)
+    assert board.rank_of("d") == 1
+    assert board.rank_of("b") == 2
+    assert len(board) == 4
+
+
+def test_top_hides_spells_unless_revealed(storage):
+    storage.table("status").insert([{"spell": "abc"}, {"spell": "xyz"}]).execute()
+    exp_stats.record_checkin(storage, "abc", "博多駅", 30)
+    exp_stats.record_checkin(storage, "xyz", "天神", 20)
+    exp_stats.record_checkin(storage, "ghost", "中洲", 10)   # status に無いじゅもん
+    board = Leaderboard()
+    board.refresh(storage)
+
+    top = board.top(3)
+    assert [e["name"] for e in top] == ["勇者No.1", "勇者No.2", leaderboard.UNKNOWN_LABEL]
+    assert all("spell" not in e for e in top)
+    assert "abc" not in repr(top)
+    assert [e["spell"] for e in board.top(3, reveal=True)] == ["abc", "xyz", "ghost"]
+
+
+def test_refresh_rereads_overlap_window(storage):
+    _stats(storage, "a", 10, "2026-01-01T00:00:10.000Z")
+    _stats(storage, "b", 20, "2026-01-01T00:00:20.000Z")
+    board = Leaderboard()
+    assert board.refresh(storage) == 2
+
+    # 後からコミットされ、watermark より少し前の時刻を持つ行も拾う
+    _stats(storage, "c", 30, "2026-01-01T00:00:15.000Z")
+    assert board.refresh(storage) == 3
+    assert board.rank_of("c") == 1
+    # overlap より前の行は読み直さない
+    _stats(storage, "d", 40, "2026-01-01T00:00:05.000Z")
+    board.refresh(storage)
+    assert board.rank_of("d") is None
+
+
+def test_refresh_pages_through_equal_timestamps(storage, monkeypatch):
+    monkeypatch.setattr(leaderboard, "FETCH_PAGE_SIZE", 2)
+    for i in range(5):
+        _stats(storage, f"s{i}", i, "2026-01-01T00:00:00.000Z")
+    board = Leaderboard()
+    board.refresh(storage)
+    assert len(board) == 5
+
+
+def test_shift_keeps_storage_format():
+    assert _shift("2026-01-01T00:00:10.000Z", -10) == "2026-01-01T00:00:00.000Z"
+    assert _shift("2026-01-01T09:00:10+09:00", -10) == "2026-01-01T00:00:00.000Z"
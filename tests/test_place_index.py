@@ -0,0 +1,108 @@
+import math
+import time
+
+import numpy as np
+
+import place_index
+
+from place_index import PlaceIndex
+from scraper import haversine, offset_point
+
+BASE = (33.5902, 130.4207)
+
+
+def _row(i, distance_m, bearing_deg, mood="カフェ"):
+    lat, lon = offset_point(*BASE, distance_m, math.radians(bearing_deg))
+    return {"id": i, "name": f"場所{i}", "lat": lat, "lon": lon, "mood": mood, "area": "博多駅"}
+
+
+def test_ring_returns_rows_in_band_sorted():
+    index = PlaceIndex()
+    index.upsert([
+        _row(1, 300, 0), _row(2, 700, 90), _row(3, 550, 180), _row(4, 1500, 270),
+        _row(5, 800, 45, mood="公園"),
+    ])
+
+    hits = index.ring(*BASE, 500, 1000, mood="カフェ")
+    assert [row["id"] for row, _ in hits] == [3, 2]
+    assert all(500 <= dist <= 1000 for _, dist in hits)
+
+    assert [row["id"] for row, _ in index.ring(*BASE, 500, 1000)] == [3, 2, 5]
+    assert [row["id"] for row, _ in index.ring(*BASE, 500, 1000, limit=1)] == [3]
+
+
+def test_upsert_and_remove_replace_rows():
+    index = PlaceIndex()
+    index.upsert([_row(1, 300, 0)])
+    index.upsert([_row(1, 1500, 0)])
+    assert len(index) == 1
+    assert index.ring(*BASE, 0, 1000) == []
+
+    index.remove([1])
+    assert len(index) == 0
+
+
+def test_nearest_matches_brute_force():
+    rng = np.random.default_rng(0)
+    rows = [_row(i, float(d), float(b)) for i, (d, b) in
+            enumerate(zip(rng.uniform(0, 5000, 300), rng.uniform(0, 360, 300)))]
+    index = PlaceIndex()
+    index.upsert(rows)
+
+    for origin in (BASE, offset_point(*BASE, 2000, 1.0), offset_point(*BASE, 8000, 3.0)):
+        hits = index.nearest(*origin, k=7)
+        expected = sorted(rows, key=lambda r: haversine(origin[0], origin[1], r["lat"], r["lon"]))[:7]
+        assert [row["id"] for row, _ in hits] == [r["id"] for r in expected]
+
+
+def test_nearest_with_few_rows_and_mood():
+    index = PlaceIndex()
+    assert index.nearest(*BASE, k=3) == []
+
+    index.upsert([_row(1, 300, 0), _row(2, 100, 0, mood="公園")])
+    assert [row["id"] for row, _ in index.nearest(*BASE, k=3)] == [2, 1]
+    assert [row["id"] for row, _ in index.nearest(*BASE, k=3, mood="カフェ")] == [1]
+
+
+def test_locate_averages_area_rows():
+    index = PlaceIndex()
+    index.upsert([_row(1, 300, 0), _row(2, 300, 180)])
+
+    lat, lon = index.locate("博多駅")
+    assert haversine(lat, lon, *BASE) < 5
+    assert index.locate("天神") is None
+
+
+def _insert(storage, *rows):
+    return storage.table("place").insert([{k: v for k, v in r.items() if k != "id"} for r in rows]).execute().data
+
+
+def test_refresh_reads_new_rows_incrementally(storage, monkeypatch):
+    _insert(storage, _row(0, 300, 0))
+    index = place_index.load_place_index(storage)
+    assert len(index) == 1
+
+    _insert(storage, _row(0, 700, 90))
+    assert index.refresh(storage) == 1
+    assert [row["id"] for row, _ in index.ring(*BASE, 0, 1000)] == [1, 2]
+
+
+def test_refresh_reloads_edited_and_deleted_rows(storage, monkeypatch):
+    _insert(storage, _row(0, 300, 0), _row(0, 700, 90))
+    index = place_index.PlaceIndex(reload_interval=60)
+    index.refresh(storage)
+
+    # id の増えない書き換えと削除
+    moved = _row(1, 1500, 0)
+    storage.table("place").upsert([moved], on_conflict="id").execute()
+    with storage.connect() as conn:
+        conn.execute("DELETE FROM place WHERE id = 2")
+    index.refresh(storage)
+    assert len(index) == 2
+
+    now = time.time()
+    monkeypatch.setattr(place_index.time, "time", lambda: now + 61)
+    assert index.refresh(storage) == 1
+    assert len(index) == 1
+    assert index.ring(*BASE, 0, 1000) == []
+    assert [row["id"] for row, _ in index.ring(*BASE, 1000, 2000)] == [1]
@@ -0,0 +1,134 @@
+import pytest
+
+import place_ingest
+import place_index
+from place_index import PlaceIndex
+from place_ingest import ingest, ingest_search, load_checkpoint, normalize_row
+from storage import StorageError
+
+
+class FailAfter:
+    """upsert を n 回だけ通し、その後は失敗するストレージ（途中で止まった投入の再現用）"""
+
+    def __init__(self, storage, n):
+        self.storage = storage
+        self.left = n
+
+    def table(self, name):
+        query = self.storage.table(name)
+        upsert = query.upsert
+
+        def limited(rows, on_conflict="id"):
+            if self.left <= 0:
+                raise StorageError("接続が切れました")
+            self.left -= 1
+            return upsert(rows, on_conflict)
+
+        query.upsert = limited
+        return query
+
+
+def _spots(n):
+    return [{"name": f"場所 {i}", "lat": 33.59 + i * 0.001, "lon": 130.42, "place_id": f"P{i}"} for i in range(n)]
+
+
+def _rows(n):
+    rows = [normalize_row(spot, "カフェ", "博多駅", 30) for spot in _spots(n)]
+    # 名前の無い行と重複した行も混ぜる
+    return rows[:3] + [normalize_row({"name": "", "lat": 0, "lon": 0}, "カフェ", "博多駅")] + rows[3:] + rows[:1]
+
+
+def _names(storage):
+    return sorted(r["name"] for r in storage.table("place").select("name").execute().data)
+
+
+def test_ingest_resumes_from_checkpoint(storage, tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    rows = _rows(7)
+
+    with pytest.raises(StorageError):
+        ingest(FailAfter(storage, 2), iter(rows), batch_size=2, checkpoint_path=path, source="snap-1")
+    assert load_checkpoint(path)["written"] == 4
+    assert len(_names(storage)) == 4
+
+    stats = ingest(storage, iter(rows), batch_size=2, checkpoint_path=path, source="snap-1")
+    # 書き終えた分（名前の無い行を含む 5 件）は読み飛ばす
+    assert stats["read"] == len(rows) - 5
+    assert stats["duplicates"] == 1
+    assert stats["written"] == 3
+    assert _names(storage) == [f"場所 {i}" for i in range(7)]
+    assert load_checkpoint(path)["written"] == 7
+
+
+def test_ingest_restarts_for_different_source(storage, tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    ingest(storage, iter(_rows(3)), batch_size=2, checkpoint_path=path, source="snap-1")
+
+    stats = ingest(storage, iter(_rows(3)), batch_size=2, checkpoint_path=path, source="snap-2")
+    assert stats["read"] == 5
+    # dedupe_key で上書きされるだけで行は増えない
+    assert len(_names(storage)) == 3
+
+
+def test_ingest_attaches_to_curated_row(storage):
+    storage.table("place").insert([
+        {"name": "カフェ　博多", "url": "https://example.com", "lat": 33.5900, "lon": 130.4200,
+         "mood": "カフェ", "area": "博多駅", "time": "30分"},
+    ]).execute()
+    spots = [
+        {"name": "カフェ 博多", "lat": 33.5905, "lon": 130.4200, "place_id": "P1"},
+        # 同じ名前でも遠ければ別の場所
+        {"name": "カフェ 博多", "lat": 33.6100, "lon": 130.4200, "place_id": "P2"},
+    ]
+
+    stats = ingest(storage, (normalize_row(s, "カフェ", "博多駅", 30) for s in spots))
+    assert stats["matched"] == 1
+    rows = storage.table("place").select("*").order("id").execute().data
+    assert len(rows) == 2
+    # 手で登録した行の中身は残し、place_id と dedupe_key だけを書き足す
+    assert rows[0]["url"] == "https://example.com"
+    assert (rows[0]["place_id"], rows[0]["dedupe_key"]) == ("P1", "カフェ|P1")
+    assert rows[1]["place_id"] == "P2"
+
+    # 2回目は dedupe_key で見つかるので書き足しも増えもしない
+    stats = ingest(storage, (normalize_row(s, "カフェ", "博多駅", 30) for s in spots))
+    assert stats["matched"] == 0
+    assert len(storage.table("place").select("id").execute().data) == 2
+
+
+def test_ingest_search_checkpoints_queries(storage, tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    spots = _spots(4)
+    results = [
+        (place_ingest.query_key("博多駅", "カフェ", 30), [normalize_row(s, "カフェ", "博多駅", 30) for s in spots[:2]]),
+        (place_ingest.query_key("天神", "カフェ", 30), [normalize_row(s, "カフェ", "天神", 30) for s in spots[2:]]),
+    ]
+
+    with pytest.raises(StorageError):
+        ingest_search(FailAfter(storage, 1), iter(results), batch_size=2, checkpoint_path=path)
+    assert load_checkpoint(path)["queries"] == [results[0][0]]
+
+    done = set(load_checkpoint(path)["queries"])
+    stats = ingest_search(storage, (r for r in results if r[0] not in done), batch_size=2, checkpoint_path=path)
+    assert stats["written"] == 2
+    assert load_checkpoint(path)["queries"] == [results[0][0], results[1][0]]
+    assert _names(storage) == [f"場所 {i}" for i in range(4)]
+
+
+def test_ingest_updates_are_visible_after_reload(storage, monkeypatch):
+    storage.table("place").insert([
+        {"name": "カフェ　博多", "lat": 33.5900, "lon": 130.4200, "mood": "カフェ", "area": "博多駅"},
+    ]).execute()
+    now = [1000.0]
+    monkeypatch.setattr(place_index.time, "time", lambda: now[0])
+    index = PlaceIndex(reload_interval=60)
+    index.refresh(storage)
+
+    ingest(storage, [normalize_row({"name": "カフェ 博多", "lat": 33.5905, "lon": 130.42, "place_id": "P1"},
+                                   "カフェ", "博多駅", 30)])
+    # id は増えないので、読み直すまで書き足しは見えない
+    index.refresh(storage)
+    assert index._rows[1].get("place_id") is None
+    now[0] += 61
+    index.refresh(storage)
+    assert index._rows[1]["place_id"] == "P1"
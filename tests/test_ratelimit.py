@@ -0,0 +1,28 @@
+import threading
+import time
+
+from ratelimit import TokenBucket
+
+
+def test_burst_then_rate():
+    bucket = TokenBucket(rate=20, capacity=3)
+    started = time.monotonic()
+    for _ in range(3):
+        bucket.acquire()
+    assert time.monotonic() - started < 0.03
+
+    for _ in range(2):
+        bucket.acquire()
+    # バーストを使い切った後は 1/20 秒に1つずつ
+    assert time.monotonic() - started >= 0.09
+
+
+def test_shared_between_threads():
+    bucket = TokenBucket(rate=50, capacity=1)
+    started = time.monotonic()
+    threads = [threading.Thread(target=bucket.acquire) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert time.monotonic() - started >= 0.09
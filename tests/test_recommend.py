@@ -0,0 +1,53 @@
+import json
+
+import recommend
+from conftest import FakeOpenAI
+from recommend import PLACEHOLDER, RECOMMEND_MAX_CHARS, parse_batch, recommend_many
+
+PLACES = ["博多駅", "天神", "中洲"]
+
+
+def _content(*items):
+    return json.dumps({"comments": [{"index": i, "comment": c} for i, c in items]}, ensure_ascii=False)
+
+
+def test_parse_batch_maps_index_to_place():
+    content = _content((1, " 駅ナカで寄り道 "), (3, "屋台が並ぶ"))
+    assert parse_batch(content, PLACES) == {"博多駅": "駅ナカで寄り道", "中洲": "屋台が並ぶ"}
+
+
+def test_parse_batch_drops_invalid_items():
+    content = _content(
+        (0, "範囲外"), (4, "範囲外"), (2, "   "), (3, "長" * (RECOMMEND_MAX_CHARS + 1)), ("1", "番号が文字列"),
+    )
+    assert parse_batch(content, PLACES) == {}
+
+
+def test_parse_batch_keeps_first_comment_for_duplicate_index():
+    assert parse_batch(_content((2, "はじめ"), (2, "あと")), PLACES) == {"天神": "はじめ"}
+
+
+def test_parse_batch_broken_json():
+    assert parse_batch("not json", PLACES) == {}
+    assert parse_batch(json.dumps({"other": []}), PLACES) == {}
+    assert parse_batch(json.dumps({"comments": "文字列"}), PLACES) == {}
+    assert parse_batch(json.dumps({"comments": ["文字列"]}), PLACES) == {}
+
+
+def test_recommend_many_defaults_to_one_request_per_place(openai_client, recommendation_cache):
+    assert recommend.RECOMMEND_MODE == "parallel"
+    comments = recommend_many(openai_client, PLACES, cache=recommendation_cache)
+
+    assert comments == {p: f"{p}のコメント" for p in PLACES}
+    assert len(openai_client.requests) == 3
+    assert not any("index" in r for r in openai_client.requests)
+
+
+def test_recommend_many_batch_mode_retries_missing_places(recommendation_cache):
+    client = FakeOpenAI(fail={"天神"})
+    comments = recommend_many(client, PLACES, cache=recommendation_cache, mode="batch")
+
+    # まとめて1回、取れなかった天神だけ1件ずつ頼み直して失敗する
+    assert comments == {"博多駅": "博多駅のコメント", "天神": PLACEHOLDER, "中洲": "中洲のコメント"}
+    assert len(client.requests) == 2
+    assert recommendation_cache.get("天神") is None
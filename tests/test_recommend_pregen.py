@@ -0,0 +1,59 @@
+import pytest
+
+from conftest import FakeOpenAI
+from recommend import cache_key
+from recommend_pregen import iter_catalog, pregenerate
+
+NAMES = ["博多駅", "天神", "中洲", "大濠公園", "箱崎"]
+
+
+@pytest.fixture
+def places(storage):
+    storage.table("place").insert([
+        {"name": name, "lat": 33.59, "lon": 130.42, "mood": "カフェ", "area": "博多駅", "place_id": f"P{i}"}
+        for i, name in enumerate(NAMES)
+    ]).execute()
+    return storage
+
+
+def _run(client, storage, cache):
+    return pregenerate(client, iter_catalog(storage), storage, chunk_size=2, max_workers=2, qps=1000, cache=cache)
+
+
+def test_pregenerate_writes_comments_to_place(places, recommendation_cache):
+    client = FakeOpenAI()
+    stats = _run(client, places, recommendation_cache)
+
+    assert (stats["places"], stats["generated"], stats["failed"]) == (5, 5, 0)
+    rows = places.table("place").select("name, place_id, recommendation, recommendation_key, mood").execute().data
+    for row in rows:
+        assert row["recommendation"] == f"{row['name']}のコメント"
+        assert row["recommendation_key"] == cache_key(row["name"], row["place_id"])
+        # ほかの列はそのまま
+        assert row["mood"] == "カフェ"
+    # 2件ずつまとめて頼む（最後の1件は1件だけの依頼）
+    assert len(client.requests) == 3
+
+
+def test_pregenerate_skips_done_places_and_resumes(places, recommendation_cache):
+    first = FakeOpenAI(fail={"中洲"})
+    stats = _run(first, places, recommendation_cache)
+    assert (stats["generated"], stats["failed"]) == (4, 1)
+
+    # 動かし直すと、まだコメントの無い中洲だけを頼む
+    assert [r["name"] for r in iter_catalog(places)] == ["中洲"]
+    second = FakeOpenAI()
+    stats = _run(second, places, recommendation_cache)
+    assert (stats["places"], stats["generated"]) == (1, 1)
+    assert len(second.requests) == 1
+    assert list(iter_catalog(places)) == []
+
+
+def test_pregenerate_uses_cached_comments_without_requests(places, recommendation_cache):
+    recommendation_cache.put_many([(name, f"{name}のコメント", f"P{i}") for i, name in enumerate(NAMES)])
+    client = FakeOpenAI()
+    stats = _run(client, places, recommendation_cache)
+
+    assert stats["generated"] == 5
+    assert client.requests == []
+    assert list(iter_catalog(places)) == []
@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+import recommend
+from conftest import FakeOpenAI
+from recommend import PLACEHOLDER, _Broadcast, stream_many, stream_stats
+
+
+def _wait_until(predicate, timeout=2.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError("条件が満たされませんでした")
+        time.sleep(0.005)
+
+
+def test_broadcast_follow_sees_progress_and_result():
+    broadcast = _Broadcast()
+    seen = []
+    follower = threading.Thread(target=lambda: seen.extend(broadcast.follow(2)))
+    follower.start()
+    _wait_until(lambda: seen)
+    broadcast.publish("博")
+    _wait_until(lambda: "博" in seen)
+    broadcast.finish("博多駅")
+    follower.join(2)
+
+    assert seen == ["", "博", "博多駅"]
+    # 終わった後から来た人は最後の文だけを受け取る
+    assert list(broadcast.follow(1)) == ["博多駅"]
+
+
+def test_broadcast_follow_raises_leader_error_and_timeout():
+    failed = _Broadcast()
+    failed.finish(error=RuntimeError("失敗"))
+    with pytest.raises(RuntimeError):
+        list(failed.follow(1))
+
+    with pytest.raises(TimeoutError):
+        list(_Broadcast().follow(0.05))
+
+
+def test_stream_many_yields_cached_first_then_progress(openai_client, recommendation_cache):
+    recommendation_cache.put("博多駅", "キャッシュ")
+    events = list(stream_many(openai_client, ["天神", "博多駅"], cache=recommendation_cache))
+
+    assert events[0] == ("博多駅", "キャッシュ", True)
+    tenjin = [(text, done) for place, text, done in events if place == "天神"]
+    # 1文字ずつ伸びていき、最後に完了で終わる
+    assert tenjin[0] == ("天", False)
+    assert tenjin[-1] == ("天神のコメント", True)
+    assert recommendation_cache.get("天神") == "天神のコメント"
+    assert len(openai_client.requests) == 1
+
+
+def test_stream_many_failure_and_timeout_become_placeholder(recommendation_cache):
+    events = list(stream_many(FakeOpenAI(fail={"中洲"}), ["中洲"], cache=recommendation_cache))
+    assert events == [("中洲", PLACEHOLDER, True)]
+    assert recommendation_cache.get("中洲") is None
+
+    events = list(stream_many(FakeOpenAI(delay=0.5), ["箱崎"], cache=recommendation_cache, timeout=0.05))
+    assert events == [("箱崎", PLACEHOLDER, True)]
+
+
+def test_concurrent_streams_of_same_place_are_coalesced(recommendation_cache):
+    client = FakeOpenAI(delay=0.2)
+    before = stream_stats()
+    results = {}
+
+    def run(name):
+        results[name] = list(stream_many(client, ["大濠公園"], cache=recommendation_cache))
+
+    leader = threading.Thread(target=run, args=("leader",))
+    leader.start()
+    key = recommend.cache_key("大濠公園")
+    _wait_until(lambda: key in recommend._streams)
+    follower = threading.Thread(target=run, args=("follower",))
+    follower.start()
+    leader.join(5)
+    follower.join(5)
+
+    after = stream_stats()
+    assert len(client.requests) == 1
+    assert after["calls"] - before["calls"] == 1
+    assert after["coalesced"] - before["coalesced"] == 1
+    assert key not in recommend._streams
+    for events in results.values():
+        assert events[-1] == ("大濠公園", "大濠公園のコメント", True)
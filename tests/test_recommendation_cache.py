@@ -0,0 +1,64 @@
+import pytest
+
+import recommend
+from recommend import RecommendationCache, cache_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(recommend.time, "time", lambda: now[0])
+    return now
+
+
+def test_cache_key_uses_place_id_and_normalized_name():
+    assert cache_key("カフェ　博多", None) == cache_key("カフェ 博多", None)
+    assert cache_key("カフェ", "P1") == cache_key("別の名前", "P1")
+    assert cache_key("カフェ", "P1") != cache_key("カフェ", None)
+    assert cache_key("カフェ", prompt_version=1) != cache_key("カフェ", prompt_version=2)
+
+
+def test_get_many_reads_hits_only(tmp_path):
+    cache = RecommendationCache(str(tmp_path / "r.sqlite3"))
+    cache.put_many([("博多駅", "駅", None), ("天神", "街", "P2")])
+
+    assert cache.get_many(["博多駅", "天神", "中洲"], {"天神": "P2"}) == {"博多駅": "駅", "天神": "街"}
+    # place_id が違えば別のコメント
+    assert cache.get("天神") is None
+    assert cache.get_many([]) == {}
+
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+    cache = RecommendationCache(str(tmp_path / "r.sqlite3"), ttl=100)
+    cache.put("博多駅", "駅")
+
+    clock[0] += 100
+    assert cache.get("博多駅") == "駅"
+    clock[0] += 1
+    assert cache.get("博多駅") is None
+    # 期限切れの行は読んだときに消える
+    with cache._connect() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM recommendation").fetchone()[0] == 0
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    cache = RecommendationCache(str(tmp_path / "r.sqlite3"), max_entries=2)
+    cache.put("a", "A")
+    clock[0] += 1
+    cache.put("b", "B")
+
+    # a を使ったので、あふれたときに消えるのは b
+    clock[0] += recommend.LAST_USED_RESOLUTION + 1
+    assert cache.get("a") == "A"
+    clock[0] += 1
+    cache.put("c", "C")
+    assert cache.get_many(["a", "b", "c"]) == {"a": "A", "c": "C"}
+
+
+def test_last_used_is_not_rewritten_on_every_read(tmp_path, clock):
+    cache = RecommendationCache(str(tmp_path / "r.sqlite3"))
+    cache.put("a", "A")
+    clock[0] += recommend.LAST_USED_RESOLUTION - 1
+    cache.get("a")
+    with cache._connect() as conn:
+        assert conn.execute("SELECT last_used FROM recommendation").fetchone()[0] == 1000.0
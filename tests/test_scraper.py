@@ -0,0 +1,376 @@
+import gzip
+import json
+
+import numpy as np
+import pytest
+
+import scraper
+from scraper import haversine, offset_point
+
+BASE = (33.5902, 130.4207)
+
+
+def _place(name, distance_m, bearing=0.0, place_id=None):
+    lat, lng = offset_point(*BASE, distance_m, bearing)
+    return {"name": name, "place_id": place_id or f"P{name}", "vicinity": "",
+            "geometry": {"location": {"lat": lat, "lng": lng}}}
+
+
+def test_haversine_batch_matches_scalar():
+    rng = np.random.default_rng(0)
+    lats = rng.uniform(33.0, 34.0, 50)
+    lons = rng.uniform(130.0, 131.0, 50)
+
+    batch = scraper.haversine_batch(*BASE, lats, lons)
+    assert batch == pytest.approx([haversine(*BASE, la, lo) for la, lo in zip(lats, lons)], rel=1e-9)
+    assert scraper.haversine_batch(*BASE, *BASE) == pytest.approx(0.0)
+
+
+def test_distance_matrix_shape():
+    matrix = scraper.distance_matrix([BASE[0], 34.0], [BASE[1], 131.0], [33.0, 33.5, 34.0], [130.0, 130.5, 131.0])
+    assert matrix.shape == (2, 3)
+    assert matrix[1, 2] == pytest.approx(0.0)
+    assert matrix[0, 0] == pytest.approx(haversine(*BASE, 33.0, 130.0))
+
+
+def test_ring_mask_is_inclusive():
+    assert scraper.ring_mask([100, 500, 700, 1000, 1001], 500, 1000).tolist() == [False, True, True, True, False]
+
+
+def test_filter_ring_keeps_band_order_and_limit():
+    places = [_place(f"場所{d}", d) for d in (100, 600, 800, 900, 1500)]
+
+    spots = scraper.filter_ring(places, *BASE, 500, 1000, limit=2)
+    assert [s["name"] for s in spots] == ["場所600", "場所800"]
+    assert [s["distance_m"] for s in spots] == pytest.approx([600, 800], abs=2)
+    assert len(scraper.filter_ring(places, *BASE, 500, 1000, limit=None)) == 3
+    assert scraper.filter_ring([], *BASE, 500, 1000) == []
+
+
+class _Clock:
+    """time.time の代わり。advance() で進める"""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(scraper.time, "time", clock)
+    return clock
+
+
+def test_normalize_keyword_folds_width_space_and_station():
+    assert scraper.normalize_keyword("博多駅") == "博多"
+    assert scraper.normalize_keyword(" 博多 ") == "博多"
+    assert scraper.normalize_keyword("ＴＥＮＪＩＮ　駅") == "tenjin"
+    assert scraper.normalize_keyword("駅") == "駅"
+
+
+def test_geocode_cache_shares_normalized_keys(tmp_path, clock):
+    cache = scraper.GeocodeCache(str(tmp_path / "geocode.sqlite3"))
+    cache.set("博多駅", 33.59, 130.42)
+
+    assert cache.get("博多") == (33.59, 130.42)
+    assert cache.get("ﾊｶﾀ") is None
+
+
+def test_geocode_cache_ttl(tmp_path, clock):
+    cache = scraper.GeocodeCache(str(tmp_path / "geocode.sqlite3"), ttl=60)
+    cache.set("博多駅", 33.59, 130.42)
+
+    clock.advance(60)
+    assert cache.get("博多駅") == (33.59, 130.42)
+    clock.advance(1)
+    assert cache.get("博多駅") is None
+
+
+def test_geocode_cache_evicts_least_recently_used(tmp_path, clock):
+    cache = scraper.GeocodeCache(str(tmp_path / "geocode.sqlite3"), max_entries=2)
+    cache.set("博多", 1.0, 1.0)
+    clock.advance(1)
+    cache.set("天神", 2.0, 2.0)
+    clock.advance(1)
+    assert cache.get("博多") == (1.0, 1.0)
+    clock.advance(1)
+    cache.set("中洲", 3.0, 3.0)
+
+    assert cache.get("天神") is None
+    assert cache.get("博多") == (1.0, 1.0)
+    assert cache.get("中洲") == (3.0, 3.0)
+
+
+class _FakeGmaps:
+    """Places API の代わり。呼ばれた引数を calls に残す"""
+
+    def __init__(self):
+        self.calls = []
+
+    def find_place(self, input=None, **kwargs):
+        self.calls.append(("find_place", input))
+        return {"candidates": [{"geometry": {"location": {"lat": BASE[0], "lng": BASE[1]}}}]}
+
+    def geocode(self, address, **kwargs):
+        self.calls.append(("geocode", address))
+        return []
+
+    def places_nearby(self, location=None, radius=None, keyword=None, language=None, page_token=None):
+        self.calls.append(("places_nearby", page_token))
+        if page_token is None:
+            return {"results": [{"place_id": "a"}], "next_page_token": f"token{len(self.calls)}"}
+        return {"results": [{"place_id": "b"}]}
+
+
+@pytest.fixture
+def fake_gmaps(monkeypatch, tmp_path):
+    fake = _FakeGmaps()
+    monkeypatch.setattr(scraper, "gmaps", fake)
+    monkeypatch.setattr(scraper, "geocode_cache", scraper.GeocodeCache(str(tmp_path / "geocode.sqlite3")))
+    monkeypatch.setattr(scraper, "nearby_cache", scraper.NearbyCache())
+    monkeypatch.setattr(scraper, "NEXT_PAGE_DELAY", 0)
+    return fake
+
+
+def test_resolve_location_uses_cache(fake_gmaps):
+    assert scraper.resolve_location("博多駅") == BASE
+    assert scraper.resolve_location(" 博多 ") == BASE
+    assert fake_gmaps.calls == [("find_place", "博多駅")]
+
+    with pytest.raises(ValueError):
+        scraper.resolve_location("どこでもない場所", method="geocode")
+
+
+def test_nearby_cache_stats_and_eviction(clock):
+    cache = scraper.NearbyCache(ttl=60, max_entries=2)
+    assert cache.get("a") is None
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)    # 一番使われていない b が消える
+
+    assert cache.get("b") is None
+    clock.advance(61)
+    assert cache.get("a") is None
+    assert cache.stats() == {"hits": 1, "misses": 3, "hit_ratio": 0.25, "evictions": 1, "size": 1}
+
+
+def test_nearby_cache_peek_is_not_counted(clock):
+    cache = scraper.NearbyCache(ttl=60)
+    cache.set("a", 1)
+
+    assert cache.peek("a") == 1
+    assert cache.peek("b") is None
+    assert cache.stats()["hits"] == 0 and cache.stats()["misses"] == 0
+    clock.advance(61)
+    assert cache.peek("a") is None
+
+
+def test_nearby_cache_cells_cover_origin():
+    cache = scraper.NearbyCache(cell_deg=0.002)
+    cell = cache.cell_of(*BASE)
+    lat, lon = cache.cell_center(cell)
+
+    assert cache.cell_of(lat, lon) == cell
+    assert haversine(*BASE, lat, lon) <= cache.cell_margin(cell)
+
+
+def test_nearby_search_shares_cell_results(fake_gmaps):
+    near = offset_point(*BASE, 10, 0.0)
+    if scraper.nearby_cache.cell_of(*near) != scraper.nearby_cache.cell_of(*BASE):
+        near = BASE
+    assert scraper.nearby_search(*BASE, 1000, "カフェ") == [{"place_id": "a"}]
+    assert scraper.nearby_search(*near, 1000, "カフェ") == [{"place_id": "a"}]
+    assert len(fake_gmaps.calls) == 1
+    assert scraper.nearby_cache.stats()["hits"] == 1
+
+
+def test_iter_places_reads_next_page_only_when_needed(fake_gmaps, monkeypatch):
+    pages = {
+        None: {"results": [_place("近い", 100), _place("リング1", 600)], "next_page_token": "t1"},
+        "t1": {"results": [_place("リング2", 700), _place("リング3", 800)]},
+    }
+    monkeypatch.setattr(fake_gmaps, "places_nearby",
+                        lambda page_token=None, **kwargs: fake_gmaps.calls.append(page_token) or pages[page_token])
+
+    first = scraper.iter_places("カフェ", 500, 1000, *BASE, limit=1)
+    assert [s["name"] for s in first] == ["リング1"]
+    assert first.pages_used == 1 and fake_gmaps.calls == [None]
+
+    more = scraper.iter_places("カフェ", 500, 1000, *BASE, limit=3)
+    assert [s["name"] for s in more] == ["リング1", "リング2", "リング3"]
+    assert more.pages_used == 2 and fake_gmaps.calls == [None, "t1"]
+
+
+def test_nearby_page_refetches_first_page_for_stale_token(fake_gmaps):
+    assert scraper.nearby_page(*BASE, 1000, "カフェ") == ([{"place_id": "a"}], True)
+    # 1ページ目の結果はキャッシュに残っているが、トークンは古くなった
+    key = next(iter(scraper.nearby_cache._data))
+    stored_at, (results, token, issued_at) = scraper.nearby_cache._data[key]
+    scraper.nearby_cache._data[key] = (stored_at, (results, token, issued_at - scraper.NEXT_PAGE_TOKEN_TTL - 1))
+
+    assert scraper.nearby_page(*BASE, 1000, "カフェ", page=1) == ([{"place_id": "b"}], False)
+    assert [token for _, token in fake_gmaps.calls] == [None, None, "token2"]
+
+
+@pytest.mark.parametrize("time_min, time_max", [(500, 1000), (1000, 2000), (1800, 2000)])
+def test_annulus_tiles_cover_ring(time_min, time_max):
+    tiles = scraper.annulus_tiles(*BASE, time_min, time_max)
+    assert len(tiles) > 1
+
+    for bearing in np.linspace(0, 2 * np.pi, 360, endpoint=False):
+        for distance in np.linspace(time_min, time_max, 7):
+            lat, lon = offset_point(*BASE, float(distance), float(bearing))
+            # 平面近似の誤差の分だけ少し余裕を見る
+            assert any(haversine(lat, lon, t_lat, t_lon) <= radius * 1.01 for t_lat, t_lon, radius in tiles)
+
+
+def test_annulus_tiles_disc_is_single_circle():
+    assert scraper.annulus_tiles(*BASE, 0, 500) == [(BASE[0], BASE[1], 500)]
+
+
+def test_search_places_annulus_merges_tiles(fake_gmaps, monkeypatch):
+    # どの小円からも同じ場所が返ってきても1件にまとめる
+    results = [_place("北", 1500, 0.0), _place("南", 1500, np.pi), _place("中心", 100, 0.0)]
+    monkeypatch.setattr(fake_gmaps, "places_nearby", lambda **kwargs: {"results": results})
+
+    spots = scraper.search_places_annulus("カフェ", 1000, 2000, *BASE, limit=None)
+    assert sorted(s["name"] for s in spots) == ["北", "南"]
+
+
+def test_search_many_runs_every_query_and_reports_errors(monkeypatch):
+    calls = []
+
+    def search_one(origin, mood, band, mode, limit=5):
+        calls.append((origin, mood, band, mode, limit))
+        if mood == "公園":
+            raise RuntimeError("失敗")
+        return [{"name": f"{origin}-{mood}-{band}"}]
+
+    monkeypatch.setattr(scraper, "_search_one", search_one)
+    results = list(scraper.search_many(["博多駅", "天神"], ["カフェ", "公園"], [30, 60], mode="annulus",
+                                       max_workers=3, limit=None))
+
+    assert len(results) == 8 and len(calls) == 8
+    assert {c[3] for c in calls} == {"annulus"} and {c[4] for c in calls} == {None}
+    for r in results:
+        if r["mood"] == "公園":
+            assert isinstance(r["error"], RuntimeError) and r["places"] == []
+        else:
+            assert r["error"] is None and r["places"] == [{"name": f"{r['origin']}-{r['mood']}-{r['band']}"}]
+
+
+def test_search_many_explicit_queries(monkeypatch):
+    monkeypatch.setattr(scraper, "_search_one", lambda origin, mood, band, mode, limit=5: [])
+    results = list(scraper.search_many(["博多駅"], ["カフェ"], [30], queries=[("天神", "公園", 60)]))
+    assert [(r["origin"], r["mood"], r["band"]) for r in results] == [("天神", "公園", 60)]
+
+
+def test_search_places_uses_shared_rate_limiter(fake_gmaps, monkeypatch):
+    acquired = []
+    monkeypatch.setattr(scraper.google_rate_limiter, "acquire", lambda: acquired.append(1))
+    monkeypatch.setattr(fake_gmaps, "places_nearby", lambda **kwargs: {"results": [_place("近い", 100)]})
+    assert [s["name"] for s in scraper.search_places("カフェ", 0, 1000, "博多駅")] == ["近い"]
+    # Find Place と Nearby Search の2回
+    assert len(acquired) == 2
+
+
+def test_precompute_round_trip(fake_gmaps, monkeypatch, tmp_path):
+    monkeypatch.setattr(fake_gmaps, "places_nearby", lambda **kwargs: {"results": [_place("近い", 100)]})
+    path = str(tmp_path / "snapshot.json.gz")
+
+    scraper.precompute(origins=["博多駅"], moods=["カフェ"], bands=(30,), path=path)
+    snapshot = scraper.load_snapshot(path)
+    origin, spots = scraper.snapshot_lookup(snapshot, " 博多 ", "カフェ", 30)
+    assert origin == BASE
+    assert [s["name"] for s in spots] == ["近い"]
+    assert snapshot["labels"] == {"博多": "博多駅"}
+    assert scraper.snapshot_lookup(snapshot, "天神", "カフェ", 30) is None
+
+
+def test_load_snapshot_missing_or_other_version(tmp_path):
+    assert scraper.load_snapshot(str(tmp_path / "none.json.gz"))["results"] == {}
+
+    path = tmp_path / "old.json.gz"
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump({"version": scraper.SNAPSHOT_VERSION + 1, "origins": {"博多": [0, 0]}, "results": {"x": []}}, f)
+    assert scraper.load_snapshot(str(path))["results"] == {}
+
+
+def test_snapshot_lookup_ignores_stale_snapshot():
+    origin_key = scraper.normalize_keyword("博多駅")
+    snapshot = {
+        "created_at": scraper.time.time(),
+        "origins": {origin_key: list(BASE)},
+        "results": {f"{origin_key}|カフェ|30": [["場所", "", BASE[0], BASE[1], 10, "P1"]]},
+    }
+    assert scraper.snapshot_lookup(snapshot, "博多駅", "カフェ", 30)[1][0]["place_id"] == "P1"
+
+    snapshot["created_at"] -= scraper.SNAPSHOT_MAX_AGE + 1
+    assert scraper.snapshot_lookup(snapshot, "博多駅", "カフェ", 30) is None
+    assert scraper.snapshot_lookup(snapshot, "博多駅", "カフェ", 30, max_age=0) is not None
+    del snapshot["created_at"]
+    assert scraper.snapshot_lookup(snapshot, "博多駅", "カフェ", 30) is None
+
+
+def test_place_batch_round_trips_dicts():
+    spots = [
+        {"name": "a", "vicinity": "v", "lat": 33.5, "lon": 130.4, "distance_m": 120, "place_id": "P1"},
+        {"name": "b", "vicinity": "", "lat": 33.6, "lon": 130.5, "distance_m": 900, "place_id": None},
+    ]
+    batch = scraper.PlaceBatch.from_dicts(spots)
+    assert len(batch) == 2
+    assert batch.to_dicts() == spots
+    assert batch[1] == spots[1]
+    df = batch.to_dataframe()
+    assert list(df["name"]) == ["a", "b"] and list(df["distance_m"]) == [120, 900]
+
+
+def test_place_batch_concat():
+    PlaceBatch = scraper.PlaceBatch
+    a = PlaceBatch(["a"], [""], [1.0], [2.0], [10], ["P1"])
+    b = PlaceBatch(["b", "c"], ["", ""], [3.0, 4.0], [5.0, 6.0], [20, 30], [None, "P3"])
+    merged = PlaceBatch.concat([a, PlaceBatch.empty(), b])
+    assert merged.name == ["a", "b", "c"]
+    assert merged.place_id == ["P1", None, "P3"]
+    assert list(merged.distance_m) == [10, 20, 30]
+    assert len(PlaceBatch.concat([])) == 0
+
+
+def test_search_batch_matches_dict_search(fake_gmaps, monkeypatch):
+    monkeypatch.setattr(fake_gmaps, "places_nearby",
+                        lambda **kwargs: {"results": [_place("近い", 100), _place("リング", 700)]})
+
+    batch = scraper.search_batch_by_coords("カフェ", 500, 1000, *BASE)
+    assert isinstance(batch, scraper.PlaceBatch)
+    assert batch.name == ["リング"]
+    assert batch.to_dicts() == scraper.search_places_by_coords("カフェ", 500, 1000, *BASE)
+
+
+def test_search_batch_with_backend():
+    from place_index import PlaceIndex
+    index = PlaceIndex()
+    lat, lon = offset_point(*BASE, 700, 0.0)
+    index.upsert([{"id": 1, "name": "索引の場所", "lat": lat, "lon": lon, "mood": "カフェ", "place_id": "P1"}])
+
+    batch = scraper.search_batch_by_coords("カフェ", 500, 1000, *BASE, backend=index)
+    assert batch.name == ["索引の場所"] and batch.place_id == ["P1"]
+    assert batch.to_dicts() == index.search_ring("カフェ", 500, 1000, *BASE)
+
+
+def test_snapshot_lookup_batch():
+    origin_key = scraper.normalize_keyword("博多駅")
+    snapshot = {
+        "created_at": scraper.time.time(),
+        "origins": {origin_key: list(BASE)},
+        "results": {f"{origin_key}|カフェ|30": [["場所", "", BASE[0], BASE[1], 10, "P1"]]},
+    }
+    origin, batch = scraper.snapshot_lookup_batch(snapshot, "博多駅", "カフェ", 30)
+    assert origin == BASE
+    assert batch.to_dicts() == scraper.snapshot_lookup(snapshot, "博多駅", "カフェ", 30)[1]
@@ -0,0 +1,105 @@
+import itertools
+
+import pytest
+
+import place_ingest
+import shop_planner
+from shop_planner import ShopPlanner, reachable
+
+AREAS = ["博多駅", "天神駅", "中洲川端駅"]
+MOODS = ["カフェ", "居酒屋"]
+TIMES = ["30分", "60分", "120分"]
+
+
+def _old_search_shops(supabase, time, mood, area):
+    """user-017 より前の app.search_shops（stations.json はこれと同じ結果になるように作ってある）"""
+    if time == "120分":
+        response = supabase.table("place").select("*").eq("mood", mood).limit(10).execute()
+    elif time == "60分" and (area == "天神駅" or area == "中洲川端駅"):
+        response = supabase.table("place").select("*").in_("area", ["天神駅", "中洲川端駅"]).eq("mood", mood).limit(5).execute()
+    else:
+        response = supabase.table("place").select("*").eq("area", area).eq("mood", mood).limit(5).execute()
+    return response.data
+
+
+@pytest.fixture
+def places(storage):
+    rows = [
+        {"name": f"{area}の{mood}{i}", "lat": 33.59, "lon": 130.42, "mood": mood, "area": area}
+        for i in range(4) for area in AREAS for mood in MOODS
+    ]
+    storage.table("place").insert(rows).execute()
+    return storage
+
+
+@pytest.fixture
+def selects(places, monkeypatch):
+    opened = []
+    table = places.table
+
+    def counting(name):
+        opened.append(name)
+        return table(name)
+
+    monkeypatch.setattr(places, "table", counting)
+    return opened
+
+
+def test_reachable():
+    stations = {"A": ["B"], "B": ["A", "C"], "C": ["B"]}
+    assert reachable(stations, "A", 0) == ["A"]
+    assert reachable(stations, "A", 1) == ["A", "B"]
+    assert reachable(stations, "A", 5) == ["A", "B", "C"]
+    assert reachable(stations, "未知の駅", 2) == ["未知の駅"]
+
+
+@pytest.mark.parametrize("time_label, mood, area", list(itertools.product(TIMES, MOODS, AREAS)))
+def test_plan_matches_old_branches(places, time_label, mood, area):
+    planner = ShopPlanner()
+    assert planner.search(places, time_label, mood, area) == _old_search_shops(places, time_label, mood, area)
+
+
+def test_unknown_time_searches_start_station_only():
+    planner = ShopPlanner()
+    assert planner.plan("90分", "カフェ", "天神駅") == ("カフェ", ("天神駅",), 5)
+    assert planner.plan("120分", "カフェ", "天神駅") == ("カフェ", None, 10)
+    assert planner.plan("60分", "カフェ", "天神駅") == ("カフェ", ("中洲川端駅", "天神駅"), 5)
+
+
+def test_search_is_cached_per_plan_and_returns_copies(places, selects):
+    planner = ShopPlanner()
+    first = planner.search(places, "60分", "カフェ", "天神駅")
+    first.clear()
+    # 天神駅と中洲川端駅の 60 分は同じプランなので、同じキャッシュを使う
+    assert len(planner.search(places, "60分", "カフェ", "中洲川端駅")) == 5
+    assert selects == ["place"]
+
+
+def test_cache_expires_and_invalidates(places, selects, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(shop_planner.time, "time", lambda: now[0])
+    planner = ShopPlanner(ttl=10)
+
+    planner.search(places, "30分", "カフェ", "博多駅")
+    now[0] += 9
+    planner.search(places, "30分", "カフェ", "博多駅")
+    assert len(selects) == 1
+    now[0] += 2
+    planner.search(places, "30分", "カフェ", "博多駅")
+    assert len(selects) == 2
+
+    planner.invalidate()
+    planner.search(places, "30分", "カフェ", "博多駅")
+    assert len(selects) == 3
+
+
+def test_ingest_invalidates_shared_planner(places, monkeypatch):
+    planner = ShopPlanner()
+    monkeypatch.setattr(place_ingest, "shop_planner", planner)
+    before = planner.search(places, "30分", "バー", "博多駅")
+    assert before == []
+
+    row = {"name": "新しいバー", "lat": 33.59, "lon": 130.42, "mood": "バー", "area": "博多駅",
+           "dedupe_key": "新しいバー|P1", "place_id": "P1"}
+    place_ingest.ingest(places, [row])
+    assert [r["name"] for r in planner.search(places, "30分", "バー", "博多駅")] == ["新しいバー"]
@@ -0,0 +1,103 @@
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def _run_concurrently(n, target):
+    results = [None] * n
+    errors = [None] * n
+
+    def worker(i):
+        try:
+            results[i] = target()
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    return threads, results, errors
+
+
+def _wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    runs = []
+
+    def slow():
+        runs.append(1)
+        started.set()
+        release.wait(5)
+        return "結果"
+
+    threads, results, errors = _run_concurrently(1, lambda: flight.do("key", slow))
+    assert started.wait(5)
+    followers, more, _ = _run_concurrently(4, lambda: flight.do("key", slow))
+    _wait_until(lambda: flight.stats()["coalesced"] == 4)
+    release.set()
+    for t in threads + followers:
+        t.join(5)
+
+    assert runs == [1]
+    assert results + more == ["結果"] * 5
+    assert flight.stats() == {"calls": 1, "coalesced": 4, "inflight": 0}
+
+
+def test_followers_receive_the_same_exception():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    error = ValueError("見つかりません")
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise error
+
+    threads, _, errors = _run_concurrently(1, lambda: flight.do("key", failing))
+    assert started.wait(5)
+    followers, _, follower_errors = _run_concurrently(3, lambda: flight.do("key", failing))
+    _wait_until(lambda: flight.stats()["coalesced"] == 3)
+    release.set()
+    for t in threads + followers:
+        t.join(5)
+
+    assert errors == [error]
+    assert follower_errors == [error] * 3
+    # 失敗した呼び出しは覚えておかないので、次は実行し直す
+    assert flight.do("key", lambda: "再実行") == "再実行"
+
+
+def test_different_keys_do_not_wait():
+    flight = SingleFlight()
+    assert flight.do("a", lambda: 1) == 1
+    assert flight.do("b", lambda: 2) == 2
+    assert flight.stats()["calls"] == 2
+
+
+def test_follower_timeout():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+
+    threads, _, _ = _run_concurrently(1, lambda: flight.do("key", slow))
+    assert started.wait(5)
+    with pytest.raises(TimeoutError):
+        flight.do("key", slow, timeout=0.05)
+    release.set()
+    threads[0].join(5)
@@ -0,0 +1,83 @@
+import pytest
+
+import spell_cache
+from spell_cache import SpellCache
+
+
+class _Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = _Clock()
+    monkeypatch.setattr(spell_cache.time, "time", c)
+    return c
+
+
+@pytest.fixture
+def lookups(storage, monkeypatch):
+    """status を引いた回数を数える"""
+    opened = []
+    table = storage.table
+
+    def counting(name):
+        opened.append(name)
+        return table(name)
+
+    monkeypatch.setattr(storage, "table", counting)
+    return opened
+
+
+def test_known_spell_is_cached_until_ttl(storage, clock, lookups):
+    storage.table("status").insert([{"spell": "abc"}]).execute()
+    lookups.clear()
+    cache = SpellCache(known_ttl=100, missing_ttl=5)
+
+    assert cache.exists(storage, "abc")
+    clock.now += 99
+    assert cache.exists(storage, "abc")
+    assert len(lookups) == 1
+
+    clock.now += 2
+    assert cache.exists(storage, "abc")
+    assert len(lookups) == 2
+
+
+def test_missing_spell_uses_short_ttl(storage, clock, lookups):
+    cache = SpellCache(known_ttl=100, missing_ttl=5)
+
+    assert not cache.exists(storage, "abc")
+    assert not cache.exists(storage, "abc")
+    assert len(lookups) == 1
+
+    # 期限内に登録されても、否定の記憶が切れるまでは「ない」と答える
+    storage.table("status").insert([{"spell": "abc"}]).execute()
+    lookups.clear()
+    clock.now += 4
+    assert not cache.exists(storage, "abc")
+    assert lookups == []
+
+    clock.now += 2
+    assert cache.exists(storage, "abc")
+    assert len(lookups) == 1
+
+
+def test_add_and_invalidate(storage, clock, lookups):
+    cache = SpellCache(known_ttl=100, missing_ttl=5)
+    assert not cache.exists(storage, "abc")
+
+    cache.add("abc")
+    assert cache.exists(storage, "abc")
+    assert len(lookups) == 1
+
+    cache.invalidate("abc")
+    assert not cache.exists(storage, "abc")
+    assert len(lookups) == 2
+    cache.invalidate()
+    assert not cache.exists(storage, "abc")
+    assert len(lookups) == 3
@@ -0,0 +1,95 @@
+import pytest
+
+import exp_stats
+import write_queue
+from spell_ledger import SpellLedger
+from write_queue import CheckinQueue
+
+
+@pytest.fixture
+def queue(storage, tmp_path, monkeypatch):
+    monkeypatch.setattr(write_queue, "RETRY_BASE", 0.01)
+    q = CheckinQueue(storage, str(tmp_path / "spool.sqlite3"), flush_interval=0.05, max_attempts=3)
+    yield q
+    q.close(timeout=2)
+
+
+@pytest.fixture
+def tables(storage, monkeypatch):
+    """storage.table() で開いたテーブル名を順に記録する"""
+    opened = []
+    table = storage.table
+
+    def counting(name):
+        opened.append(name)
+        return table(name)
+
+    monkeypatch.setattr(storage, "table", counting)
+    return opened
+
+
+def test_ledger_totals_come_from_spell_stats(storage, tables):
+    exp_stats.record_checkin(storage, "abc", "博多駅", 60)
+    exp_stats.record_checkin(storage, "abc", "天神", 50)
+    ledger = SpellLedger(storage, "abc")
+
+    assert ledger.total_exp() == 110
+    assert ledger.level() == 1
+    assert ledger.visits() == 2
+    # records は読まず、spell_stats の1行だけ
+    assert tables == ["spell_stats"]
+
+
+def test_ledger_loads_place_records_lazily(storage, tables):
+    for place in ("博多駅", "博多駅", "天神"):
+        exp_stats.record_checkin(storage, "abc", place, 10)
+    ledger = SpellLedger(storage, "abc")
+
+    assert ledger.visit_count("博多駅") == 2
+    assert ledger.visit_count("博多駅") == 2
+    assert tables == ["spell_stats", "records"]
+    assert len(ledger.records()) == 3
+    assert ledger.visit_count("天神") == 1
+    assert tables == ["spell_stats", "records", "records"]
+
+
+def test_ledger_counts_pending_checkins_once(storage, queue):
+    exp_stats.record_checkin(storage, "abc", "博多駅", 40)
+    ledger = SpellLedger(storage, "abc", queue=queue)
+
+    assert ledger.total_exp() == 40
+    assert ledger.visit_count("天神") == 0
+    stats = ledger.add("天神", 30)
+    assert stats == {"total_exp": 70, "level": 0, "visits": 2}
+    assert [r["place"] for r in ledger.pending_records()] == ["天神"]
+    assert ledger.visit_count("天神") == 1
+
+    assert queue.flush(timeout=5)
+    assert ledger.pending_records() == []
+    assert ledger.total_exp() == 70
+    # 送信済みの行を読み直しても二重に数えない
+    ledger.load()
+    assert ledger.total_exp() == 70
+    assert ledger.visits() == 2
+    assert ledger.visit_count("天神") == 1
+    assert len(ledger.records()) == 2
+
+
+def test_ledger_without_queue_writes_immediately(storage):
+    ledger = SpellLedger(storage, "abc")
+    ledger.add("博多駅", 120)
+
+    assert exp_stats.get_stats(storage, "abc") == {"total_exp": 120, "level": 1, "visits": 1}
+    assert ledger.level() == 1
+
+
+def test_ledger_drops_records_written_by_another_device(storage):
+    ledger = SpellLedger(storage, "abc")
+    ledger.add("博多駅", 10)
+    assert ledger.visit_count("博多駅") == 1
+
+    # 別の端末から同じじゅもんでチェックイン
+    exp_stats.record_checkin(storage, "abc", "博多駅", 10)
+    stats = ledger.add("博多駅", 10)
+    assert stats["visits"] == 3
+    assert ledger.visit_count("博多駅") == 3
@@ -0,0 +1,92 @@
+import re
+import sqlite3
+
+import pytest
+
+import exp_stats
+import storage as storage_module
+from storage import StorageError, utc_timestamp
+
+
+def _places(storage, *names):
+    rows = [{"name": n, "lat": 33.59, "lon": 130.42, "mood": "カフェ", "area": "博多駅"} for n in names]
+    return storage.table("place").insert(rows).execute().data
+
+
+def test_insert_returns_rows_with_ids(storage):
+    rows = _places(storage, "a", "b")
+    assert [r["id"] for r in rows] == [1, 2]
+    assert storage.table("place").select("id, name").eq("name", "b").execute().data == [{"id": 2, "name": "b"}]
+
+
+def test_filters_order_and_limit(storage):
+    _places(storage, "a", "b", "c", "d")
+    query = storage.table("place").select("name")
+
+    assert [r["name"] for r in query.gt("id", 1).lt("id", 4).order("id", desc=True).execute().data] == ["c", "b"]
+    assert [r["name"] for r in storage.table("place").select("name").gte("id", 3).execute().data] == ["c", "d"]
+    assert [r["name"] for r in storage.table("place").select("name").in_("name", ["a", "d"]).execute().data] == ["a", "d"]
+    assert storage.table("place").select("name").in_("name", []).execute().data == []
+    assert len(storage.table("place").select("id").order("id").limit(3).execute().data) == 3
+
+
+def test_rejects_unsafe_identifiers(storage):
+    with pytest.raises(ValueError):
+        storage.table("place").select("name").eq("name; drop table place", "x")
+
+
+def test_unknown_rpc(storage):
+    with pytest.raises(StorageError):
+        storage.rpc("no_such_function").execute()
+
+
+def test_unique_dedupe_key(storage):
+    row = {"name": "カフェ", "lat": 33.59, "lon": 130.42, "mood": "カフェ", "dedupe_key": "カフェ|P1"}
+    storage.table("place").insert([row]).execute()
+    with pytest.raises(StorageError):
+        storage.table("place").insert([dict(row)]).execute()
+
+    storage.table("place").upsert([dict(row, name="カフェ 2")], on_conflict="dedupe_key").execute()
+    rows = storage.table("place").select("name").execute().data
+    assert rows == [{"name": "カフェ 2"}]
+
+
+def test_timestamps_use_one_format(storage):
+    pattern = re.compile(r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{3}Z$")
+    storage.table("status").insert([{"spell": "abc"}]).execute()
+    exp_stats.record_checkin(storage, "abc", "博多駅", 10)
+    stamps = [
+        storage.table("status").select("created_at").execute().data[0]["created_at"],
+        storage.table("records").select("created_at").execute().data[0]["created_at"],
+        storage.table("spell_stats").select("updated_at").execute().data[0]["updated_at"],
+        utc_timestamp(),
+    ]
+    assert all(pattern.match(s) for s in stamps), stamps
+
+
+def test_connections_are_closed(storage, monkeypatch):
+    opened = []
+    connect = sqlite3.connect
+
+    def tracking(*args, **kwargs):
+        opened.append(connect(*args, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(storage_module.sqlite3, "connect", tracking)
+    storage.table("status").insert([{"spell": "abc"}]).execute()
+    storage.table("status").select("spell").execute()
+    assert len(opened) == 2
+    for conn in opened:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+
+
+def test_update_changes_only_given_columns(storage):
+    _places(storage, "a", "b")
+    rows = storage.table("place").update({"recommendation": "いい店"}).eq("id", 2).execute().data
+
+    assert [(r["id"], r["name"], r["recommendation"]) for r in rows] == [(2, "b", "いい店")]
+    data = storage.table("place").select("name, recommendation, mood").order("id").execute().data
+    assert data == [{"name": "a", "recommendation": None, "mood": "カフェ"},
+                    {"name": "b", "recommendation": "いい店", "mood": "カフェ"}]
+    assert storage.table("place").update({"name": "x"}).eq("id", 99).execute().data == []
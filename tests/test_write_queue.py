@@ -0,0 +1,118 @@
+import sqlite3
+
+import pytest
+
+import exp_stats
+import write_queue
+from write_queue import CheckinQueue
+
+
+@pytest.fixture
+def queue(storage, tmp_path, monkeypatch):
+    monkeypatch.setattr(write_queue, "RETRY_BASE", 0.01)
+    q = CheckinQueue(storage, str(tmp_path / "spool.sqlite3"), flush_interval=0.05, max_attempts=3)
+    yield q
+    q.close(timeout=2)
+
+
+def test_queue_delivers_checkins(storage, queue):
+    ids = [queue.enqueue("abc", place, 10) for place in ("博多駅", "天神", "中洲")]
+
+    assert queue.flush(timeout=5)
+    assert queue.pending() == 0
+    rows = storage.table("records").select("request_id, exp").eq("spell", "abc").execute().data
+    assert sorted(r["request_id"] for r in rows) == sorted(ids)
+    assert exp_stats.get_stats(storage, "abc") == {"total_exp": 30, "level": 0, "visits": 3}
+    assert queue.stats() == {"pending": 0, "sent": 3, "failures": 0, "dead_letter": 0}
+
+
+@pytest.mark.parametrize("spell, place, exp", [
+    ("abc", None, 10),
+    ("abc", "", 10),
+    ("", "博多駅", 10),
+    (None, "博多駅", 10),
+    ("abc", "博多駅", None),
+    ("abc", "博多駅", "10"),
+    ("abc", "博多駅", -5),
+])
+def test_enqueue_rejects_bad_input(queue, spell, place, exp):
+    with pytest.raises(ValueError):
+        queue.enqueue(spell, place, exp)
+    assert queue.pending() == 0
+
+
+def test_queue_moves_failing_row_to_dead_letter(storage, queue, monkeypatch):
+    record_checkins = exp_stats.record_checkins
+
+    def flaky(supabase, rows):
+        if any(r["place"] == "壊れた行" for r in rows):
+            raise RuntimeError("書き込みに失敗しました")
+        return record_checkins(supabase, rows)
+
+    monkeypatch.setattr(exp_stats, "record_checkins", flaky)
+    for place in ("博多駅", "壊れた行", "天神"):
+        queue.enqueue("abc", place, 10)
+
+    # 失敗し続ける行があっても後ろの行は送られる
+    assert queue.flush(timeout=5)
+    places = {r["place"] for r in storage.table("records").select("place").execute().data}
+    assert places == {"博多駅", "天神"}
+    assert queue.dead_letters() == 1
+    assert isinstance(queue.last_error, RuntimeError)
+
+    monkeypatch.setattr(exp_stats, "record_checkins", record_checkins)
+    assert queue.retry_dead_letters() == 1
+    assert queue.flush(timeout=5)
+    assert queue.dead_letters() == 0
+    assert exp_stats.get_stats(storage, "abc")["visits"] == 3
+
+
+def test_queue_survives_spool_errors(storage, queue, monkeypatch):
+    next_batch = queue._next_batch
+    calls = []
+
+    def locked(size):
+        calls.append(size)
+        if len(calls) <= 2:
+            raise sqlite3.OperationalError("database is locked")
+        return next_batch(size)
+
+    monkeypatch.setattr(queue, "_next_batch", locked)
+    queue.enqueue("abc", "博多駅", 10)
+
+    assert queue.flush(timeout=5)
+    assert queue._worker.is_alive()
+    assert isinstance(queue.last_error, sqlite3.OperationalError)
+    assert exp_stats.get_stats(storage, "abc")["visits"] == 1
+
+
+def test_shared_spool_rows_are_claimed_once(storage, tmp_path, monkeypatch):
+    path = str(tmp_path / "shared.sqlite3")
+    a = CheckinQueue(storage, path, flush_interval=60)
+    b = CheckinQueue(storage, path, flush_interval=60)
+    # 裏のスレッドを止めて、_next_batch の取り合いだけを見る
+    for q in (a, b):
+        q._stop = True
+        q._wakeup.set()
+        q._worker.join(2)
+    for place in ("博多駅", "天神", "中洲"):
+        a.enqueue("abc", place, 10)
+
+    first = a._next_batch(2)
+    assert [r[3] for r in first] == ["博多駅", "天神"]
+    # a が取った行は b には渡らない。a はもう一度取り直せる
+    assert [r[3] for r in b._next_batch(10)] == ["中洲"]
+    assert a._next_batch(10) == first
+
+    # a が落ちて期限が切れたら b が引き継ぐ
+    now = write_queue.time.time()
+    monkeypatch.setattr(write_queue.time, "time", lambda: now + write_queue.LEASE + 1)
+    assert [r[3] for r in b._next_batch(10)] == ["博多駅", "天神", "中洲"]
+
+
+def test_record_checkins_ignores_duplicate_request_ids(storage):
+    rows = [{"request_id": "r1", "spell": "abc", "place": "博多駅", "exp": 10}]
+    assert exp_stats.record_checkins(storage, rows) == 1
+    # 再送しても二重に入らない
+    assert exp_stats.record_checkins(storage, rows + [{"request_id": "r2", "spell": "abc", "place": "天神", "exp": 5}]) == 1
+    assert exp_stats.get_stats(storage, "abc") == {"total_exp": 15, "level": 0, "visits": 2}
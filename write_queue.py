@@ -0,0 +1,217 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+
+import exp_stats
+
+# 送信待ちのチェックインを置いておくファイル（プロセスが落ちても消えない）
+SPOOL_PATH = os.getenv("CHECKIN_SPOOL_PATH", os.path.join(".cache", "checkin_spool.sqlite3"))
+BATCH_SIZE = 50          # 1回の書き込みでまとめる最大件数
+FLUSH_INTERVAL = 0.5     # 秒。新しいチェックインが来なくてもこの間隔で送信待ちを確認する
+RETRY_BASE = 1.0         # 秒。失敗したら 1, 2, 4, ... 秒待って再送する
+RETRY_MAX = 60.0         # 秒。再送の待ち時間の上限
+# 1行をこの回数送って失敗したら dead_letter 表へ移し、後ろの行を先に送る（待ち時間の上限と合わせて約 15 分）
+MAX_ATTEMPTS = int(os.getenv("CHECKIN_MAX_ATTEMPTS", "20"))
+# 秒。送る行を取ったプロセスはこの間その行を専有する（落ちたプロセスの行は期限が切れたらほかのプロセスが送る）
+LEASE = 120.0
+
+
+class CheckinQueue:
+    """
+    チェックインをいったん SQLite の送信待ちファイル（spool）に書き、裏のスレッドがまとめて Supabase に送るキュー
+    enqueue() は spool に書いた時点で戻るので、チェックインボタンはすぐに反応する
+    行ごとに request_id（UUID）を付けて送るので、失敗して再送しても二重に経験値が入らない
+    起動時に spool に残っている行（前のプロセスで送れなかった分）から送り始める
+    送信に失敗すると先頭の1行ずつに切り替えて送り直し、max_attempts 回失敗した行は dead_letter 表へ移す
+    （1行がずっと失敗しても後ろの行が詰まらない）。dead_letter の行は retry_dead_letters() で戻せる
+    同じ spool を複数のプロセスで使うときは、送る前に owner と lease_until を書いて行を取るので同じ行を二重に送らない
+    """
+
+    def __init__(self, supabase, path=SPOOL_PATH, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 max_attempts=MAX_ATTEMPTS):
+        self.supabase = supabase
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.sent = 0         # 送信に成功した行数
+        self.failures = 0     # 送信（または spool の読み書き）に失敗した回数
+        self.last_error = None
+        self.owner = str(uuid.uuid4())  # このキューが取った行の印
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS spool ("
+                " seq INTEGER PRIMARY KEY AUTOINCREMENT, request_id TEXT NOT NULL UNIQUE,"
+                " spell TEXT NOT NULL, place TEXT NOT NULL, exp INTEGER NOT NULL, created_at REAL NOT NULL,"
+                " attempts INTEGER NOT NULL DEFAULT 0, last_error TEXT, owner TEXT, lease_until REAL)"
+            )
+            # 送信回数の列が無い古い spool には足す
+            columns = {r[1] for r in conn.execute("PRAGMA table_info(spool)")}
+            if "attempts" not in columns:
+                conn.execute("ALTER TABLE spool ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+            if "last_error" not in columns:
+                conn.execute("ALTER TABLE spool ADD COLUMN last_error TEXT")
+            if "owner" not in columns:
+                conn.execute("ALTER TABLE spool ADD COLUMN owner TEXT")
+                conn.execute("ALTER TABLE spool ADD COLUMN lease_until REAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS dead_letter ("
+                " seq INTEGER PRIMARY KEY, request_id TEXT NOT NULL UNIQUE,"
+                " spell TEXT NOT NULL, place TEXT NOT NULL, exp INTEGER NOT NULL, created_at REAL NOT NULL,"
+                " attempts INTEGER NOT NULL, last_error TEXT, failed_at REAL NOT NULL)"
+            )
+        self._wakeup = threading.Event()
+        self._idle = threading.Condition()
+        self._stop = False
+        self._worker = threading.Thread(target=self._run, name="checkin-queue", daemon=True)
+        self._worker.start()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def enqueue(self, spell, place, exp) -> str:
+        """チェックインを送信待ちに加え、その request_id を返す。spell・place が空か exp が整数でなければ ValueError"""
+        if not isinstance(spell, str) or not spell:
+            raise ValueError(f"じゅもんが空です: {spell!r}")
+        if not isinstance(place, str) or not place:
+            raise ValueError(f"場所が空です: {place!r}")
+        if isinstance(exp, bool) or not isinstance(exp, int) or exp < 0:
+            raise ValueError(f"経験値は 0 以上の整数にしてください: {exp!r}")
+        request_id = str(uuid.uuid4())
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO spool (request_id, spell, place, exp, created_at) VALUES (?, ?, ?, ?, ?)",
+                (request_id, spell, place, exp, time.time())
+            )
+        self._wakeup.set()
+        return request_id
+
+    def pending(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    def pending_ids(self, spell=None) -> set:
+        """まだ送れていない request_id の集合"""
+        with self._connect() as conn:
+            if spell is None:
+                rows = conn.execute("SELECT request_id FROM spool").fetchall()
+            else:
+                rows = conn.execute("SELECT request_id FROM spool WHERE spell = ?", (spell,)).fetchall()
+        return {r[0] for r in rows}
+
+    def flush(self, timeout=None) -> bool:
+        """送信待ちが空になるまで待つ。timeout 秒で空にならなければ False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._wakeup.set()
+        with self._idle:
+            while self.pending():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining if remaining is not None else 1.0)
+        return True
+
+    def close(self, timeout=5.0):
+        self.flush(timeout)
+        self._stop = True
+        self._wakeup.set()
+        self._worker.join(timeout)
+
+    def dead_letters(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+
+    def retry_dead_letters(self) -> int:
+        """dead_letter の行を送信回数 0 で spool の末尾に戻し、戻した行数を返す"""
+        with self._connect() as conn:
+            n = conn.execute(
+                "INSERT INTO spool (request_id, spell, place, exp, created_at)"
+                " SELECT request_id, spell, place, exp, created_at FROM dead_letter ORDER BY seq"
+            ).rowcount
+            conn.execute("DELETE FROM dead_letter")
+        self._wakeup.set()
+        return n
+
+    def _next_batch(self, size):
+        """
+        先頭から size 行を取って返す
+        ほかのプロセスが取っていて期限が切れていない行は飛ばす（自分が取った行はもう一度取り直す）
+        """
+        now = time.time()
+        with self._connect() as conn:
+            # 1つの UPDATE で取るので、ほかのプロセスと同じ行を取り合うことはない
+            conn.execute(
+                "UPDATE spool SET owner = ?, lease_until = ? WHERE seq IN ("
+                " SELECT seq FROM spool WHERE owner IS NULL OR owner = ? OR lease_until < ? ORDER BY seq LIMIT ?)",
+                (self.owner, now + LEASE, self.owner, now, size)
+            )
+            return conn.execute(
+                "SELECT seq, request_id, spell, place, exp FROM spool WHERE owner = ? ORDER BY seq LIMIT ?",
+                (self.owner, size)
+            ).fetchall()
+
+    def _mark_failed(self, batch, error):
+        """batch の行の送信回数を増やし、max_attempts に達した行を dead_letter へ移す"""
+        seqs = [(row[0],) for row in batch]
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE spool SET attempts = attempts + 1, last_error = ? WHERE seq = ?",
+                [(repr(error), seq) for (seq,) in seqs]
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO dead_letter"
+                " SELECT seq, request_id, spell, place, exp, created_at, attempts, last_error, ? FROM spool"
+                " WHERE attempts >= ?",
+                (time.time(), self.max_attempts)
+            )
+            conn.execute("DELETE FROM spool WHERE attempts >= ?", (self.max_attempts,))
+
+    def _run(self):
+        attempt = 0
+        while not self._stop:
+            try:
+                attempt = self._step(attempt)
+            except Exception as e:
+                # 送信の失敗だけでなく spool の読み書きの失敗（ロック待ちの時間切れなど）でもスレッドは止めない
+                self.failures += 1
+                self.last_error = e
+                # 少しずつ間隔を空けて再送する（複数プロセスが同時に再送しないよう揺らぎを入れる）
+                delay = min(RETRY_MAX, RETRY_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+                attempt += 1
+                time.sleep(delay)
+
+    def _step(self, attempt) -> int:
+        """送信待ちを1回分送り、次の attempt を返す。失敗したら例外を投げる"""
+        # 失敗が続いているあいだは先頭の1行だけを送り、失敗している行を切り分ける
+        batch = self._next_batch(self.batch_size if attempt == 0 else 1)
+        if not batch:
+            with self._idle:
+                self._idle.notify_all()
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            return attempt
+
+        rows = [{"request_id": rid, "spell": spell, "place": place, "exp": exp}
+                for _, rid, spell, place, exp in batch]
+        try:
+            exp_stats.record_checkins(self.supabase, rows)
+        except Exception as e:
+            self._mark_failed(batch, e)
+            raise
+
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM spool WHERE seq = ?", [(row[0],) for row in batch])
+        self.sent += len(batch)
+        with self._idle:
+            self._idle.notify_all()
+        return 0
+
+    def stats(self) -> dict:
+        return {"pending": self.pending(), "sent": self.sent, "failures": self.failures,
+                "dead_letter": self.dead_letters()}